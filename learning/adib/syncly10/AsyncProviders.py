@@ -0,0 +1,386 @@
+# --- START OF FILE AsyncProviders.py ---
+
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from abc import abstractmethod
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, AsyncIterator
+from Service import Service, AsyncService, AsyncUpload
+from FileHandler import UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE
+from Executors import run_in
+
+# --- Async HTTP Imports ---
+try:
+    import httpx
+except ImportError: httpx = None; logging.warning("httpx not installed, async provider calls run the sync SDKs on the provider executors...")
+
+logger = logging.getLogger(__name__)
+
+# Shared keep-alive pool for every provider request made from the event loop
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", 200))
+ASYNC_HTTP_MAX_KEEPALIVE = int(os.getenv("ASYNC_HTTP_MAX_KEEPALIVE", 50))
+ASYNC_HTTP_TIMEOUT_SECONDS = float(os.getenv("ASYNC_HTTP_TIMEOUT_SECONDS", 60))
+
+GOOGLE_DRIVE_API = "https://www.googleapis.com/drive/v3"
+GOOGLE_UPLOAD_API = "https://www.googleapis.com/upload/drive/v3"
+DROPBOX_API = "https://api.dropboxapi.com/2"
+DROPBOX_CONTENT_API = "https://content.dropboxapi.com/2"
+
+_http_client = None
+
+
+def get_http_client():
+    """Returns the process-wide httpx.AsyncClient, creating it on first use (inside the running event loop)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_HTTP_MAX_KEEPALIVE)
+        _http_client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(ASYNC_HTTP_TIMEOUT_SECONDS, connect=10.0))
+    return _http_client
+
+
+async def close_http_client():
+    """Closes the shared client's pooled connections (called on API shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _byte_range(start: int, end: Optional[int]) -> Optional[str]:
+    if start == 0 and end is None:
+        return None
+    return f"bytes={start}-{end - 1}" if end is not None else f"bytes={start}-"
+
+
+class _AuthorizedClient(AsyncService):
+    """Bearer-token requests on the shared client; a 401 refreshes the token once and retries."""
+
+    def __init__(self, drive: Service):
+        self.drive = drive
+        self.provider = drive.provider
+        self.bucket_number = drive.bucket_number
+        self._refresh_lock = asyncio.Lock()
+
+    @abstractmethod
+    def _access_token(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _token_expired(self) -> bool:
+        pass
+
+    @abstractmethod
+    def _refresh_token(self):
+        """Blocking refresh through the provider SDK (runs on the provider executor)."""
+        pass
+
+    async def _token(self, force_refresh: bool = False) -> str:
+        if force_refresh or self._token_expired():
+            async with self._refresh_lock:
+                if force_refresh or self._token_expired():
+                    await run_in(self.provider, self._refresh_token)
+                    logger.info(f"Refreshed {self.provider} access token (Bucket {self.bucket_number}).")
+        return self._access_token()
+
+    async def _send(self, method: str, url: str, headers: Optional[Dict] = None, stream: bool = False, **kwargs):
+        """Sends with the bearer token; a 401 (token revoked before its expiry) refreshes it once and retries."""
+        client = get_http_client()
+        for attempt in range(2):
+            request_headers = dict(headers or {}, Authorization=f"Bearer {await self._token(force_refresh=attempt > 0)}")
+            response = await client.send(client.build_request(method, url, headers=request_headers, **kwargs), stream=stream)
+            if response.status_code == 401 and attempt == 0:
+                await response.aclose()
+                continue
+            return response
+
+    async def _request(self, method: str, url: str, ok_statuses=(), headers: Optional[Dict] = None, **kwargs):
+        response = await self._send(method, url, headers, **kwargs)
+        if response.status_code not in ok_statuses:
+            response.raise_for_status()
+        return response
+
+    async def _stream(self, method: str, url: str, headers: Dict, **kwargs) -> AsyncIterator[bytes]:
+        response = await self._send(method, url, headers, stream=True, **kwargs)
+        try:
+            response.raise_for_status()
+            async for block in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                if block: yield block
+        finally:
+            await response.aclose()
+
+
+# --- Google Drive v3 ---
+
+class AsyncGoogleDrive(_AuthorizedClient):
+    """Google Drive v3 REST calls for an authenticated GoogleDrive bucket, using its OAuth credentials."""
+    INTERNAL_FETCH_LIMIT = 200 # Same listing cap as GoogleDrive.listFiles
+
+    @property
+    def _credentials(self):
+        return self.drive.service._http.credentials
+
+    def _access_token(self) -> Optional[str]:
+        return self._credentials.token
+
+    def _token_expired(self) -> bool:
+        return not self._credentials.valid
+
+    def _refresh_token(self):
+        from google.auth.transport.requests import Request
+        self._credentials.refresh(Request())
+
+    async def alist_files(self, query: Optional[str] = None, max_results: Optional[int] = None) -> List[Dict]:
+        query_filter = "trashed = false"
+        if query:
+            safe_query = query.replace("'", "\\'") # Escape single quotes
+            query_filter += f" and name contains '{safe_query}'"
+        limit = min(max_results or self.INTERNAL_FETCH_LIMIT, self.INTERNAL_FETCH_LIMIT)
+        files_list, page_token = [], None
+        while len(files_list) < limit:
+            params = {"q": query_filter, "pageSize": min(limit - len(files_list), 100), "orderBy": "name",
+                      "fields": f"nextPageToken, files({self.drive.CATALOG_FIELDS})"}
+            if page_token: params["pageToken"] = page_token
+            results = (await self._request("GET", f"{GOOGLE_DRIVE_API}/files", params=params)).json()
+            files_list.extend(self.drive._catalog_entry(file) for file in results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if not page_token: break
+        return files_list[:limit]
+
+    async def asearch(self, query: str, limit: int = 10) -> List[Dict]:
+        search_query = self.drive.search_query(query)
+        if not search_query: return []
+        files_list, page_token = [], None
+        try:
+            while len(files_list) < limit:
+                params = {"q": search_query, "pageSize": min(limit - len(files_list), 100), "fields": f"nextPageToken, files({self.drive.SEARCH_FIELDS})"}
+                if page_token: params["pageToken"] = page_token
+                results = (await self._request("GET", f"{GOOGLE_DRIVE_API}/files", params=params)).json()
+                files_list.extend(self.drive._search_entry(file) for file in results.get("files", []))
+                page_token = results.get("nextPageToken")
+                if not page_token: break
+        except httpx.HTTPStatusError as error: logger.error(f"HTTP error during async GDrive search (Bucket {self.bucket_number}): {error}")
+        return files_list[:limit]
+
+    async def acheck_storage(self) -> tuple[int, int]:
+        try:
+            quota = (await self._request("GET", f"{GOOGLE_DRIVE_API}/about", params={"fields": "storageQuota"})).json()["storageQuota"]
+            return int(quota.get("limit", 0)), int(quota.get("usage", 0))
+        except httpx.HTTPError as error: logger.error(f"Error checking Google Drive storage (Bucket {self.bucket_number}): {error}"); return 0, 0
+
+    async def aopen_read(self, file_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        if end is not None and end <= start: return
+        byte_range = _byte_range(start, end)
+        async for block in self._stream("GET", f"{GOOGLE_DRIVE_API}/files/{file_id}", {"Range": byte_range} if byte_range else {}, params={"alt": "media"}):
+            yield block
+
+    async def aopen_write(self, name: str, size: int, mimetype: Optional[str] = None) -> AsyncUpload:
+        response = await self._request("POST", f"{GOOGLE_UPLOAD_API}/files", params={"uploadType": "resumable", "fields": "id"}, json={"name": name},
+                                       headers={"X-Upload-Content-Type": mimetype or "application/octet-stream", "X-Upload-Content-Length": str(size)})
+        return _GoogleUpload(self, response.headers["Location"], name, size)
+
+
+class _GoogleUpload(AsyncUpload):
+    """Resumable upload session: buffered bytes go out in UPLOAD_CHUNK_SIZE PUTs (a multiple of 256 KiB, as Drive requires)."""
+
+    def __init__(self, client: AsyncGoogleDrive, session_url: str, name: str, size: int):
+        self.client, self.session_url, self.name, self.size = client, session_url, name, size
+        self._buffer = bytearray()
+        self._offset = 0
+
+    async def _put(self, length: int):
+        chunk = bytes(self._buffer[:length]); del self._buffer[:length]
+        content_range = f"bytes {self._offset}-{self._offset + length - 1}/{self.size}" if length else f"bytes */{self.size}"
+        response = await self.client._request("PUT", self.session_url, ok_statuses=(308,), content=chunk, headers={"Content-Range": content_range})
+        self._offset += length
+        return response
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        # The last chunk is sent by close(), which is when Drive creates the file
+        while len(self._buffer) >= UPLOAD_CHUNK_SIZE and self._offset + UPLOAD_CHUNK_SIZE < self.size:
+            await self._put(UPLOAD_CHUNK_SIZE)
+            logger.debug(f"Uploading '{self.name}' to Google Drive (Bucket {self.client.bucket_number}): {self._offset}/{self.size} bytes")
+
+    async def close(self) -> Dict:
+        if self._offset + len(self._buffer) != self.size:
+            raise ValueError(f"Upload of '{self.name}' received {self._offset + len(self._buffer)} bytes, expected {self.size}")
+        response = await self._put(len(self._buffer))
+        return {"file_id": response.json().get("id"), "path": None, "size": self.size}
+
+
+# --- Dropbox v2 ---
+
+class AsyncDropbox(_AuthorizedClient):
+    """Dropbox v2 HTTP endpoints for an authenticated DropboxService bucket, sharing the SDK client's tokens."""
+
+    def _access_token(self) -> Optional[str]:
+        return self.drive.service._oauth2_access_token
+
+    def _token_expired(self) -> bool:
+        expiration = getattr(self.drive.service, "_oauth2_access_token_expiration", None)
+        return bool(expiration) and datetime.utcnow() + timedelta(minutes=5) >= expiration
+
+    def _refresh_token(self):
+        self.drive.service.refresh_access_token()
+
+    async def _rpc(self, route: str, arguments: Optional[Dict] = None) -> Dict:
+        return (await self._request("POST", f"{DROPBOX_API}/{route}", json=arguments)).json()
+
+    def _entry(self, metadata: Dict) -> Dict:
+        """Same fields as DropboxService._catalog_entry, from the JSON metadata."""
+        return {
+            "id": metadata.get("id"), "name": metadata.get("name"), "size": metadata.get("size"), "mimeType": None,
+            "modifiedTime": metadata.get("server_modified"), "content_hash": metadata.get("content_hash"),
+            "path_lower": metadata.get("path_lower"), "path": f"dropbox:{metadata.get('path_lower')}",
+            "provider": "Dropbox", "bucket": self.bucket_number,
+        }
+
+    async def alist_files(self, query: Optional[str] = None, max_results: Optional[int] = None) -> List[Dict]:
+        """Root folder listing like DropboxService.listFiles, with stable dropbox: paths instead of a temporary link per file."""
+        files_list = []
+        result = await self._rpc("files/list_folder", {"path": "", "recursive": False})
+        while True:
+            for entry in result.get("entries", []):
+                if entry.get(".tag") != "file" or (query and query.lower() not in entry.get("name", "").lower()): continue
+                files_list.append(self._entry(entry))
+                if max_results and len(files_list) >= max_results: return files_list
+            if not result.get("has_more"): return files_list
+            result = await self._rpc("files/list_folder/continue", {"cursor": result["cursor"]})
+
+    async def _temporary_link(self, metadata: Dict) -> str:
+        try: return (await self._rpc("files/get_temporary_link", {"path": metadata["path_display"]}))["link"]
+        except httpx.HTTPStatusError as link_err: logger.debug(f"Could not get temp link for {metadata.get('name')}: {link_err}."); return f"dropbox:{metadata.get('path_lower')}"
+
+    async def atemporary_link(self, file_id: str) -> str:
+        """Same as DropboxService.temporaryLink; errors are raised."""
+        return (await self._rpc("files/get_temporary_link", {"path": file_id}))["link"]
+
+    async def asearch(self, query: str, limit: int = 10) -> List[Dict]:
+        try:
+            result = await self._rpc("files/search_v2", {"query": query, "options": {"max_results": min(limit * 2, 100), "order_by": "relevance", "file_status": "active"}})
+        except httpx.HTTPStatusError as err: logger.error(f"Dropbox API error during async search (Bucket {self.bucket_number}): {err}"); return []
+        matches = [match["metadata"]["metadata"] for match in result.get("matches", []) if match.get("metadata", {}).get("metadata", {}).get(".tag") == "file"][:limit]
+        links = await asyncio.gather(*(self._temporary_link(metadata) for metadata in matches)) # One round trip for all links
+        access_token = self._access_token()
+        return [{"id": metadata.get("id"), "name": metadata.get("name"), "size": metadata.get("size"),
+                 "path_lower": metadata.get("path_lower"), "path": link, "provider": "Dropbox", "bucket": self.bucket_number,
+                 "revision": metadata.get("content_hash") or metadata.get("rev"), "access_token": access_token}
+                for metadata, link in zip(matches, links)]
+
+    async def acheck_storage(self) -> tuple[int, int]:
+        try:
+            usage = await self._rpc("users/get_space_usage")
+            return usage.get("allocation", {}).get("allocated", 0), usage.get("used", 0)
+        except httpx.HTTPError as err: logger.error(f"Dropbox API error checking storage (Bucket {self.bucket_number}): {err}"); return 0, 0
+
+    async def aopen_read(self, file_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        if end is not None and end <= start: return
+        headers = {"Dropbox-API-Arg": json.dumps({"path": file_id})}
+        byte_range = _byte_range(start, end)
+        if byte_range: headers["Range"] = byte_range
+        async for block in self._stream("POST", f"{DROPBOX_CONTENT_API}/files/download", headers):
+            yield block
+
+    async def aopen_write(self, name: str, size: int, mimetype: Optional[str] = None) -> AsyncUpload:
+        return _DropboxUpload(self, f"/{name}", size)
+
+
+class _DropboxUpload(AsyncUpload):
+    """Single files/upload up to UPLOAD_CHUNK_SIZE, otherwise an upload session (start / append_v2 / finish)."""
+
+    def __init__(self, client: AsyncDropbox, path: str, size: int):
+        self.client, self.path, self.size = client, path, size
+        self._buffer = bytearray()
+        self._session_id: Optional[str] = None
+        self._offset = 0
+
+    async def _content(self, route: str, arguments: Dict, data: bytes) -> Dict:
+        response = await self.client._request("POST", f"{DROPBOX_CONTENT_API}/{route}", content=data,
+                                              headers={"Dropbox-API-Arg": json.dumps(arguments), "Content-Type": "application/octet-stream"})
+        return response.json() if response.content else {} # append_v2 has no result
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= UPLOAD_CHUNK_SIZE and self._offset + UPLOAD_CHUNK_SIZE < self.size:
+            chunk = bytes(self._buffer[:UPLOAD_CHUNK_SIZE]); del self._buffer[:UPLOAD_CHUNK_SIZE]
+            if self._session_id is None: self._session_id = (await self._content("files/upload_session/start", {}, chunk))["session_id"]
+            else: await self._content("files/upload_session/append_v2", {"cursor": {"session_id": self._session_id, "offset": self._offset}}, chunk)
+            self._offset += len(chunk)
+            logger.debug(f"Uploading '{self.path}' to Dropbox (Bucket {self.client.bucket_number}): {self._offset}/{self.size} bytes")
+
+    async def close(self) -> Dict:
+        if self._offset + len(self._buffer) != self.size:
+            raise ValueError(f"Upload of '{self.path}' received {self._offset + len(self._buffer)} bytes, expected {self.size}")
+        commit = {"path": self.path, "mode": "add", "autorename": True} # Never replace an object a manifest may share
+        if self._session_id is None: metadata = await self._content("files/upload", commit, bytes(self._buffer))
+        else: metadata = await self._content("files/upload_session/finish", {"cursor": {"session_id": self._session_id, "offset": self._offset}, "commit": commit}, bytes(self._buffer))
+        self._buffer.clear()
+        return {"file_id": metadata.get("id"), "name": metadata.get("name"), "path": metadata.get("path_display"), "size": metadata.get("size")}
+
+
+# --- Thread-backed fallback ---
+
+class ThreadedAsyncService(AsyncService):
+    """AsyncService over the sync SDK implementation: every call runs on the provider's executor (see Executors)."""
+
+    def __init__(self, drive: Service):
+        self.drive = drive
+        self.provider = drive.provider
+        self.bucket_number = drive.bucket_number
+
+    async def alist_files(self, query: Optional[str] = None, max_results: Optional[int] = None) -> List[Dict]:
+        return await run_in(self.provider, self.drive.listFiles, query=query, max_results=max_results)
+
+    async def asearch(self, query: str, limit: int = 10) -> List[Dict]:
+        return await run_in(self.provider, self.drive.searchFiles, query, limit)
+
+    async def acheck_storage(self) -> tuple[int, int]:
+        return await run_in(self.provider, self.drive.check_storage)
+
+    async def atemporary_link(self, file_id: str) -> str:
+        return await run_in(self.provider, self.drive.temporaryLink, file_id) # Dropbox buckets only
+
+    async def aopen_read(self, file_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        blocks = self.drive.iterDownload(file_id, start, end)
+        while True:
+            block = await run_in(self.provider, next, blocks, None)
+            if block is None: return
+            yield block
+
+    async def aopen_write(self, name: str, size: int, mimetype: Optional[str] = None) -> AsyncUpload:
+        return _SpooledUpload(self, name, size, mimetype)
+
+
+class _SpooledUpload(AsyncUpload):
+    """Collects the bytes in a spooled temp file and hands it to Service.uploadStream on close()."""
+
+    def __init__(self, owner: ThreadedAsyncService, name: str, size: int, mimetype: Optional[str]):
+        self.owner, self.name, self.size, self.mimetype = owner, name, size, mimetype
+        self._file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)
+
+    async def write(self, data: bytes):
+        await run_in(self.owner.provider, self._file.write, data) # May spill to disk
+
+    async def close(self) -> Dict:
+        try:
+            self._file.seek(0)
+            return await run_in(self.owner.provider, self.owner.drive.uploadStream, self._file, self.name, self.size, self.mimetype)
+        finally: self._file.close()
+
+
+NATIVE_ASYNC_SERVICES = {"GoogleDrive": AsyncGoogleDrive, "Dropbox": AsyncDropbox}
+
+
+def async_service_for(drive: Service, native: bool = True) -> AsyncService:
+    """
+    Async client for an authenticated bucket: the native httpx implementation when native is set
+    and httpx is installed, otherwise the sync SDK on the provider executor.
+    """
+    if native and httpx is not None and drive.provider in NATIVE_ASYNC_SERVICES:
+        return NATIVE_ASYNC_SERVICES[drive.provider](drive)
+    return ThreadedAsyncService(drive)
+
+# --- END OF FILE AsyncProviders.py ---
@@ -8,6 +8,9 @@ from dropbox.oauth import DropboxOAuth2Flow
 import dropbox
 import logging
 from Database import Database
+from ClientRegistry import get_dropbox_client, discard_dropbox_client, get_google_drive_service
+from TokenRefresher import TokenRefresher, expiry_to_str
+from DiscoveryCache import build_drive_service
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 
@@ -68,21 +71,26 @@ class AuthManager:
     def authenticate_google_drive(self, bucket_number, credentials_file="credentials.json"):
         """Authenticate with Google Drive using PKCE and refresh tokens"""
         SCOPES = ['https://www.googleapis.com/auth/drive']
-        token_data = self.db.tokens_collection.find_one({
+        # Credentials kept fresh by the TokenRefresher: no token lookup or refresh on this path
+        refresher = TokenRefresher.get_instance()
+        creds = refresher.lookup(self.user_id, bucket_number, "GoogleDrive")
+        token_data = None if creds else self.db.tokens_collection.find_one({
             "user_id": self.user_id, 
             "bucket_number": bucket_number,
             "service_type": "GoogleDrive"
         })
         
-        creds = None
         if token_data:
             try:
-                creds = Credentials.from_authorized_user_info(token_data)
+                # Saved as access_token, google-auth reads token
+                creds = Credentials.from_authorized_user_info({**token_data, "token": token_data.get("token") or token_data.get("access_token")})
                 if creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
+                    creds.refresh(Request()) # Only when nothing refreshed it ahead of time (e.g. first load after a restart)
+                    self._save_token(bucket_number, "GoogleDrive", {"access_token": creds.token, "expiry": expiry_to_str(creds.expiry)})
             except Exception as e:
                 logger.error(f"Error loading/refreshing Google Drive token: {e}")
                 creds = None
+                self._invalidate_pooled_drives("Google Drive token refresh failed")
 
         if not creds or not creds.valid:
             logger.info("Starting Google Drive authentication...")
@@ -98,17 +106,24 @@ class AuthManager:
                 "client_id": creds.client_id,
                 "client_secret": creds.client_secret,
                 "token_uri": creds.token_uri,
-                "scopes": creds.scopes
+                "scopes": creds.scopes,
+                "expiry": expiry_to_str(creds.expiry)
             }
             
             self._save_token(bucket_number, "GoogleDrive", token_data)
             logger.info("Google Drive authentication successful.")
         
-        from googleapiclient.discovery import build
-        return build("drive", "v3", credentials=creds)
+        # Reuses the service (and its open connection) already built for this credential; new ones come from the cached discovery document
+        service = get_google_drive_service(creds, build_drive_service)
+        refresher.register(self.user_id, bucket_number, "GoogleDrive", service._http.credentials) # The credentials the service actually uses
+        return service
     
     def authenticate_dropbox(self, bucket_number, app_key, app_secret):
         """Authenticate with Dropbox using a browser-based flow"""
+        refresher = TokenRefresher.get_instance()
+        dbx = refresher.lookup(self.user_id, bucket_number, "Dropbox")
+        if dbx is not None:
+            return dbx
         token_data = self.db.tokens_collection.find_one({
             "user_id": self.user_id, 
             "bucket_number": bucket_number,
@@ -118,18 +133,26 @@ class AuthManager:
         dbx = None
         if token_data:
             try:
-                dbx = dropbox.Dropbox(
-                    oauth2_access_token=token_data.get("access_token"),
-                    oauth2_refresh_token=token_data.get("refresh_token"),
+                dbx = get_dropbox_client(
+                    access_token=token_data.get("access_token"),
+                    refresh_token=token_data.get("refresh_token"),
                     app_key=app_key,
-                    app_secret=app_secret
+                    app_secret=app_secret,
+                    expiration=token_data.get("expires_at")
                 )
-                dbx.users_get_current_account()
+                if token_data.get("refresh_token") and not token_data.get("expires_at"):
+                    dbx.refresh_access_token() # Saved before expiry was tracked: refresh once so the refresher can schedule it
+                dbx.users_get_current_account() # The SDK refreshes first if the saved token has expired
+                if dbx._oauth2_access_token != token_data.get("access_token"):
+                    self._save_token(bucket_number, "Dropbox", {"access_token": dbx._oauth2_access_token, "expires_at": dbx._oauth2_access_token_expiration})
+                refresher.register(self.user_id, bucket_number, "Dropbox", dbx)
                 logger.info("Dropbox client initialized from saved token.")
                 return dbx
             except Exception as e:
                 logger.error(f"Error with Dropbox token: {e}")
+                discard_dropbox_client(access_token=token_data.get("access_token"), refresh_token=token_data.get("refresh_token"), app_key=app_key)
                 dbx = None
+                self._invalidate_pooled_drives("Dropbox token refresh failed")
         
         logger.info("Starting Dropbox authentication...")
         auth_flow = DropboxOAuth2Flow(
@@ -176,18 +199,21 @@ class AuthManager:
                 "service_type": "Dropbox",
                 "access_token": oauth_result.access_token,
                 "refresh_token": oauth_result.refresh_token,
+                "expires_at": oauth_result.expires_at,
                 "app_key": app_key,
                 "app_secret": app_secret
             }
             
             self._save_token(bucket_number, "Dropbox", token_data)
             
-            dbx = dropbox.Dropbox(
-                oauth2_access_token=oauth_result.access_token,
-                oauth2_refresh_token=oauth_result.refresh_token,
+            dbx = get_dropbox_client(
+                access_token=oauth_result.access_token,
+                refresh_token=oauth_result.refresh_token,
                 app_key=app_key,
-                app_secret=app_secret
+                app_secret=app_secret,
+                expiration=oauth_result.expires_at
             )
+            refresher.register(self.user_id, bucket_number, "Dropbox", dbx)
             logger.info("Dropbox authentication successful.")
             return dbx
         except Exception as e:
@@ -201,11 +227,10 @@ class AuthManager:
             {"$set": token_data},
             upsert=True
         )
-    
-    def _save_token(self, bucket_number, service_type, token_data):
-        """Save tokens to MongoDB"""
-        self.db.tokens_collection.update_one(
-            {"user_id": self.user_id, "bucket_number": bucket_number, "service_type": service_type},
-            {"$set": token_data},
-            upsert=True
-        )
\ No newline at end of file
+
+    def _invalidate_pooled_drives(self, reason):
+        """Drop the user's pooled DriveManager so stale clients are not reused"""
+        if self.user_id is None:
+            return
+        from DrivePool import invalidate_drive_manager
+        invalidate_drive_manager(self.user_id, reason)
\ No newline at end of file
@@ -0,0 +1,603 @@
+# --- START OF FILE ChunkTransfer.py ---
+
+import io
+import os
+import math
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple, Callable, Iterator
+
+from Service import Service
+from Database import Database
+
+logger = logging.getLogger(__name__)
+
+# Largest chunk placed in one bucket; bigger free space is filled with several chunks
+SPLIT_MAX_CHUNK_SIZE = int(os.getenv("SPLIT_MAX_CHUNK_MB", 1024)) * 1024 * 1024
+# Space left free in every bucket so quota drift does not fail the last chunk
+SPLIT_FREE_SPACE_MARGIN = int(os.getenv("SPLIT_FREE_SPACE_MARGIN_MB", 16)) * 1024 * 1024
+# Parallel chunk uploads: total workers, and uploads in flight per bucket (provider rate limits)
+CHUNK_UPLOAD_WORKERS = int(os.getenv("CHUNK_UPLOAD_WORKERS", 8))
+CHUNK_UPLOADS_PER_BUCKET = int(os.getenv("CHUNK_UPLOADS_PER_BUCKET", 2))
+CHUNK_UPLOAD_RETRIES = int(os.getenv("CHUNK_UPLOAD_RETRIES", 3))
+CHUNK_RETRY_BACKOFF_SECONDS = float(os.getenv("CHUNK_RETRY_BACKOFF_SECONDS", 2))
+# Chunking mode for split uploads: "fixed" (pack by free space) or "cdc" (content-defined, block-level dedup)
+SPLIT_CHUNKING_MODE = os.getenv("SPLIT_CHUNKING_MODE", "fixed").lower()
+# Content-defined chunk bounds; average holds for binary data (text with dense newlines cuts somewhat smaller)
+CDC_MIN_SIZE = int(os.getenv("CDC_MIN_CHUNK_MB", 4)) * 1024 * 1024
+CDC_AVG_SIZE = int(os.getenv("CDC_AVG_CHUNK_MB", 16)) * 1024 * 1024
+CDC_MAX_SIZE = int(os.getenv("CDC_MAX_CHUNK_MB", 64)) * 1024 * 1024
+# In cdc mode, files at least this large go through the chunked pipeline even if one bucket could hold them
+CDC_MIN_FILE_SIZE = int(os.getenv("CDC_MIN_FILE_MB", 64)) * 1024 * 1024
+CDC_MAX_VERSIONS = int(os.getenv("CDC_MAX_VERSIONS", 10)) # Previous versions kept per file name
+CDC_ANCHOR = b"\n" # Candidate cut points; frequent in text, ~1/256 of positions in binary data
+CDC_WINDOW = 48 # Bytes hashed at a candidate to decide on a cut
+
+# Parallel chunk downloads when reassembling split files
+CHUNK_DOWNLOAD_WORKERS = int(os.getenv("CHUNK_DOWNLOAD_WORKERS", 8))
+CHUNK_DOWNLOADS_PER_BUCKET = int(os.getenv("CHUNK_DOWNLOADS_PER_BUCKET", 2))
+
+
+def chunk_name(file_name: str, index: int) -> str:
+    """Name of the index-th chunk, matching the .partN convention DriveManager.parse_part_info understands."""
+    return f"{file_name}.part{index}"
+
+
+class RangeReader(io.IOBase):
+    """
+    Read-only, seekable view of [offset, offset + length) of a shared source stream.
+    Every read seeks the source under a lock, so several readers (one per chunk)
+    can share one file object without copying the range to a temporary file.
+    """
+    def __init__(self, source, offset: int, length: int, lock: Optional[threading.Lock] = None, on_read: Optional[Callable[[int], None]] = None):
+        self._source = source
+        self._offset = offset
+        self._length = length
+        self._position = 0
+        self._lock = lock or threading.Lock()
+        self._on_read = on_read # Called with the new position after every read
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET: position = offset
+        elif whence == io.SEEK_CUR: position = self._position + offset
+        elif whence == io.SEEK_END: position = self._length + offset
+        else: raise ValueError(f"Invalid whence: {whence}")
+        self._position = max(0, min(position, self._length))
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        with self._lock:
+            self._source.seek(self._offset + self._position)
+            data = self._source.read(size)
+        self._position += len(data)
+        if self._on_read: self._on_read(self._position)
+        return data
+
+
+def plan_chunks(file_size: int, buckets: List[Tuple[int, Service]]) -> List[Dict]:
+    """
+    Packs a file into chunks over buckets given as [(free_bytes, drive)], largest free space first.
+    Each bucket receives consecutive chunks of at most SPLIT_MAX_CHUNK_SIZE until its free space
+    (minus SPLIT_FREE_SPACE_MARGIN) is used. Raises ValueError when the buckets cannot hold the file.
+    :return: [{"index", "offset", "size", "drive"}] covering the file in order.
+    """
+    plan = []
+    offset = 0
+    for free, drive in sorted(buckets, key=lambda x: x[0], reverse=True):
+        usable = free - SPLIT_FREE_SPACE_MARGIN
+        while usable > 0 and offset < file_size:
+            size = min(usable, file_size - offset, SPLIT_MAX_CHUNK_SIZE)
+            plan.append({"index": len(plan), "offset": offset, "size": size, "drive": drive})
+            offset += size
+            usable -= size
+        if offset >= file_size:
+            break
+    if offset < file_size:
+        raise ValueError(f"Not enough storage space across connected drives: {file_size - offset} bytes do not fit.")
+    return plan
+
+
+def use_chunked_upload(file_size: int) -> bool:
+    """True when a file should go through ChunkUploader even though a single bucket could hold it."""
+    return SPLIT_CHUNKING_MODE == "cdc" and file_size >= CDC_MIN_FILE_SIZE
+
+
+BLOCK_NAME_PREFIX = "syncly-block-"
+
+
+def block_name(sha256: str) -> str:
+    """Content-addressed object name for cdc blocks; never overwritten with different bytes."""
+    return f"{BLOCK_NAME_PREFIX}{sha256}"
+
+
+def is_block_name(name: Optional[str]) -> bool:
+    """True for cdc block objects, which are storage internals and never listed as user files."""
+    return bool(name) and name.startswith(BLOCK_NAME_PREFIX)
+
+
+def manifest_refs(doc: Dict) -> List[Dict]:
+    """Every chunk entry a manifest references, current version and kept versions."""
+    chunks = list(doc.get("chunks") or [])
+    for version in doc.get("versions") or []: chunks.extend(version.get("chunks") or [])
+    return chunks
+
+
+def is_logical_file(manifest: Dict) -> bool:
+    """True when a manifest's name is not itself a stored object (split, cdc or deduplicated files)."""
+    chunks = manifest.get("chunks") or []
+    return len(chunks) != 1 or chunks[0].get("chunk_name") != manifest.get("file_name")
+
+
+def _find_cut(buf: bytes, mask: int) -> int:
+    """
+    Returns the length of the next content-defined chunk at the start of buf.
+    Candidates are CDC_ANCHOR bytes past CDC_MIN_SIZE (located with bytes.find, so the scan runs in C);
+    a candidate is a cut when the CRC32 of the CDC_WINDOW bytes ending there matches the mask.
+    """
+    limit = min(len(buf), CDC_MAX_SIZE)
+    if limit <= CDC_MIN_SIZE:
+        return limit
+    position = buf.find(CDC_ANCHOR, CDC_MIN_SIZE, limit)
+    while position != -1:
+        if zlib.crc32(buf[position - CDC_WINDOW + 1:position + 1]) & mask == 0:
+            return position + 1
+        position = buf.find(CDC_ANCHOR, position + 1, limit)
+    return limit
+
+
+def cdc_blocks(stream, file_size: int) -> Iterator[Tuple[int, int, str]]:
+    """
+    Yields (offset, size, sha256) of content-defined blocks of a seekable stream.
+    Cut points depend only on nearby content, so an insertion or edit changes the blocks around
+    it and later boundaries line up again. At most CDC_MAX_SIZE bytes are buffered.
+    """
+    # One candidate per ~256 bytes in binary data: choose the mask so cuts land ~CDC_AVG_SIZE apart
+    mask = (1 << max(0, int(math.log2(max(CDC_AVG_SIZE - CDC_MIN_SIZE, 256) / 256)))) - 1
+    stream.seek(0)
+    offset = 0
+    buf = b""
+    while offset < file_size:
+        if len(buf) < CDC_MAX_SIZE:
+            buf += stream.read(min(CDC_MAX_SIZE - len(buf), file_size - offset - len(buf)))
+        if not buf:
+            break
+        cut = _find_cut(buf, mask)
+        yield offset, cut, hashlib.sha256(buf[:cut]).hexdigest()
+        offset += cut
+        buf = buf[cut:]
+    stream.seek(0)
+
+
+def assign_blocks(parts: List[Dict], buckets: List[Tuple[int, Service]]) -> List[Dict]:
+    """
+    Places each new block in the bucket with the most remaining free space, which also spreads
+    blocks over accounts for parallel upload. Raises ValueError when a block fits nowhere.
+    """
+    remaining = [[free - SPLIT_FREE_SPACE_MARGIN, drive] for free, drive in buckets]
+    for part in parts:
+        target = max(remaining, key=lambda b: b[0], default=None)
+        if target is None or target[0] < part["size"]:
+            raise ValueError(f"Not enough storage space across connected drives for a {part['size']} byte block.")
+        part["drive"] = target[1]
+        target[0] -= part["size"]
+    return parts
+
+
+def interleave_by_bucket(plan: List[Dict]) -> List[Dict]:
+    """Reorders a chunk plan round-robin over buckets so parallel workers start on different accounts."""
+    queues: Dict[Tuple[str, int], List[Dict]] = {}
+    for part in plan:
+        queues.setdefault((part["drive"].provider, part["drive"].bucket_number), []).append(part)
+    ordered = []
+    while queues:
+        for key in list(queues):
+            ordered.append(queues[key].pop(0))
+            if not queues[key]: del queues[key]
+    return ordered
+
+
+class _TransferProgress:
+    """Aggregates bytes transferred over all chunks; a retried chunk does not count its bytes twice."""
+    def __init__(self, total: int, callback: Optional[Callable[[int, int], None]]):
+        self.total = total
+        self.callback = callback
+        self._sent: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def update(self, index: int, position: int):
+        with self._lock:
+            if position <= self._sent.get(index, 0):
+                return
+            self._sent[index] = position
+            done = sum(self._sent.values())
+        if self.callback:
+            try: self.callback(done, self.total)
+            except Exception as e: logger.debug(f"Upload progress callback failed: {e}")
+
+
+class ChunkUploader:
+    """
+    Splits a file across every connected Google Drive and Dropbox bucket by free space.
+    Chunks are streamed straight from byte ranges of the source (no .partN temp files)
+    and uploaded in parallel, and the chunk manifest is stored in metadata_collection
+    so the file can be reassembled.
+    """
+    def __init__(self, drive_manager):
+        self.drive_manager = drive_manager
+        self.db = Database().get_instance()
+
+    def _free_buckets(self) -> List[Tuple[int, Service]]:
+        buckets = []
+        for drive, quota in self.drive_manager.get_drive_quotas():
+            if quota and getattr(drive, 'service', None) and getattr(drive, 'bucket_number', None) is not None:
+                limit, usage = quota
+                if limit - usage > 0:
+                    buckets.append((limit - usage, drive))
+        return buckets
+
+    def plan(self, file_size: int) -> List[Dict]:
+        """Returns the chunk plan for a file of file_size bytes over the user's current free space."""
+        return plan_chunks(file_size, self._free_buckets())
+
+    def upload(self, stream, file_name: str, mimetype: Optional[str], file_size: int, metadata: Optional[Dict] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """
+        Uploads file_size bytes of a seekable stream as chunks and saves the manifest.
+        If any chunk fails for good, chunks already uploaded are deleted and the error is raised.
+        :param progress: Optional callback(bytes_sent, total_bytes), called from worker threads.
+        :return: The metadata document, with one entry per chunk in "chunks".
+        """
+        user_id = getattr(self.drive_manager, 'user_id', None)
+        if not user_id:
+            raise Exception("User context missing for metadata.")
+
+        if SPLIT_CHUNKING_MODE == "cdc":
+            plan, reused, duplicates = self.plan_cdc(stream, file_size)
+            single = False
+            logger.info(f"Uploading '{file_name}' ({file_size} bytes) as {len(plan) + len(reused) + len(duplicates)} content-defined block(s) "
+                        f"for user {user_id}: {len(plan)} new, {len(reused) + len(duplicates)} reused")
+        else:
+            plan, reused, duplicates = self.plan(file_size), [], []
+            single = len(plan) == 1
+            logger.info(f"Uploading '{file_name}' ({file_size} bytes) as {len(plan)} chunk(s) for user {user_id}")
+
+        uploaded = self._upload_chunks(stream, file_name, mimetype, file_size, plan, single, progress) if plan else []
+        try:
+            # Blocks repeated inside this file point at the copy uploaded (or reused) for their first occurrence
+            by_hash = {chunk["sha256"]: chunk for chunk in uploaded + reused if chunk.get("sha256")}
+            chunks = uploaded + reused + [dict(by_hash[part["sha256"]], index=part["index"], offset=part["offset"]) for part in duplicates]
+            chunks.sort(key=lambda c: c["index"])
+
+            manifest = dict(metadata or {})
+            manifest.update({"user_id": user_id, "file_name": file_name, "file_size": file_size, "mimetype": mimetype,
+                             "split": not single, "chunking": "cdc" if SPLIT_CHUNKING_MODE == "cdc" else "fixed",
+                             "uploaded_at": datetime.utcnow(), "chunks": chunks})
+            self._save_manifest(manifest)
+        except Exception as e:
+            # Reused blocks belong to other manifests; only this upload's chunks are removed
+            logger.error(f"Saving the manifest of '{file_name}' failed, removing {len(uploaded)} uploaded chunk(s): {e}")
+            self._rollback(uploaded)
+            raise
+        return manifest
+
+    def plan_cdc(self, stream, file_size: int) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """
+        Splits the stream into content-defined blocks and sorts them into:
+        - new blocks to upload (placed on buckets by free space),
+        - chunk entries reused from blocks already stored in any bucket (any file, any version),
+        - repeats of a block that occurs earlier in this same file.
+        """
+        blocks = list(cdc_blocks(stream, file_size))
+        known = self._known_blocks({sha for _, _, sha in blocks})
+        new_parts, reused, duplicates, seen = [], [], [], set()
+        for index, (offset, size, sha) in enumerate(blocks):
+            part = {"index": index, "offset": offset, "size": size, "sha256": sha}
+            if sha in seen:
+                duplicates.append(part)
+            elif sha in known:
+                reused.append(dict(known[sha], index=index, offset=offset))
+            else:
+                new_parts.append(part)
+            seen.add(sha)
+        return assign_blocks(new_parts, self._free_buckets()), reused, duplicates
+
+    def _known_blocks(self, hashes) -> Dict[str, Dict]:
+        """Maps block sha256 -> stored chunk entry for blocks this user already has in a connected bucket."""
+        if not hashes or self.db is None or self.db.metadata_collection is None:
+            return {}
+        connected = {(drive.provider, drive.bucket_number) for drive in self.drive_manager.drives}
+        known = {}
+        query = {"user_id": self.drive_manager.user_id, "$or": [{"chunks.sha256": {"$in": list(hashes)}}, {"versions.chunks.sha256": {"$in": list(hashes)}}]}
+        for doc in self.db.metadata_collection.find(query, {"chunks": 1, "versions.chunks": 1}):
+            for chunk in manifest_refs(doc):
+                sha = chunk.get("sha256")
+                if sha in hashes and sha not in known and (chunk.get("provider"), chunk.get("bucket")) in connected:
+                    known[sha] = {key: chunk.get(key) for key in ("chunk_name", "size", "provider", "bucket", "file_id", "path", "sha256")}
+        return known
+
+    def _upload_chunks(self, stream, file_name, mimetype, file_size, plan, single, progress) -> List[Dict]:
+        """
+        Uploads the planned chunks on a bounded pool, at most CHUNK_UPLOADS_PER_BUCKET per bucket,
+        so throughput grows with the number of connected accounts. Returns chunks in file order.
+        """
+        lock = threading.Lock() # Serializes seek+read on the shared source
+        tracker = _TransferProgress(file_size, progress)
+        bucket_slots = {(part["drive"].provider, part["drive"].bucket_number): threading.BoundedSemaphore(CHUNK_UPLOADS_PER_BUCKET) for part in plan}
+        cancelled = threading.Event()
+        started_at = time.monotonic()
+
+        def _run(part):
+            with bucket_slots[(part["drive"].provider, part["drive"].bucket_number)]:
+                if cancelled.is_set():
+                    return None
+                return self._upload_chunk_with_retry(stream, lock, file_name, mimetype, part, single, tracker, cancelled)
+
+        workers = max(1, min(CHUNK_UPLOAD_WORKERS, len(plan)))
+        chunks = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-upload") as executor:
+            futures = [executor.submit(_run, part) for part in interleave_by_bucket(plan)]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            failure = next((f.exception() for f in done if f.exception() is not None), None)
+            if failure is not None:
+                cancelled.set()
+                for future in not_done: future.cancel()
+                wait(not_done) # Let in-flight chunks finish so they can be rolled back too
+            for future in futures:
+                if future.done() and not future.cancelled() and future.exception() is None and future.result():
+                    chunks.append(future.result())
+
+        if failure is not None:
+            logger.error(f"Chunk upload of '{file_name}' failed, removing {len(chunks)} uploaded chunk(s): {failure}")
+            self._rollback(chunks)
+            raise failure
+
+        chunks.sort(key=lambda c: c["index"])
+        elapsed = time.monotonic() - started_at
+        logger.info(f"Uploaded {len(chunks)} chunk(s) of '{file_name}' with {workers} worker(s) in {elapsed:.2f}s "
+                    f"({file_size / max(elapsed, 1e-6) / 1024**2:.1f} MB/s)")
+        return chunks
+
+    def _upload_chunk_with_retry(self, stream, lock, file_name, mimetype, part, single, tracker, cancelled) -> Dict:
+        """Uploads one chunk, retrying with exponential backoff before giving up."""
+        attempt = 0
+        while True:
+            try:
+                return self._upload_chunk(stream, lock, file_name, mimetype, part, single, tracker)
+            except Exception as e:
+                attempt += 1
+                if attempt > CHUNK_UPLOAD_RETRIES or cancelled.is_set():
+                    raise
+                delay = CHUNK_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning(f"Chunk {part['index']} of '{file_name}' failed (attempt {attempt}/{CHUNK_UPLOAD_RETRIES + 1}): {e}. Retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _upload_chunk(self, stream, lock, file_name, mimetype, part, single, tracker) -> Dict:
+        drive = part["drive"]
+        if "sha256" in part: name = block_name(part["sha256"])
+        else: name = file_name if single else chunk_name(file_name, part["index"])
+        reader = RangeReader(stream, part["offset"], part["size"], lock, on_read=lambda position: tracker.update(part["index"], position))
+        logger.info(f"Uploading chunk {part['index']} of '{file_name}' ({part['size']} bytes at offset {part['offset']}) to {drive.provider} Bucket {drive.bucket_number}")
+        result = drive.uploadStream(reader, name, part["size"], mimetype if single else "application/octet-stream")
+        self.drive_manager.record_upload(drive.bucket_number, part["size"])
+        chunk = {"chunk_name": result.get("name") or name, "index": part["index"], "offset": part["offset"], "size": part["size"],
+                 "provider": drive.provider, "bucket": drive.bucket_number, "file_id": result["file_id"], "path": result.get("path")}
+        if "sha256" in part: chunk["sha256"] = part["sha256"]
+        return chunk
+
+    def _rollback(self, chunks: List[Dict]):
+        """Deletes already uploaded chunks so a failed split does not leave orphans behind."""
+        drives = {(drive.provider, drive.bucket_number): drive for drive in self.drive_manager.drives}
+        for chunk in chunks:
+            drive = drives.get((chunk["provider"], chunk["bucket"]))
+            if drive is None or not drive.deleteFile(chunk["file_id"]):
+                logger.warning(f"Could not remove orphaned chunk '{chunk['chunk_name']}' from {chunk['provider']} Bucket {chunk['bucket']}")
+            else:
+                self.drive_manager.record_upload(chunk["bucket"], -chunk["size"])
+
+    def _save_manifest(self, manifest: Dict):
+        if self.db is None or self.db.metadata_collection is None:
+            logger.error("Database connection or metadata_collection not initialized. Cannot save chunk manifest.")
+            return
+        key = {"user_id": manifest["user_id"], "file_name": manifest["file_name"]}
+        update = {"$set": manifest, "$unset": {"dedup_of": ""}}
+        previous = self.db.metadata_collection.find_one(key)
+        # Content-addressed blocks are never overwritten, so the previous cdc version stays rebuildable
+        if previous and previous.get("chunks") and all(c.get("sha256") for c in previous["chunks"]) \
+                and previous.get("content_sha256") != manifest.get("content_sha256"):
+            version = {field: previous.get(field) for field in ("file_size", "mimetype", "content_sha256", "uploaded_at", "chunks")}
+            update["$push"] = {"versions": {"$each": [version], "$slice": -CDC_MAX_VERSIONS}}
+        self.db.metadata_collection.update_one(key, update, upsert=True)
+        logger.info(f"Chunk manifest saved for file: {manifest['file_name']} ({len(manifest['chunks'])} chunks)")
+        if previous:
+            try: self.release_unreferenced(previous, key)
+            except Exception as e: logger.warning(f"Cleanup of chunks no longer used by '{manifest['file_name']}' failed: {e}")
+
+    def release_unreferenced(self, previous: Dict, key: Dict):
+        """
+        Deletes the objects Syncly stored for the previous manifest of a re-uploaded name (cdc blocks, chunks, or the
+        single object of a plain upload) that no manifest of the user references any more: replaced objects and those
+        of versions pruned past CDC_MAX_VERSIONS. A dedup alias owns nothing but blocks, since it may point at files
+        Syncly never stored. Reference counts are the manifests (including aliases) still pointing at an object's file id.
+        """
+        current = self.db.metadata_collection.find_one(key, {"chunks": 1, "versions.chunks": 1}) or {}
+        kept = {(c.get("provider"), c.get("bucket"), c.get("file_id")) for c in manifest_refs(current)}
+        candidates = {}
+        for chunk in manifest_refs(previous):
+            ref = (chunk.get("provider"), chunk.get("bucket"), chunk.get("file_id"))
+            owned = is_block_name(chunk.get("chunk_name")) or not previous.get("dedup_of")
+            if chunk.get("file_id") and owned and ref not in kept: candidates[ref] = chunk
+        orphans = [chunk for chunk in candidates.values() if not self.db.metadata_collection.count_documents(
+            {"user_id": key["user_id"], "$or": [{"chunks.file_id": chunk["file_id"]}, {"versions.chunks.file_id": chunk["file_id"]}]}, limit=1)]
+        if orphans:
+            logger.info(f"Removing {len(orphans)} chunk(s) of '{key['file_name']}' no longer referenced by any manifest")
+            self._rollback(orphans)
+
+
+class ChunkAssembler:
+    """
+    Rebuilds a file from its metadata_collection chunk manifest.
+    Chunks are fetched concurrently from their buckets and each block is written straight
+    to its offset in a preallocated output file, so no per-chunk temp files are created
+    and every byte is written to disk exactly once.
+    """
+    def __init__(self, drive_manager):
+        self.drive_manager = drive_manager
+        self.db = Database().get_instance()
+
+    def find_manifest(self, file_name: str) -> Optional[Dict]:
+        """Returns the stored manifest for one of the user's files, or None."""
+        if self.db is None or self.db.metadata_collection is None:
+            return None
+        manifest = self.db.metadata_collection.find_one({"user_id": self.drive_manager.user_id, "file_name": file_name})
+        return manifest if manifest and manifest.get("chunks") else None
+
+    def _drive_for(self, chunk: Dict) -> Service:
+        for drive in self.drive_manager.drives:
+            if drive.provider == chunk.get("provider") and drive.bucket_number == chunk.get("bucket") and drive.service:
+                return drive
+        raise LookupError(f"{chunk.get('provider')} Bucket {chunk.get('bucket')} holding '{chunk.get('chunk_name')}' is not connected.")
+
+    @staticmethod
+    def version_manifest(manifest: Dict, version: Optional[int]) -> Dict:
+        """
+        Returns the manifest of an older version of a cdc file: 1 is the previous upload, 2 the one before, ...
+        None or 0 means the current version. Raises LookupError for versions that are not kept.
+        """
+        if not version:
+            return manifest
+        versions = manifest.get("versions", [])
+        if version > len(versions):
+            raise LookupError(f"Version {version} of '{manifest.get('file_name')}' is not available ({len(versions)} kept).")
+        return dict(versions[-version], file_name=manifest.get("file_name"))
+
+    @staticmethod
+    def _chunk_ref(chunk: Dict) -> str:
+        # Dropbox manifests also carry the path; ids work for both providers
+        return chunk.get("file_id") or chunk.get("path")
+
+    @staticmethod
+    def _overlapping(chunks: List[Dict], start: int, end: Optional[int]) -> Iterator[Dict]:
+        for chunk in chunks:
+            if end is not None and chunk["offset"] >= end:
+                break
+            if chunk["offset"] + chunk["size"] > start:
+                yield chunk
+
+    def check_available(self, manifest: Dict, start: int = 0, end: Optional[int] = None):
+        """Raises LookupError unless every bucket holding a chunk of [start, end) is connected."""
+        chunks = sorted(manifest["chunks"], key=lambda c: c.get("index", 0))
+        for chunk in chunks if len(chunks) == 1 else self._overlapping(chunks, start, end):
+            self._drive_for(chunk)
+
+    def iter_range(self, manifest: Dict, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields bytes [start, end) of the file described by the manifest, in order, fetching only
+        the chunks (and the part of each chunk) that overlap the range. Nothing touches the disk.
+        """
+        chunks = sorted(manifest["chunks"], key=lambda c: c.get("index", 0))
+        if len(chunks) == 1:
+            chunk = chunks[0]
+            yield from self._drive_for(chunk).iterDownload(self._chunk_ref(chunk), start=start, end=end)
+            return
+        for chunk in self._overlapping(chunks, start, end):
+            chunk_start = chunk["offset"]; chunk_end = chunk_start + chunk["size"]
+            local_start = max(start, chunk_start) - chunk_start
+            local_end = (min(end, chunk_end) if end is not None else chunk_end) - chunk_start
+            yield from self._drive_for(chunk).iterDownload(self._chunk_ref(chunk), start=local_start, end=local_end)
+
+    def assemble(self, manifest: Dict, output_path: str, progress: Optional[Callable[[int, int], None]] = None) -> str:
+        """
+        Downloads every chunk of the manifest into output_path.
+        The file is built as output_path + ".partial" and renamed once complete.
+        :return: output_path
+        """
+        chunks = sorted(manifest["chunks"], key=lambda c: c.get("index", 0))
+        # Manifests written before offsets were recorded hold a single whole-file chunk
+        if len(chunks) > 1 and any(c.get("offset") is None or c.get("size") is None for c in chunks):
+            raise ValueError(f"Manifest for '{manifest.get('file_name')}' has no chunk offsets; cannot reassemble.")
+        file_size = manifest.get("file_size") or sum(c.get("size") or 0 for c in chunks)
+        temp_path = output_path + ".partial"
+        tracker = _TransferProgress(file_size, progress)
+        bucket_slots = {(c.get("provider"), c.get("bucket")): threading.BoundedSemaphore(CHUNK_DOWNLOADS_PER_BUCKET) for c in chunks}
+        write_lock = threading.Lock() # Only used where os.pwrite is unavailable (Windows)
+        started_at = time.monotonic()
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(temp_path, "wb") as output:
+            if file_size: output.truncate(file_size) # Preallocate so every chunk can be written in place
+            fd = output.fileno()
+
+            def _write_at(data: bytes, offset: int):
+                if hasattr(os, "pwrite"):
+                    while data:
+                        written = os.pwrite(fd, data, offset)
+                        data = data[written:]; offset += written
+                else:
+                    with write_lock:
+                        output.seek(offset); output.write(data); output.flush()
+
+            def _run(chunk):
+                with bucket_slots[(chunk.get("provider"), chunk.get("bucket"))]:
+                    return self._download_chunk_with_retry(chunk, _write_at, tracker)
+
+            workers = max(1, min(CHUNK_DOWNLOAD_WORKERS, len(chunks)))
+            try:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-download") as executor:
+                    futures = [executor.submit(_run, chunk) for chunk in chunks]
+                    for future in futures: future.result()
+            except Exception:
+                output.close()
+                try: os.remove(temp_path)
+                except OSError: pass
+                raise
+
+        os.replace(temp_path, output_path)
+        elapsed = time.monotonic() - started_at
+        logger.info(f"Reassembled '{manifest.get('file_name')}' from {len(chunks)} chunk(s) with {workers} worker(s) in {elapsed:.2f}s "
+                    f"({file_size / max(elapsed, 1e-6) / 1024**2:.1f} MB/s)")
+        return output_path
+
+    def _download_chunk_with_retry(self, chunk: Dict, write_at, tracker: _TransferProgress):
+        """Downloads one chunk; a retry resumes from the last byte written instead of starting over."""
+        drive = self._drive_for(chunk)
+        base = chunk.get("offset") or 0
+        size = chunk.get("size")
+        written = 0
+        attempt = 0
+        while True:
+            try:
+                for block in drive.iterDownload(self._chunk_ref(chunk), start=written, end=size):
+                    write_at(block, base + written)
+                    written += len(block)
+                    tracker.update(chunk.get("index", 0), written)
+                if size is not None and written < size:
+                    raise IOError(f"Chunk '{chunk.get('chunk_name')}' ended after {written} of {size} bytes")
+                return written
+            except Exception as e:
+                attempt += 1
+                if attempt > CHUNK_UPLOAD_RETRIES:
+                    raise
+                delay = CHUNK_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning(f"Download of chunk '{chunk.get('chunk_name')}' failed at byte {written} (attempt {attempt}/{CHUNK_UPLOAD_RETRIES + 1}): {e}. Retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+# --- END OF FILE ChunkTransfer.py ---
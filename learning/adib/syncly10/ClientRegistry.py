@@ -0,0 +1,147 @@
+# --- START OF FILE ClientRegistry.py ---
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+import dropbox
+from groq import Groq
+
+logger = logging.getLogger(__name__)
+
+# Connections kept alive in the shared Dropbox session (all Dropbox clients and temporary-link downloads use it)
+DROPBOX_POOL_CONNECTIONS = int(os.getenv("DROPBOX_POOL_CONNECTIONS", 32))
+# Clients kept per provider, one per credential; the least recently used are dropped beyond this
+CLIENT_REGISTRY_MAX_CLIENTS = int(os.getenv("CLIENT_REGISTRY_MAX_CLIENTS", 512))
+# Google transports (open connections) kept per executor thread; the least recently used are closed beyond this
+GOOGLE_THREAD_HTTP_MAX = int(os.getenv("GOOGLE_THREAD_HTTP_MAX", 16))
+
+
+class _LRURegistry:
+    """Thread-safe credential -> client map with LRU eviction."""
+
+    def __init__(self, name: str, max_size: int = CLIENT_REGISTRY_MAX_CLIENTS):
+        self.name = name
+        self.max_size = max_size
+        self._clients: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+        client = create() # Outside the lock: may do network I/O
+        with self._lock:
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._clients.pop(key, None)
+
+
+_dropbox_clients = _LRURegistry("dropbox")
+_google_services = _LRURegistry("google")
+_groq_clients = _LRURegistry("groq", max_size=4)
+_dropbox_session = None
+_dropbox_session_lock = threading.Lock()
+_google_http_local = threading.local()
+_google_generations: Dict[Hashable, int] = {} # Bumped when a credential is discarded, so threads drop their transport for it
+_google_generations_lock = threading.Lock()
+
+
+# --- Dropbox ---
+
+def get_dropbox_session():
+    """The process-wide requests session (keep-alive pool) shared by every Dropbox client."""
+    global _dropbox_session
+    with _dropbox_session_lock:
+        if _dropbox_session is None:
+            _dropbox_session = dropbox.create_session(max_connections=DROPBOX_POOL_CONNECTIONS)
+        return _dropbox_session
+
+
+def get_dropbox_client(access_token: Optional[str] = None, refresh_token: Optional[str] = None,
+                       app_key: Optional[str] = None, app_secret: Optional[str] = None, expiration: Optional[datetime] = None) -> dropbox.Dropbox:
+    """
+    Returns the Dropbox client for a credential, creating it on first use. Clients with a refresh
+    token are keyed by it (their access token changes on refresh), others by the access token.
+    """
+    key = ("refresh", refresh_token, app_key) if refresh_token else ("access", access_token)
+    return _dropbox_clients.get_or_create(key, lambda: dropbox.Dropbox(
+        oauth2_access_token=access_token, oauth2_refresh_token=refresh_token, oauth2_access_token_expiration=expiration,
+        app_key=app_key, app_secret=app_secret, session=get_dropbox_session()))
+
+
+def discard_dropbox_client(access_token: Optional[str] = None, refresh_token: Optional[str] = None, app_key: Optional[str] = None):
+    """Forgets a client whose credential was rejected, so the next lookup builds a fresh one."""
+    _dropbox_clients.discard(("refresh", refresh_token, app_key) if refresh_token else ("access", access_token))
+
+
+# --- Google Drive ---
+
+def _google_key(credentials) -> Hashable:
+    return (credentials.client_id, credentials.refresh_token) if getattr(credentials, "refresh_token", None) else id(credentials)
+
+
+def get_google_drive_service(credentials, build_service: Callable[[Any], Any]):
+    """
+    Returns the Drive service built for this credential (build_service(credentials) on first use).
+    The service keeps its authorized transport, and with it the open connection, across DriveManager rebuilds.
+    """
+    return _google_services.get_or_create(_google_key(credentials), lambda: build_service(credentials))
+
+
+def discard_google_drive_service(credentials):
+    key = _google_key(credentials)
+    _google_services.discard(key)
+    with _google_generations_lock:
+        _google_generations[key] = _google_generations.get(key, 0) + 1
+
+
+def _close_transport(http):
+    try: http.http.close()
+    except Exception as e: logger.debug(f"Closing Google transport failed: {e}")
+
+
+def google_thread_http(credentials):
+    """
+    Authorized httplib2 transport for the calling thread and credential. httplib2 is not thread-safe,
+    so each executor thread keeps its own connection per credential and reuses it across requests.
+    Each thread keeps at most GOOGLE_THREAD_HTTP_MAX transports (LRU); transports of discarded
+    credentials are replaced on their next use.
+    """
+    transports = getattr(_google_http_local, "transports", None)
+    if transports is None:
+        transports = _google_http_local.transports = OrderedDict()
+    key = _google_key(credentials)
+    generation = _google_generations.get(key, 0)
+    entry = transports.get(key)
+    if entry is not None and entry[0] == generation and entry[1].credentials is credentials:
+        transports.move_to_end(key)
+        return entry[1]
+    if entry is not None:
+        _close_transport(transports.pop(key)[1])
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    http = AuthorizedHttp(credentials, http=httplib2.Http())
+    transports[key] = (generation, http)
+    while len(transports) > GOOGLE_THREAD_HTTP_MAX:
+        _close_transport(transports.popitem(last=False)[1][1])
+    return http
+
+
+# --- Groq ---
+
+def get_groq_client(api_key: str) -> Groq:
+    """One Groq client (and its httpx connection pool) per API key for the whole process."""
+    return _groq_clients.get_or_create(api_key, lambda: Groq(api_key=api_key))
+
+# --- END OF FILE ClientRegistry.py ---
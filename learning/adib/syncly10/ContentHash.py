@@ -0,0 +1,119 @@
+# --- START OF FILE ContentHash.py ---
+
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from Database import Database
+from FileHandler import DOWNLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Dropbox content_hash: SHA-256 over the concatenated SHA-256 digests of 4 MB blocks
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def compute_content_hashes(stream) -> Dict[str, str]:
+    """
+    Hashes a seekable stream in one pass and rewinds it.
+    Returns the SHA-256 used for Syncly's own dedup index, plus the MD5 (Google Drive md5Checksum)
+    and Dropbox content_hash so files already stored at the providers can be matched too.
+    """
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    dropbox_blocks = hashlib.sha256()
+    block = hashlib.sha256()
+    block_filled = 0
+
+    stream.seek(0)
+    while True:
+        data = stream.read(DOWNLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        sha256.update(data)
+        md5.update(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), DROPBOX_HASH_BLOCK_SIZE - block_filled)
+            block.update(view[:take])
+            block_filled += take
+            view = view[take:]
+            if block_filled == DROPBOX_HASH_BLOCK_SIZE:
+                dropbox_blocks.update(block.digest())
+                block = hashlib.sha256()
+                block_filled = 0
+    if block_filled:
+        dropbox_blocks.update(block.digest())
+    stream.seek(0)
+
+    return {"content_sha256": sha256.hexdigest(), "content_md5": md5.hexdigest(), "dropbox_content_hash": dropbox_blocks.hexdigest()}
+
+
+class ContentDedup:
+    """
+    Per-user content-hash -> manifest index over metadata_collection (indexed on user_id + content_sha256),
+    with the file catalog's md5Checksum / content_hash as a second source for files not uploaded by Syncly.
+    A hit records the new name as a manifest pointing at the already stored chunks, so nothing is uploaded.
+    """
+    def __init__(self, drive_manager):
+        self.drive_manager = drive_manager
+        self.db = Database().get_instance()
+
+    def find_existing(self, hashes: Dict[str, str], file_size: int) -> Optional[Dict]:
+        """Returns a manifest-shaped document for stored content identical to hashes, or None."""
+        user_id = self.drive_manager.user_id
+        if self.db.metadata_collection is not None:
+            manifest = self.db.metadata_collection.find_one(
+                {"user_id": user_id, "content_sha256": hashes["content_sha256"], "file_size": file_size, "chunks.0": {"$exists": True}})
+            if manifest and self._chunks_reachable(manifest["chunks"]):
+                return manifest
+        if self.db.file_index_collection is not None:
+            doc = self.db.file_index_collection.find_one({"user_id": user_id, "size": file_size, "$or": [
+                {"provider": "Dropbox", "content_hash": hashes["dropbox_content_hash"]},
+                {"provider": "GoogleDrive", "md5Checksum": hashes["content_md5"]},
+            ]})
+            if doc:
+                chunk = {"chunk_name": doc.get("name"), "index": 0, "offset": 0, "size": doc.get("size"), "provider": doc.get("provider"),
+                         "bucket": doc.get("bucket"), "file_id": doc.get("file_id"), "path": doc.get("path_lower")}
+                if self._chunks_reachable([chunk]):
+                    return {"file_name": doc.get("name"), "file_size": doc.get("size"), "mimetype": doc.get("mimeType"), "chunks": [chunk]}
+        return None
+
+    def _chunks_reachable(self, chunks) -> bool:
+        # Only reuse content whose buckets are still connected
+        connected = {(drive.provider, drive.bucket_number) for drive in self.drive_manager.drives}
+        return all((chunk.get("provider"), chunk.get("bucket")) in connected for chunk in chunks)
+
+    def link(self, file_name: str, mimetype: Optional[str], existing: Dict, hashes: Dict[str, str]) -> Dict:
+        """Stores file_name as a new manifest sharing existing's chunks and returns it."""
+        manifest = {"user_id": self.drive_manager.user_id, "file_name": file_name, "file_size": existing.get("file_size"),
+                    "mimetype": mimetype or existing.get("mimetype"), "split": len(existing["chunks"]) > 1,
+                    "chunks": existing["chunks"], "dedup_of": existing.get("file_name"), **hashes}
+        self.db.metadata_collection.update_one(
+            {"user_id": manifest["user_id"], "file_name": file_name},
+            {"$set": manifest},
+            upsert=True
+        )
+        logger.info(f"Deduplicated '{file_name}': same content as '{existing.get('file_name')}', no upload needed.")
+        return manifest
+
+    def check(self, stream, file_name: str, mimetype: Optional[str], file_size: int) -> Tuple[Optional[Dict], Dict[str, str]]:
+        """
+        Hashes the stream and links file_name to identical stored content if there is any.
+        :return: (linked manifest or None, hashes to store with a fresh upload)
+        """
+        hashes = compute_content_hashes(stream)
+        try:
+            existing = self.find_existing(hashes, file_size)
+        except Exception as e:
+            logger.warning(f"Dedup lookup failed for '{file_name}', uploading normally: {e}")
+            return None, hashes
+        if existing is None:
+            return None, hashes
+        if existing.get("file_name") == file_name and "user_id" in existing:
+            # This name already has a manifest for the same content: nothing to record
+            logger.info(f"'{file_name}' is already stored with identical content, skipping upload.")
+            return {**existing, "dedup_of": existing.get("dedup_of") or file_name}, hashes
+        return self.link(file_name, mimetype, existing, hashes), hashes
+
+# --- END OF FILE ContentHash.py ---
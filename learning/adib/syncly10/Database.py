@@ -31,6 +31,11 @@ class Database:
                 # --- Add the new collection attribute ---
                 cls._instance.pending_links_collection = cls._instance.db['pending_links'] # For bot auth links
                 # --- End Add ---
+                cls._instance.file_index_collection = cls._instance.db['file_index'] # Catalog of files across buckets
+                cls._instance.file_index_state_collection = cls._instance.db['file_index_state'] # Per-bucket indexer state
+                cls._instance.extraction_cache_collection = cls._instance.db['extraction_cache'] # Extracted text for /llm/ask
+                cls._instance.search_index_collection = cls._instance.db['search_index'] # BM25 term frequencies per file
+                cls._instance.vector_index_collection = cls._instance.db['vector_index'] # Passage embeddings per file
 
             except ConnectionFailure as e:
                 logger.error(f"Failed to connect to MongoDB at {mongo_uri}: {e}")
@@ -42,6 +47,11 @@ class Database:
                 cls._instance.metadata_collection = None
                 cls._instance.drives_collection = None
                 cls._instance.pending_links_collection = None
+                cls._instance.file_index_collection = None
+                cls._instance.file_index_state_collection = None
+                cls._instance.extraction_cache_collection = None
+                cls._instance.search_index_collection = None
+                cls._instance.vector_index_collection = None
                 # Should probably exit or raise here in a real app
             except Exception as e: # Catch other potential errors during init
                  logger.error(f"An unexpected error occurred during Database initialization: {e}", exc_info=True)
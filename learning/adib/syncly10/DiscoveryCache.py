@@ -0,0 +1,68 @@
+# --- START OF FILE DiscoveryCache.py ---
+
+import os
+import json
+import time
+import logging
+import threading
+import urllib.request
+from typing import Dict, Optional
+from googleapiclient.discovery import build, build_from_document
+
+# --- Bundled Discovery Documents ---
+try:
+    from googleapiclient.discovery_cache import get_static_doc
+except ImportError: get_static_doc = None; logging.warning("google-api-python-client has no bundled discovery documents, Drive's will be downloaded once...")
+
+logger = logging.getLogger(__name__)
+
+# A discovery document here overrides the bundled one (and is where a downloaded one is kept)
+DISCOVERY_CACHE_DIR = os.getenv("DISCOVERY_CACHE_DIR", "discovery_cache")
+DRIVE_DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+
+_documents: Dict[str, Dict] = {}
+_documents_lock = threading.Lock()
+
+
+def _load_document(service_name: str, version: str) -> Optional[Dict]:
+    path = os.path.join(DISCOVERY_CACHE_DIR, f"{service_name}.{version}.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    content = get_static_doc(service_name, version) if get_static_doc else None
+    if content:
+        return json.loads(content)
+    if (service_name, version) != ("drive", "v3"):
+        return None
+    # Neither cached nor bundled: download once and keep it for later restarts
+    with urllib.request.urlopen(DRIVE_DISCOVERY_URL, timeout=10) as response:
+        content = response.read().decode("utf-8")
+    os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return json.loads(content)
+
+
+def discovery_document(service_name: str = "drive", version: str = "v3") -> Optional[Dict]:
+    """The parsed discovery document, read once per process (None if it is unavailable)."""
+    key = f"{service_name}.{version}"
+    with _documents_lock:
+        if key not in _documents:
+            started_at = time.perf_counter()
+            try: _documents[key] = _load_document(service_name, version)
+            except Exception as e: logger.error(f"Could not load discovery document {key}: {e}"); _documents[key] = None
+            if _documents[key]: logger.info(f"Loaded discovery document {key} in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        return _documents[key]
+
+
+def build_drive_service(credentials):
+    """
+    Drive v3 service for a credential, built from the cached discovery document so no JSON is read
+    or parsed per bucket. All services share the parsed document (and its schemas).
+    """
+    document = discovery_document("drive", "v3")
+    if document is None:
+        return build("drive", "v3", credentials=credentials) # Cache unavailable: let the client library find it
+    return build_from_document(document, credentials=credentials)
+
+# --- END OF FILE DiscoveryCache.py ---
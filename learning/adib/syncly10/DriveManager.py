@@ -2,22 +2,48 @@
 
 import os
 import re
-from Service import Service
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+from Service import Service, AsyncService
 from Database import Database
 from GoogleDrive import GoogleDrive
 from Dropbox import DropboxService
 from AuthManager import AuthManager
+from QuotaCache import QuotaCache
+from FileIndex import FileIndex, FileIndexer
+from SearchIndex import SearchIndex, SearchIndexer
+from Executors import get_executor, run_in
+from AsyncProviders import async_service_for
+from ChunkTransfer import is_block_name
 import logging # Added logging
-from typing import List, Dict, Optional # Added typing imports
+from typing import List, Dict, Optional, Tuple, Iterable # Added typing imports
 
 logger = logging.getLogger(__name__) # Added logger
 
+# Bucket loading limits
+DRIVE_LOAD_WORKERS = int(os.getenv("DRIVE_LOAD_WORKERS", 8))
+DRIVE_LOAD_TIMEOUT_SECONDS = float(os.getenv("DRIVE_LOAD_TIMEOUT_SECONDS", 20))
+# Live searches of all buckets share this deadline; later buckets are reported as partial
+SEARCH_FANOUT_DEADLINE_SECONDS = float(os.getenv("SEARCH_FANOUT_DEADLINE_SECONDS", 2.5))
+# Hits scoring at least this (see _search_score) count towards stopping the fan-out early: half the query terms
+# in the name of a bucket's top result, more of them further down its list (a name holding every term always counts)
+SEARCH_STRONG_HIT_SCORE = 2.0
+# Dropbox temporary links last four hours; listings reuse one for this long
+DROPBOX_LINK_TTL_SECONDS = float(os.getenv("DROPBOX_LINK_TTL_SECONDS", 3 * 3600))
+# Provider clients behind the async methods (alist_files, asearch_files_with_status):
+# "native" = AsyncProviders over the shared httpx client, "threads" = the sync SDKs on the provider executors
+ASYNC_PROVIDER_CLIENTS = os.getenv("ASYNC_PROVIDER_CLIENTS", "native")
+
 class DriveManager:
     def __init__(self, user_id, token_dir="tokens"):
         self.user_id = user_id
         self.drives: List[Service] = [] # Added type hint
         self.token_dir = token_dir
         self.sorted_buckets = []
+        self.degraded_buckets: List[Dict] = [] # Buckets that failed or timed out while loading
+        self._async_services: Dict[Tuple[str, int], AsyncService] = {}
+        self._dropbox_links: Dict[Tuple[int, str], Tuple[str, float]] = {} # (bucket, file id) -> (temporary link, expiry)
         os.makedirs(self.token_dir, exist_ok=True)
         # AuthManager is generally not needed directly here after initialization,
         # as authentication happens when loading drives.
@@ -25,54 +51,115 @@ class DriveManager:
         self.load_user_drives()
 
     def load_user_drives(self):
-        """Loads and authenticates drives associated with the user_id."""
+        """
+        Loads and authenticates drives associated with the user_id.
+        Up to DRIVE_LOAD_WORKERS buckets are authenticated at once, so cold start costs
+        roughly the slowest bucket instead of the sum of all of them. Each bucket gets
+        DRIVE_LOAD_TIMEOUT_SECONDS from the moment it starts; one that fails or runs over
+        is recorded in self.degraded_buckets instead of stalling the whole user, and its
+        slot goes to the next queued bucket.
+        """
         db = Database().get_instance()
-        user_drives = db.drives_collection.find({"user_id": self.user_id})
-        loaded_drives_count = 0
-        for drive_data in user_drives:
-            drive_instance = None
+        user_drives = list(db.drives_collection.find({"user_id": self.user_id}))
+        if not user_drives:
+            logger.info(f"No drives configured for User ID: {self.user_id}")
+            return
+
+        started_at = time.monotonic()
+        queued = list(user_drives)
+        running: Dict = {} # future -> (drive_data, deadline)
+        finished, timed_out = [], []
+        # One thread per bucket at most: a stuck bucket keeps its thread, but not its slot
+        executor = ThreadPoolExecutor(max_workers=len(user_drives), thread_name_prefix="drive-load")
+        try:
+            while queued or running:
+                while queued and len(running) < max(1, DRIVE_LOAD_WORKERS):
+                    drive_data = queued.pop(0)
+                    running[executor.submit(self._load_drive, drive_data)] = (drive_data, time.monotonic() + DRIVE_LOAD_TIMEOUT_SECONDS)
+                next_deadline = min(deadline for _, deadline in running.values())
+                done, _ = wait(running, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished.append((future, running.pop(future)[0]))
+                now = time.monotonic()
+                for future, (drive_data, deadline) in list(running.items()):
+                    if deadline <= now and not future.done():
+                        del running[future]; timed_out.append(drive_data)
+        finally:
+            # Do not wait for stuck buckets; their threads finish (or fail) on their own
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        loaded = []
+        for future, drive_data in finished:
             try:
-                bucket_num = drive_data['bucket_number']
-                drive_type = drive_data['type']
-                logger.info(f"Loading drive: Type={drive_type}, Bucket={bucket_num} for User ID: {self.user_id}")
-
-                if drive_type == 'GoogleDrive':
-                    gd = GoogleDrive(token_dir=self.token_dir, credentials_file="credentials.json")
-                    # Authentication happens here
-                    if gd.authenticate(bucket_num, self.user_id):
-                         drive_instance = gd
-                    else:
-                         logger.error(f"Failed to authenticate GoogleDrive Bucket {bucket_num} for User ID: {self.user_id}")
-
-                elif drive_type == 'Dropbox':
-                    # Ensure app_key and app_secret are present
-                    app_key = drive_data.get('app_key')
-                    app_secret = drive_data.get('app_secret')
-                    if not app_key or not app_secret:
-                        logger.error(f"Dropbox Bucket {bucket_num} for User ID: {self.user_id} is missing app_key or app_secret in database.")
-                        continue # Skip this drive
-
-                    dbx = DropboxService(token_dir=self.token_dir, app_key=app_key, app_secret=app_secret)
-                     # Authentication happens here
-                    if dbx.authenticate(bucket_num, self.user_id):
-                         drive_instance = dbx
-                    else:
-                         logger.error(f"Failed to authenticate Dropbox Bucket {bucket_num} for User ID: {self.user_id}")
+                drive_instance, elapsed = future.result()
+            except Exception as e:
+                logger.error(f"Error loading drive for user {self.user_id}, data {drive_data}: {e}", exc_info=True)
+                drive_instance, elapsed = None, None
+            if drive_instance:
+                loaded.append((drive_data.get('bucket_number', 0), drive_instance))
+            else:
+                self.degraded_buckets.append({"bucket_number": drive_data.get('bucket_number'), "type": drive_data.get('type'), "reason": "failed", "seconds": elapsed})
+
+        for drive_data in timed_out:
+            logger.warning(f"Timed out after {DRIVE_LOAD_TIMEOUT_SECONDS}s loading {drive_data.get('type')} Bucket {drive_data.get('bucket_number')} for User ID: {self.user_id}. Marking as degraded.")
+            self.degraded_buckets.append({"bucket_number": drive_data.get('bucket_number'), "type": drive_data.get('type'), "reason": "timeout", "seconds": DRIVE_LOAD_TIMEOUT_SECONDS})
+
+        # Keep drives in bucket order so "Drive Number" stays stable between requests
+        loaded.sort(key=lambda x: x[0])
+        self.drives.extend(drive for _, drive in loaded)
+
+        logger.info(f"Finished loading drives for User ID: {self.user_id} in {time.monotonic() - started_at:.2f}s. "
+                    f"Total loaded: {len(loaded)}, degraded: {len(self.degraded_buckets)}")
 
+    def _load_drive(self, drive_data):
+        """
+        Authenticates a single bucket described by a drives_collection document.
+        :return: A tuple of (authenticated drive instance or None, seconds spent).
+        """
+        started_at = time.monotonic()
+        drive_instance = None
+        try:
+            bucket_num = drive_data['bucket_number']
+            drive_type = drive_data['type']
+            logger.info(f"Loading drive: Type={drive_type}, Bucket={bucket_num} for User ID: {self.user_id}")
+
+            if drive_type == 'GoogleDrive':
+                gd = GoogleDrive(token_dir=self.token_dir, credentials_file="credentials.json")
+                # Authentication happens here
+                if gd.authenticate(bucket_num, self.user_id):
+                     drive_instance = gd
                 else:
-                     logger.warning(f"Unknown drive type '{drive_type}' found for user {self.user_id}, bucket {bucket_num}")
+                     logger.error(f"Failed to authenticate GoogleDrive Bucket {bucket_num} for User ID: {self.user_id}")
+
+            elif drive_type == 'Dropbox':
+                # Ensure app_key and app_secret are present
+                app_key = drive_data.get('app_key')
+                app_secret = drive_data.get('app_secret')
+                if not app_key or not app_secret:
+                    logger.error(f"Dropbox Bucket {bucket_num} for User ID: {self.user_id} is missing app_key or app_secret in database.")
+                    return None, time.monotonic() - started_at
+
+                dbx = DropboxService(token_dir=self.token_dir, app_key=app_key, app_secret=app_secret)
+                 # Authentication happens here
+                if dbx.authenticate(bucket_num, self.user_id):
+                     drive_instance = dbx
+                else:
+                     logger.error(f"Failed to authenticate Dropbox Bucket {bucket_num} for User ID: {self.user_id}")
 
-                if drive_instance:
-                    self.drives.append(drive_instance)
-                    loaded_drives_count += 1
-                    logger.info(f"Successfully loaded and authenticated {drive_type} Bucket {bucket_num}")
+            else:
+                 logger.warning(f"Unknown drive type '{drive_type}' found for user {self.user_id}, bucket {bucket_num}")
 
-            except KeyError as e:
-                 logger.error(f"Missing expected key {e} in drive data for user {self.user_id}: {drive_data}")
-            except Exception as e:
-                logger.error(f"Error loading drive for user {self.user_id}, data {drive_data}: {e}", exc_info=True)
+        except KeyError as e:
+             logger.error(f"Missing expected key {e} in drive data for user {self.user_id}: {drive_data}")
+        except Exception as e:
+            logger.error(f"Error loading drive for user {self.user_id}, data {drive_data}: {e}", exc_info=True)
 
-        logger.info(f"Finished loading drives for User ID: {self.user_id}. Total loaded: {loaded_drives_count}")
+        elapsed = time.monotonic() - started_at
+        if drive_instance:
+            logger.info(f"Successfully loaded and authenticated {drive_data.get('type')} Bucket {drive_data.get('bucket_number')} in {elapsed:.2f}s")
+        else:
+            logger.warning(f"Could not load {drive_data.get('type')} Bucket {drive_data.get('bucket_number')} (took {elapsed:.2f}s)")
+        return drive_instance, elapsed
 
 
     def add_drive(self, drive: Service, bucket_number, drive_type):
@@ -119,70 +206,175 @@ class DriveManager:
             raise # Re-raise the exception to be handled by the caller (e.g., the API endpoint)
 
 
-    def check_all_storages(self):
+    def get_drive_quotas(self, force_refresh: bool = False) -> List[Tuple[Service, Optional[Tuple[int, int]]]]:
+        """
+        Returns [(drive, (limit, usage) or None)] for every loaded drive, in drive order.
+        Values come from the shared QuotaCache; buckets with nothing cached (or all of them
+        when force_refresh is set) are queried concurrently, and stale values are served
+        while a background refresh runs.
+        """
+        cache = QuotaCache.get_instance()
+        quotas: Dict[int, Optional[Tuple[int, int]]] = {}
+        to_fetch = []
+        for index, drive in enumerate(self.drives):
+            bucket_number = getattr(drive, 'bucket_number', None)
+            if bucket_number is None or not getattr(drive, 'service', None):
+                quotas[index] = None
+                continue
+            if not force_refresh:
+                cached, is_fresh = cache.get(self.user_id, bucket_number)
+                if cached is not None:
+                    quotas[index] = cached
+                    if not is_fresh:
+                        cache.refresh_in_background(self.user_id, bucket_number, drive.check_storage)
+                    continue
+            to_fetch.append(index)
+
+        if to_fetch:
+            logger.info(f"Fetching quota for {len(to_fetch)} of {len(self.drives)} drives for user {self.user_id}")
+            futures = {index: cache.executor.submit(self.drives[index].check_storage) for index in to_fetch}
+            for index, future in futures.items():
+                drive = self.drives[index]
+                try:
+                    limit, usage = future.result()
+                except Exception as e:
+                    logger.error(f"Error checking storage for drive at index {index} ({type(drive).__name__}): {e}", exc_info=True)
+                    quotas[index] = None
+                    continue
+                # check_storage reports (0, 0) on errors; do not cache those
+                if limit or usage:
+                    cache.put(self.user_id, drive.bucket_number, limit, usage)
+                quotas[index] = (limit, usage)
+
+        return [(drive, quotas.get(index)) for index, drive in enumerate(self.drives)]
+
+    def check_all_storages(self, force_refresh: bool = False):
         """
         Checks storage usage for all drives and sorts them by free space.
+        Served from the quota cache unless force_refresh is set.
         :return: A tuple containing storage info, total limit, and total usage.
         """
-        self.sorted_buckets = []  # Reset the sorted_buckets list
+        sorted_buckets = []
         storage_info = []
         total_limit = 0
         total_usage = 0
         logger.info(f"Checking storage for {len(self.drives)} drives for user {self.user_id}")
-        for index, drive in enumerate(self.drives):
-            try:
-                limit, usage = drive.check_storage()
-                free = limit - usage
-                # Ensure drive object is valid before adding
-                if hasattr(drive, 'service') and drive.service: # Basic check if drive is authenticated/valid
-                    if free >= 0: # Allow storing even if full, just sort order changes
-                        self.sorted_buckets.append((free, drive, index))
-                    provider_name = type(drive).__name__
+        for index, (drive, quota) in enumerate(self.get_drive_quotas(force_refresh)):
+            if quota is None:
+                if hasattr(drive, 'service') and drive.service:
+                    provider_name = f"{type(drive).__name__} (Error)"
                 else:
                     provider_name = f"{type(drive).__name__} (Unauthenticated?)"
-                    limit, usage, free = 0, 0, 0 # Assume zero storage if not authenticated
                     logger.warning(f"Drive at index {index} ({provider_name}) seems unauthenticated. Skipping detailed storage check.")
-
-
-                total_limit += limit
-                total_usage += usage
+                # Add placeholder info if a specific drive check fails
                 storage_info.append({
                     "Drive Number": index + 1,
-                    "Storage Limit (bytes)": limit / 1024**3 if limit else 0,
-                    "Used Storage (bytes)": usage / 1024**3 if usage else 0,
-                    "Free Storage": free / 1024**3 if free else 0,
+                    "Storage Limit (bytes)": 0, "Used Storage (bytes)": 0, "Free Storage": 0,
                     "Provider": provider_name
                 })
-            except Exception as e:
-                 logger.error(f"Error checking storage for drive at index {index} ({type(drive).__name__}): {e}", exc_info=True)
-                 # Add placeholder info if a specific drive check fails
-                 storage_info.append({
-                     "Drive Number": index + 1,
-                     "Storage Limit (bytes)": 0, "Used Storage (bytes)": 0, "Free Storage": 0,
-                     "Provider": f"{type(drive).__name__} (Error)"
-                 })
-
+                continue
+
+            limit, usage = quota
+            free = limit - usage
+            if free >= 0: # Allow storing even if full, just sort order changes
+                sorted_buckets.append((free, drive, index))
+
+            total_limit += limit
+            total_usage += usage
+            storage_info.append({
+                "Drive Number": index + 1,
+                "Storage Limit (bytes)": limit / 1024**3 if limit else 0,
+                "Used Storage (bytes)": usage / 1024**3 if usage else 0,
+                "Free Storage": free / 1024**3 if free else 0,
+                "Provider": type(drive).__name__
+            })
 
         # Sort buckets by free space in descending order
-        self.sorted_buckets.sort(reverse=True, key=lambda x: x[0])
+        sorted_buckets.sort(reverse=True, key=lambda x: x[0])
+        self.sorted_buckets = sorted_buckets
         logger.info(f"Storage check complete. Total Limit: {total_limit}, Total Usage: {total_usage}")
         return storage_info, total_limit, total_usage
 
     def get_sorted_buckets(self):
         """
-        Returns the sorted list of buckets with the most free space. Re-checks if list is empty.
+        Returns the sorted list of buckets with the most free space.
+        Always recomputed from the quota cache, so our own uploads are reflected without a provider call.
         """
-        # Re-check storage if the list is empty or seems outdated
-        if not self.sorted_buckets:
-             logger.info("Sorted buckets list is empty, re-checking storage.")
-             self.check_all_storages()
+        self.check_all_storages()
         return self.sorted_buckets
 
     def update_sorted_buckets(self):
         """
-        Updates the sorted list of buckets based on current storage status.
+        Updates the sorted list of buckets based on current storage status, bypassing the quota cache.
         """
-        self.check_all_storages()
+        self.check_all_storages(force_refresh=True)
+
+    def record_upload(self, bucket_number, bytes_written: int):
+        """
+        Records bytes we uploaded to a bucket in the shared quota cache.
+        """
+        QuotaCache.get_instance().record_upload(self.user_id, bucket_number, bytes_written)
+
+    def locate_file(self, file_name: str, extensions: Iterable[str] = ()) -> Optional[Dict]:
+        """
+        Resolves a file name to a manifest-shaped document:
+        {"file_name", "file_size", "mimetype", "chunks": [{"index", "offset", "size", "provider", "bucket", "file_id", "path"}]}.
+        Lookup order: the metadata_collection manifest written at upload time (one indexed read on
+        user_id + file_name), then the file catalog, and only then one concurrent findFile fan-out
+        across drives. extensions adds "file_name + ext" candidates to the two indexed lookups.
+        """
+        candidates = [file_name] + [file_name + ext for ext in extensions if not file_name.lower().endswith(ext.lower())]
+        db = Database().get_instance()
+        if db.metadata_collection is not None:
+            manifests = {doc["file_name"]: doc for doc in db.metadata_collection.find({"user_id": self.user_id, "file_name": {"$in": candidates}}) if doc.get("chunks")}
+            for name in candidates:
+                if name in manifests:
+                    return manifests[name]
+
+        try:
+            entry = FileIndex().find_file(self.user_id, candidates)
+        except Exception as e:
+            logger.warning(f"File catalog lookup failed for '{file_name}': {e}")
+            entry = None
+        if entry and any(d.provider == entry.get("provider") and d.bucket_number == entry.get("bucket") for d in self.drives):
+            return self._manifest_from_entry(entry["provider"], entry["bucket"], entry)
+
+        return self._find_file_in_drives(file_name)
+
+    def _find_file_in_drives(self, file_name: str) -> Optional[Dict]:
+        """Asks every drive for an exact-name match concurrently and returns the first hit."""
+        drives = [drive for drive in self.drives if getattr(drive, 'service', None)]
+        if not drives:
+            return None
+        logger.info(f"'{file_name}' not in manifest or catalog, searching {len(drives)} drives for user {self.user_id}")
+        # Each lookup runs on its provider's shared executor, so concurrent requests can't oversubscribe a provider
+        futures = {get_executor(drive.provider).submit(drive.findFile, file_name): drive for drive in drives}
+        try:
+            for future in as_completed(futures, timeout=DRIVE_LOAD_TIMEOUT_SECONDS):
+                drive = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    logger.error(f"Error looking up '{file_name}' in {type(drive).__name__} (Bucket {drive.bucket_number}): {e}")
+                    continue
+                if entry:
+                    return self._manifest_from_entry(drive.provider, drive.bucket_number, entry)
+        except FuturesTimeoutError:
+            logger.warning(f"Timed out after {DRIVE_LOAD_TIMEOUT_SECONDS}s searching drives for '{file_name}'")
+        finally:
+            for future in futures: future.cancel() # Drop lookups still queued behind other requests
+        return None
+
+    @staticmethod
+    def _manifest_from_entry(provider: str, bucket_number: int, entry: Dict) -> Dict:
+        """Wraps a single provider file (catalog entry) as a one-chunk manifest."""
+        return {
+            "file_name": entry.get("name"),
+            "file_size": entry.get("size"),
+            "mimetype": entry.get("mimeType"),
+            "chunks": [{"chunk_name": entry.get("name"), "index": 0, "offset": 0, "size": entry.get("size"),
+                        "provider": provider, "bucket": bucket_number, "file_id": entry.get("id"), "path": entry.get("path_lower")}],
+        }
 
     def get_all_authenticated_buckets(self):
         """
@@ -316,42 +508,208 @@ class DriveManager:
         self.paginate_files(all_files)
 
     # --- New Method for LLM Context ---
+    def _with_access_tokens(self, files: List[Dict]) -> List[Dict]:
+        """Adds the bucket's access token to Dropbox results, which /llm/ask needs to download them."""
+        tokens = {}
+        for drive in self.drives:
+            if isinstance(drive, DropboxService) and drive.service:
+                tokens[drive.bucket_number] = getattr(getattr(drive.service, 'session', None), 'access_token', None) or getattr(drive.service, '_oauth2_access_token', None)
+        for file in files:
+            if file.get("provider") == "Dropbox": file["access_token"] = tokens.get(file.get("bucket"))
+        return files
+
     def search_files_for_llm(self, query: str, limit_per_drive: int = 5, total_limit: int = 10) -> List[Dict]:
         """
         Searches for files across all authenticated drives based on a query,
-        intended for providing context to an LLM. Uses searchFiles.
+        intended for providing context to an LLM. Uses the local SearchIndex when it is ready,
+        otherwise each drive's searchFiles.
         Returns a limited list of file metadata.
         """
+        return self.search_files_with_status(query, limit_per_drive, total_limit)[0]
+
+    def search_files_with_status(self, query: str, limit_per_drive: int = 5, total_limit: int = 10) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Same as search_files_for_llm, also returning the buckets whose results are missing
+        ({"provider", "bucket", "reason"}: timeout, error or skipped) when the drives were searched live.
+        """
         if not self.drives:
             logger.warning(f"No authenticated drives found for user {self.user_id} during LLM search.")
-            return []
-
-        all_found_files = []
-        logger.info(f"Starting LLM file search for query '{query}' across {len(self.drives)} drives.")
-
-        # Collect files from all drives using the searchFiles method
-        for drive in self.drives:
-            logger.debug(f"Searching in {type(drive).__name__}...")
-            try:
-                # Pass the query and a per-drive limit
-                found_in_drive = self.search_files_in_drive(drive, query, limit_per_drive)
-                if found_in_drive:
-                     logger.info(f"Found {len(found_in_drive)} potential files in {type(drive).__name__}")
-                     all_found_files.extend(found_in_drive) # Add provider info if not already present
-                else:
-                     logger.info(f"No files found matching query in {type(drive).__name__}")
-
-            except Exception as e:
-                logger.error(f"Error searching files for LLM context in {type(drive).__name__}: {e}", exc_info=True)
+            return [], []
 
-        # Optional: De-duplicate based on name and provider? For now, keep duplicates if they exist across providers.
-        # Optional: Sort by relevance if search APIs provide scores, or by name/date. Sorting by name for consistency.
-        all_found_files.sort(key=lambda x: x.get('name', '').lower())
-
-        logger.info(f"Total files found across all drives before limit: {len(all_found_files)}")
+        indexed = self._search_index(query, total_limit)
+        if indexed is not None:
+            return indexed, []
+        return self._search_drives(query, limit_per_drive, total_limit)
 
+    async def asearch_files_with_status(self, query: str, limit_per_drive: int = 5, total_limit: int = 10) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Async search_files_with_status: the local index is read on the "drives" executor, and live
+        searches go through the async provider clients (see async_service) instead of a thread per bucket.
+        """
+        if not self.drives:
+            logger.warning(f"No authenticated drives found for user {self.user_id} during LLM search.")
+            return [], []
+        indexed = await run_in("drives", self._search_index, query, total_limit)
+        if indexed is not None:
+            return indexed, []
+        return await self._asearch_drives(query, limit_per_drive, total_limit)
+
+    def _search_index(self, query: str, total_limit: int) -> Optional[List[Dict]]:
+        """Results from the local index, or None (after scheduling the index build) when it does not cover every bucket yet."""
+        # Served from the local BM25 index once it covers every bucket (same ranking for all providers)
+        search_index = SearchIndex.get_instance()
+        if search_index.is_ready(self):
+            if FileIndexer.get_instance().needs_refresh(self): FileIndexer.get_instance().schedule(self) # Catalog delta, then content re-index
+            return self._with_access_tokens(search_index.search(self.user_id, query, total_limit))
+        # Not indexed yet: build the catalog (and then the search index) in the background, ask the providers this time
+        indexer = FileIndexer.get_instance()
+        if indexer.is_indexed(self): SearchIndexer.get_instance().schedule(self)
+        else: indexer.schedule(self)
+        return None
+
+    def _search_drives(self, query: str, limit_per_drive: int, total_limit: int) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Runs searchFiles on every drive concurrently under one deadline (SEARCH_FANOUT_DEADLINE_SECONDS).
+        Results are merged by relevance; once total_limit strong hits are in, slower buckets are not waited for.
+        """
+        drives = [drive for drive in self.drives if getattr(drive, 'service', None)]
+        terms = set(re.findall(r"\w+", query.lower()))
+        logger.info(f"Starting LLM file search for query '{query}' across {len(drives)} drives.")
+        found: Dict[Tuple, Dict] = {}
+        partial: List[Dict] = []
+        futures = {get_executor(drive.provider).submit(self.search_files_in_drive, drive, query, limit_per_drive): drive for drive in drives}
+        pending = set(futures)
+        started_at = time.monotonic()
+        try:
+            for future in as_completed(futures, timeout=SEARCH_FANOUT_DEADLINE_SECONDS):
+                pending.discard(future)
+                drive = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"Error searching files for LLM context in {type(drive).__name__} (Bucket {drive.bucket_number}): {e}", exc_info=True)
+                    partial.append({"provider": drive.provider, "bucket": drive.bucket_number, "reason": "error"})
+                    continue
+                logger.info(f"Found {len(results)} potential files in {type(drive).__name__} (Bucket {drive.bucket_number}) after {time.monotonic() - started_at:.2f}s")
+                self._merge_hits(found, results, terms)
+                if pending and sum(1 for f in found.values() if f["score"] >= SEARCH_STRONG_HIT_SCORE) >= total_limit:
+                    logger.info(f"{total_limit} strong hits found, not waiting for {len(pending)} more buckets.")
+                    partial.extend({"provider": futures[f].provider, "bucket": futures[f].bucket_number, "reason": "skipped"} for f in pending)
+                    break
+        except FuturesTimeoutError:
+            logger.warning(f"Search deadline of {SEARCH_FANOUT_DEADLINE_SECONDS}s reached, {len(pending)} buckets returned no results in time.")
+            partial.extend({"provider": futures[f].provider, "bucket": futures[f].bucket_number, "reason": "timeout"} for f in pending)
+        finally:
+            for future in pending: future.cancel()
+
+        ranked = sorted(found.values(), key=lambda f: (-f["score"], f.get("name", "").lower()))
+        logger.info(f"Total files found across all drives before limit: {len(ranked)} ({len(partial)} buckets partial)")
         # Return the top N results overall
-        return all_found_files[:total_limit]
+        return ranked[:total_limit], partial
+
+    async def _asearch_drives(self, query: str, limit_per_drive: int, total_limit: int) -> Tuple[List[Dict], List[Dict]]:
+        """_search_drives on the event loop: same deadline, early stop and ranking, one task per bucket."""
+        drives = [drive for drive in self.drives if getattr(drive, 'service', None)]
+        terms = set(re.findall(r"\w+", query.lower()))
+        found: Dict[Tuple, Dict] = {}
+        partial: List[Dict] = []
+        tasks = {asyncio.ensure_future(self.async_service(drive).asearch(query, limit_per_drive)): drive for drive in drives}
+        pending = set(tasks)
+        deadline = time.monotonic() + SEARCH_FANOUT_DEADLINE_SECONDS
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.warning(f"Search deadline of {SEARCH_FANOUT_DEADLINE_SECONDS}s reached, {len(pending)} buckets returned no results in time.")
+                    partial.extend({"provider": tasks[t].provider, "bucket": tasks[t].bucket_number, "reason": "timeout"} for t in pending)
+                    break
+                for task in done:
+                    drive = tasks[task]
+                    try: results = task.result()
+                    except Exception as e:
+                        logger.error(f"Error searching files in {type(drive).__name__} (Bucket {drive.bucket_number}): {e}", exc_info=True)
+                        partial.append({"provider": drive.provider, "bucket": drive.bucket_number, "reason": "error"})
+                        continue
+                    self._merge_hits(found, results, terms)
+                if pending and sum(1 for f in found.values() if f["score"] >= SEARCH_STRONG_HIT_SCORE) >= total_limit:
+                    logger.info(f"{total_limit} strong hits found, not waiting for {len(pending)} more buckets.")
+                    partial.extend({"provider": tasks[t].provider, "bucket": tasks[t].bucket_number, "reason": "skipped"} for t in pending)
+                    break
+        finally:
+            for task in pending: task.cancel()
+        ranked = sorted(found.values(), key=lambda f: (-f["score"], f.get("name", "").lower()))
+        return ranked[:total_limit], partial
+
+    def _merge_hits(self, found: Dict[Tuple, Dict], results: List[Dict], terms: set):
+        """Adds one bucket's relevance-ordered results to found, keeping the best score per file."""
+        for position, file in enumerate(results):
+            if is_block_name(file.get("name")): continue # cdc blocks are storage internals
+            key = (file.get("provider"), file.get("id") or file.get("path_lower") or file.get("name"))
+            score = self._search_score(file, terms, position)
+            if key not in found or found[key]["score"] < score:
+                found[key] = dict(file, score=score)
+
+    # --- Async provider clients ---
+
+    def async_service(self, drive: Service) -> AsyncService:
+        """The AsyncService for a loaded bucket (native or thread-backed, see ASYNC_PROVIDER_CLIENTS), created once per bucket."""
+        key = (drive.provider, drive.bucket_number)
+        service = self._async_services.get(key)
+        if service is None or service.drive is not drive:
+            service = async_service_for(drive, native=ASYNC_PROVIDER_CLIENTS == "native")
+            self._async_services[key] = service
+        return service
+
+    async def aresolve_links(self, files: List[Dict]) -> List[Dict]:
+        """
+        Replaces the stable "dropbox:" paths of catalog and listing entries with temporary links, so the
+        file list can open them. Links are fetched concurrently and reused for DROPBOX_LINK_TTL_SECONDS;
+        an entry whose link cannot be fetched keeps its dropbox: path.
+        """
+        drives = {drive.bucket_number: drive for drive in self.drives if isinstance(drive, DropboxService) and drive.service}
+        now = time.monotonic()
+        self._dropbox_links = {key: cached for key, cached in self._dropbox_links.items() if cached[1] > now} # Drop expired links
+
+        async def _resolve(file: Dict):
+            key = (file.get("bucket"), file.get("id") or file["path"][len("dropbox:"):])
+            cached = self._dropbox_links.get(key)
+            if cached:
+                file["path"] = cached[0]; return
+            try: link = await self.async_service(drives[key[0]]).atemporary_link(key[1])
+            except Exception as e: logger.debug(f"Could not get temporary link for {file.get('name')} (Dropbox Bucket {key[0]}): {e}"); return
+            self._dropbox_links[key] = (link, time.monotonic() + DROPBOX_LINK_TTL_SECONDS)
+            file["path"] = link
+
+        await asyncio.gather(*(_resolve(file) for file in files
+                               if file.get("provider") == "Dropbox" and file.get("bucket") in drives and (file.get("path") or "").startswith("dropbox:")))
+        return files
+
+    async def alist_files(self, query: Optional[str] = None) -> Tuple[List[Dict], List[Tuple[Service, Exception]]]:
+        """Live listing of every bucket concurrently. Returns (files, [(drive, error)]) so callers can react to auth errors."""
+        drives = [drive for drive in self.drives if getattr(drive, 'service', None)]
+        results = await asyncio.gather(*(self.async_service(drive).alist_files(query=query) for drive in drives), return_exceptions=True)
+        files, errors = [], []
+        for drive, result in zip(drives, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error listing files from {type(drive).__name__} (Bucket {drive.bucket_number}): {result}")
+                errors.append((drive, result))
+                continue
+            result = [file for file in result if not is_block_name(file.get("name"))] # cdc blocks are storage internals
+            for file in result:
+                file.setdefault("provider", drive.provider)
+                file.setdefault("bucket", drive.bucket_number)
+            files.extend(result)
+        return self._with_access_tokens(files), errors
+
+    @staticmethod
+    def _search_score(file: Dict, terms: set, position: int) -> float:
+        """
+        Relevance across providers: share of query terms in the file name (weighted x2)
+        plus the provider's own rank (position in its relevance-ordered result list).
+        """
+        name_terms = set(re.findall(r"\w+", (file.get("name") or "").lower()))
+        name_match = len(terms & name_terms) / len(terms) if terms else 0.0
+        return round(2 * name_match + 1 / (1 + position), 4)
 
 
 # --- END OF FILE DriveManager.py ---
\ No newline at end of file
@@ -0,0 +1,116 @@
+# --- START OF FILE DrivePool.py ---
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from DriveManager import DriveManager
+
+logger = logging.getLogger(__name__)
+
+# Pool limits (overridable through the environment like the other settings)
+DRIVE_POOL_MAX_USERS = int(os.getenv("DRIVE_POOL_MAX_USERS", 256))
+DRIVE_POOL_TTL_SECONDS = int(os.getenv("DRIVE_POOL_TTL_SECONDS", 30 * 60))
+# Users with degraded (failed or timed out) buckets are retried much sooner
+DRIVE_POOL_DEGRADED_TTL_SECONDS = int(os.getenv("DRIVE_POOL_DEGRADED_TTL_SECONDS", 60))
+
+
+class DrivePool:
+    """
+    Process-wide pool of authenticated DriveManager instances, keyed by user.
+    Entries expire after DRIVE_POOL_TTL_SECONDS and the least recently used
+    user is evicted once DRIVE_POOL_MAX_USERS is exceeded, so a warm request
+    reuses the already authenticated drive clients instead of rebuilding them.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(DrivePool, cls).__new__(cls)
+                    instance._entries = OrderedDict() # user key -> (DriveManager, expires_at)
+                    instance._lock = threading.Lock()
+                    instance.max_users = DRIVE_POOL_MAX_USERS
+                    instance.ttl_seconds = DRIVE_POOL_TTL_SECONDS
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of DrivePool."""
+        return cls()
+
+    @staticmethod
+    def _key(user_id) -> str:
+        # ObjectId and str user ids must map to the same entry
+        return str(user_id)
+
+    def get(self, user_id) -> DriveManager:
+        """Returns a pooled DriveManager for the user, building one on a miss or after expiry."""
+        key = self._key(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                drive_manager, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    logger.debug(f"DrivePool hit for user {key}")
+                    return drive_manager
+                logger.info(f"DrivePool entry for user {key} expired, rebuilding.")
+                del self._entries[key]
+
+        # Build outside the lock: authenticating every bucket can take seconds
+        # and must not block requests of other users.
+        logger.info(f"DrivePool miss for user {key}, loading drives.")
+        drive_manager = DriveManager(user_id=user_id)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and time.monotonic() < existing[1]:
+                # Another request finished loading the same user first, keep that one
+                self._entries.move_to_end(key)
+                return existing[0]
+            ttl = DRIVE_POOL_DEGRADED_TTL_SECONDS if drive_manager.degraded_buckets else self.ttl_seconds
+            self._entries[key] = (drive_manager, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_users:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.info(f"DrivePool evicted least recently used user {evicted_key}")
+        return drive_manager
+
+    def peek(self, user_id) -> Optional[DriveManager]:
+        """Returns the pooled DriveManager without building or refreshing it."""
+        with self._lock:
+            entry = self._entries.get(self._key(user_id))
+        return entry[0] if entry else None
+
+    def invalidate(self, user_id, reason: str = ""):
+        """Drops the pooled DriveManager so the next request reloads the user's drives."""
+        key = self._key(user_id)
+        with self._lock:
+            removed = self._entries.pop(key, None)
+        if removed is not None:
+            logger.info(f"DrivePool invalidated user {key}{f' ({reason})' if reason else ''}")
+
+    def clear(self):
+        """Drops every pooled DriveManager."""
+        with self._lock:
+            self._entries.clear()
+
+
+def get_drive_manager(user_id) -> DriveManager:
+    """Convenience wrapper returning the pooled DriveManager for user_id."""
+    return DrivePool.get_instance().get(user_id)
+
+
+def invalidate_drive_manager(user_id, reason: str = ""):
+    """Convenience wrapper invalidating the pooled DriveManager for user_id."""
+    DrivePool.get_instance().invalidate(user_id, reason)
+
+# --- END OF FILE DrivePool.py ---
@@ -2,32 +2,29 @@
 
 import os
 import io
+import shutil
 import dropbox
 import logging
 import re
 from dropbox.exceptions import AuthError, ApiError
 from dropbox.files import WriteMode, FileMetadata, SearchOptions, SearchOrderBy, FileStatus # Added imports
-from FileHandler import FileHandler
+from FileHandler import FileHandler, DOWNLOAD_CHUNK_SIZE
 from Database import Database
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable
 from DriveManager import DriveManager # Import DriveManager if needed for user_id context
 from Dropbox import DropboxService
-
-# --- Text Extraction Imports ---
-try:
-    import PyPDF2
-except ImportError: PyPDF2 = None; logging.warning("PyPDF2 not installed...")
-try:
-    import docx
-except ImportError: docx = None; logging.warning("python-docx not installed...")
+from ChunkTransfer import ChunkUploader, ChunkAssembler, use_chunked_upload
+from ContentHash import ContentDedup
+from ExtractionCache import ExtractionCache
+from ClientRegistry import get_dropbox_client
+from TextExtraction import extract_text, head_bytes_for, SUPPORTED_TEXT_EXTENSIONS
 
 # --- Constants ---
-SUPPORTED_TEXT_EXTENSIONS = ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml', '.pdf', '.docx')
 MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024 # 50 MB limit
 
 class DropBoxFile(FileHandler):
     def __init__(self, access_token: str, drive_manager): # Pass DriveManager
-        self.dbx = dropbox.Dropbox(access_token)
+        self.dbx = get_dropbox_client(access_token=access_token) # Shared per token, pooled connections
         self.drive_manager = drive_manager # Store DriveManager
         self.db = Database().get_instance()
         self.logger = logging.getLogger(__name__)
@@ -50,37 +47,38 @@ class DropBoxFile(FileHandler):
                  self.logger.error("Cannot update metadata: user_id is missing.")
                  return # Stop if user_id is missing
 
+            key = {"user_id": user_id, "file_name": metadata["file_name"]}
+            previous = self.db.metadata_collection.find_one(key)
             self.db.metadata_collection.update_one(
-                {"user_id": user_id, "file_name": metadata["file_name"]},
-                {"$set": metadata},
+                key,
+                {"$set": metadata, "$unset": {"dedup_of": ""}}, # A fresh upload no longer aliases other content
                 upsert=True
             )
             self.logger.info(f"Metadata updated in MongoDB for file: {metadata['file_name']}")
+            if previous: # Re-upload of a name: delete the object it replaced once nothing references it
+                try: ChunkUploader(self.drive_manager).release_unreferenced(previous, key)
+                except Exception as e: self.logger.warning(f"Cleanup of objects replaced by '{metadata['file_name']}' failed: {e}")
         except Exception as e:
              self.logger.error(f"Failed to update metadata in MongoDB: {e}", exc_info=True)
              # raise # Optionally re-raise
 
     def _check_available_space(self, file_size):
-        # Checks space across Dropbox buckets associated with the user
+        # Checks space across Dropbox buckets associated with the user, using the shared quota cache
         dropbox_buckets_info = []
         total_free = 0
         if not hasattr(self.drive_manager, 'drives') or not self.drive_manager.drives:
              self.logger.warning("DriveManager has no drives loaded for Dropbox space check.")
              return False, None
 
-        for drive_instance in self.drive_manager.drives:
+        for drive_instance, quota in self.drive_manager.get_drive_quotas():
              # Check if it's a DropboxService instance and has an authenticated service
-            if isinstance(drive_instance, DropboxService) and drive_instance.service and hasattr(drive_instance, 'bucket_number'):
-                 try:
-                     # Use the check_storage method from DropboxService instance
-                     limit, usage_used = drive_instance.check_storage()
-                     free = limit - usage_used
-                     if free >= 0:
-                          total_free += free
-                          # Store free space, the client instance, and bucket number
-                          dropbox_buckets_info.append([free, drive_instance.service, drive_instance.bucket_number])
-                 except Exception as e:
-                     self.logger.error(f"Error checking storage for Dropbox bucket {drive_instance.bucket_number}: {e}")
+            if isinstance(drive_instance, DropboxService) and drive_instance.service and hasattr(drive_instance, 'bucket_number') and quota:
+                 limit, usage_used = quota
+                 free = limit - usage_used
+                 if free >= 0:
+                      total_free += free
+                      # Store free space, the drive instance, and bucket number
+                      dropbox_buckets_info.append([free, drive_instance, drive_instance.bucket_number])
 
         if total_free < file_size:
             self.logger.warning(f"Not enough total free space ({total_free} bytes) across Dropbox buckets for file size {file_size} bytes.")
@@ -89,16 +87,15 @@ class DropBoxFile(FileHandler):
         dropbox_buckets_info.sort(reverse=True, key=lambda x: x[0])
         return True, dropbox_buckets_info
 
-    def _upload_entire_file(self, file_path, file_name, best_bucket_info):
-        """Upload the entire file to the best available Dropbox bucket."""
-        free_space, dbx_client, bucket_number = best_bucket_info
-        dropbox_path = f"/{file_name}"
+    def _upload_stream_to_bucket(self, stream, file_name, file_size, best_bucket_info):
+        """Upload a stream to the given Dropbox bucket [free_space, drive_instance, bucket_number]."""
+        free_space, drive_instance, bucket_number = best_bucket_info
         try:
-            self.logger.info(f"Uploading '{file_name}' to Dropbox Bucket {bucket_number} (Path: {dropbox_path})")
-            with open(file_path, "rb") as f:
-                file_metadata = dbx_client.files_upload(f.read(), dropbox_path, mode=WriteMode("overwrite"))
-            self.logger.info(f"Successfully uploaded '{file_name}' to Dropbox Bucket {bucket_number}, Path: {file_metadata.path_display}")
-            return {"chunk_name": file_name, "file_id": file_metadata.id, "path": file_metadata.path_lower, "bucket": bucket_number}
+            self.logger.info(f"Uploading '{file_name}' ({file_size} bytes) to Dropbox Bucket {bucket_number} (Path: /{file_name})")
+            result = drive_instance.uploadStream(stream, file_name, file_size)
+            self.logger.info(f"Successfully uploaded '{file_name}' to Dropbox Bucket {bucket_number}, Path: {result['path']}")
+            self.drive_manager.record_upload(bucket_number, result["size"])
+            return {"chunk_name": result.get("name") or file_name, "index": 0, "offset": 0, "size": result["size"], "provider": drive_instance.provider, "bucket": bucket_number, "file_id": result["file_id"], "path": result["path"]}
         except ApiError as err:
             self.logger.error(f"Failed to upload '{file_name}' to Dropbox Bucket {bucket_number}: {err}")
             return None
@@ -106,37 +103,51 @@ class DropBoxFile(FileHandler):
              self.logger.error(f"Unexpected error uploading '{file_name}' to Dropbox Bucket {bucket_number}: {e}", exc_info=True)
              return None
 
+    def _upload_entire_file(self, file_path, file_name, best_bucket_info):
+        """Upload the entire file to the best available Dropbox bucket."""
+        with open(file_path, "rb") as stream:
+            return self._upload_stream_to_bucket(stream, file_name, os.path.getsize(file_path), best_bucket_info)
+
     def upload_file(self, file_path, file_name, mimetype="None"):
-        """Upload a file to Dropbox and save metadata to MongoDB."""
+        """Upload a file to Dropbox and save metadata to MongoDB. Returns the metadata document."""
         if not os.path.exists(file_path):
              self.logger.error(f"Upload failed: File not found at {file_path}")
              raise FileNotFoundError(f"File not found: {file_path}")
 
-        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as stream:
+            return self.upload_stream(stream, file_name, mimetype, os.path.getsize(file_path))
+
+    def upload_stream(self, stream, file_name, mimetype, file_size):
+        """
+        Upload a binary stream (e.g. the spooled request body) to Dropbox without copying
+        it to a local file or reading it fully into memory. Returns the metadata document.
+        """
+        # Identical content already stored for this user: record the name, upload nothing
+        linked, content_hashes = ContentDedup(self.drive_manager).check(stream, file_name, mimetype, file_size)
+        if linked:
+            return linked
+
         has_space, sorted_dropbox_buckets = self._check_available_space(file_size)
-        if not has_space:
-             self.logger.error(f"Upload failed: Not enough space for file '{file_name}' (size: {file_size} bytes)")
-             raise Exception("Not enough storage space available in connected Dropbox accounts.")
+        if not has_space or sorted_dropbox_buckets[0][0] < file_size or use_chunked_upload(file_size):
+            # No single Dropbox bucket can hold it (or cdc mode is on): split across every connected bucket
+            self.logger.info(f"File '{file_name}' ({file_size} bytes) goes through the chunked pipeline across buckets.")
+            return ChunkUploader(self.drive_manager).upload(stream, file_name, mimetype, file_size, content_hashes)
 
         user_id = getattr(self.drive_manager, 'user_id', None)
         if not user_id:
             self.logger.error("Cannot upload: user_id not found in DriveManager.")
             raise Exception("User context not found for metadata.")
 
-        metadata = {"user_id": user_id, "file_name": file_name, "chunks": []} # Add user_id here
-        best_bucket_info = sorted_dropbox_buckets[0] # [free_space, client_instance, bucket_number]
-
-        if best_bucket_info[0] >= file_size:
-            chunk_metadata = self._upload_entire_file(file_path, file_name, best_bucket_info)
-            if chunk_metadata:
-                metadata["chunks"].append(chunk_metadata)
-                self._update_metadata(metadata) # Call corrected metadata update
-            else:
-                 self.logger.error(f"Upload failed for file '{file_name}' due to error in _upload_entire_file (Dropbox).")
-                 raise Exception(f"Failed to upload {file_name} to Dropbox.")
+        metadata = {"user_id": user_id, "file_name": file_name, "file_size": file_size, "mimetype": mimetype, "chunks": [], **content_hashes} # Add user_id here
+        best_bucket_info = sorted_dropbox_buckets[0] # [free_space, drive_instance, bucket_number]
+        chunk_metadata = self._upload_stream_to_bucket(stream, file_name, file_size, best_bucket_info)
+        if chunk_metadata:
+            metadata["chunks"].append(chunk_metadata)
+            self._update_metadata(metadata) # Call corrected metadata update
+            return metadata
         else:
-            self.logger.warning(f"File '{file_name}' is larger than the single largest free space in Dropbox buckets. Chunking required but not implemented.")
-            raise NotImplementedError("File splitting/chunking for Dropbox is not yet implemented.")
+             self.logger.error(f"Upload failed for file '{file_name}' due to error in _upload_stream_to_bucket (Dropbox).")
+             raise Exception(f"Failed to upload {file_name} to Dropbox.")
 
 
     # --- download_file_content_by_path, extract_text_from_content ---
@@ -145,8 +156,8 @@ class DropBoxFile(FileHandler):
     # (Keep the rest of the DropBoxFile methods as they were in the previous step)
     # ... (rest of DropBoxFile.py methods from previous step) ...
 
-    def download_file_content_by_path(self, file_path: str) -> Optional[io.BytesIO]:
-        """Downloads file content from Dropbox (using file path) into an in-memory BytesIO object."""
+    def download_file_content_by_path(self, file_path: str, max_bytes: Optional[int] = None) -> Optional[io.BytesIO]:
+        """Downloads file content from Dropbox (using file path) into an in-memory BytesIO object (only the first max_bytes if given)."""
         try:
             self.logger.info(f"Attempting to get metadata for Dropbox path: {file_path}")
             metadata = self.dbx.files_get_metadata(file_path)
@@ -154,6 +165,8 @@ class DropBoxFile(FileHandler):
                  self.logger.warning(f"Path {file_path} is not a file. Skipping download.")
                  return None
             file_size = metadata.size
+            if max_bytes:
+                return self._download_head_by_path(file_path, max_bytes)
             if file_size > MAX_FILE_SIZE_BYTES:
                 self.logger.warning(f"Skipping download for Dropbox path {file_path}: size ({file_size} bytes) exceeds limit ({MAX_FILE_SIZE_BYTES} bytes).")
                 return None
@@ -177,44 +190,39 @@ class DropBoxFile(FileHandler):
             self.logger.error(f"Unexpected error downloading Dropbox path {file_path}: {e}", exc_info=True)
             return None
 
-    def extract_text_from_content(self, content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None) -> Optional[str]:
-        """Extracts text from a BytesIO buffer based on filename extension."""
-        # Identical logic to GDriveFile, can be potentially refactored
-        extracted_text = None
-        file_ext = os.path.splitext(filename)[1].lower()
-        if not file_ext in SUPPORTED_TEXT_EXTENSIONS:
-             self.logger.debug(f"Skipping text extraction for '{filename}': Unsupported extension '{file_ext}'.")
-             return None
-        self.logger.info(f"Attempting text extraction for '{filename}' (extension: {file_ext})")
+    def _download_head_by_path(self, file_path: str, max_bytes: int) -> io.BytesIO:
+        # Reads the download stream only up to max_bytes and drops the connection; the size limit doesn't apply
+        metadata, response = self.dbx.files_download(file_path)
+        file_buffer = io.BytesIO()
         try:
-            if file_ext == '.pdf':
-                if PyPDF2:
-                    # ... pdf extraction ...
-                    pdf_reader = PyPDF2.PdfReader(content_buffer)
-                    text_parts = [page.extract_text() for page in pdf_reader.pages if page.extract_text()]
-                    extracted_text = "\n".join(text_parts).strip()
-                    if not extracted_text: self.logger.warning(f"PyPDF2 extracted no text from '{filename}'.")
-                else: self.logger.warning(f"Cannot extract text from PDF '{filename}': PyPDF2 not available.")
-            elif file_ext == '.docx':
-                if docx:
-                     # ... docx extraction ...
-                     document = docx.Document(content_buffer)
-                     extracted_text = "\n".join([para.text for para in document.paragraphs]).strip()
-                else: self.logger.warning(f"Cannot extract text from DOCX '{filename}': python-docx not available.")
-            elif file_ext in ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml'):
-                # ... plain text extraction ...
-                raw_bytes = content_buffer.getvalue(); extracted_text = None
-                try: extracted_text = raw_bytes.decode('utf-8').strip()
-                except UnicodeDecodeError:
-                     self.logger.warning(f"UTF-8 decoding failed for '{filename}', trying latin-1.")
-                     try: extracted_text = raw_bytes.decode('latin-1').strip()
-                     except Exception as decode_err: self.logger.error(f"Could not decode text file '{filename}': {decode_err}")
-            else: self.logger.debug(f"No specific text extraction logic for extension '{file_ext}' in file '{filename}'.")
-        except PyPDF2.errors.PdfReadError as pdf_err: self.logger.error(f"Error reading PDF '{filename}' with PyPDF2: {pdf_err}")
-        except Exception as e: self.logger.error(f"Failed to extract text from '{filename}': {e}", exc_info=True); extracted_text = None
-        if extracted_text: self.logger.info(f"Successfully extracted text from '{filename}' (length: {len(extracted_text)} chars).")
-        else: self.logger.warning(f"Could not extract text from '{filename}' (extension: {file_ext}).")
-        return extracted_text if extracted_text else None
+            for data in response.iter_content(chunk_size=min(max_bytes, DOWNLOAD_CHUNK_SIZE)):
+                file_buffer.write(data[:max_bytes - file_buffer.tell()])
+                if file_buffer.tell() >= max_bytes:
+                    break
+        finally:
+            response.close()
+        self.logger.info(f"Downloaded first {file_buffer.tell()} bytes of Dropbox path: {file_path}")
+        file_buffer.seek(0)
+        return file_buffer
+
+    def extract_text_from_content(self, content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None, max_chars: Optional[int] = None) -> Optional[str]:
+        """Extracts text from a BytesIO buffer based on filename extension, stopping once max_chars are collected."""
+        return extract_text(content_buffer, filename, mime_type, max_chars)
+
+    def extract_text_by_path(self, file_path: str, file_name: str, file_id: Optional[str] = None, revision: Optional[str] = None,
+                             parse: Optional[Callable] = None, max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Extracted text of a Dropbox file, served from the extraction cache when this content_hash was parsed before.
+        parse(buffer, name, mime_type, max_chars) replaces the in-thread parser (e.g. TextExtraction.extract_text_in_pool).
+        With max_chars, only the head of plain-text files is downloaded and PDF/DOCX parsing stops early.
+        """
+        def _download_and_extract():
+            buffer = self.download_file_content_by_path(file_path, max_bytes=head_bytes_for(file_name, max_chars))
+            if buffer is None:
+                return None
+            try: return (parse or self.extract_text_from_content)(buffer, file_name, None, max_chars)
+            finally: buffer.close()
+        return ExtractionCache().get_or_extract("Dropbox", file_id, revision, _download_and_extract, max_chars)
 
     def download_file(self, file_path: str, save_path: str):
         """
@@ -266,7 +274,13 @@ class DropBoxFile(FileHandler):
     def download_and_merge_chunks(self, file_name, save_path):
         """Download and merge chunked files from Dropbox."""
         os.makedirs(save_path, exist_ok=True)
-    
+
+        # Files uploaded through ChunkUploader have a manifest: fetch chunks in parallel, straight into place
+        assembler = ChunkAssembler(self.drive_manager)
+        manifest = assembler.find_manifest(file_name)
+        if manifest:
+            return assembler.assemble(manifest, os.path.join(save_path, file_name))
+
         try:
             result = self.dbx.files_search_v2(query=file_name).matches
             chunk_files = [entry.metadata.get_metadata() for entry in result if ".part" in entry.metadata.name]
@@ -308,12 +322,14 @@ class DropBoxFile(FileHandler):
         with open(merged_file_path, "wb") as merged_file:
             for chunk_path in file_paths:
                 with open(chunk_path, "rb") as chunk:
-                    merged_file.write(chunk.read())
+                    shutil.copyfileobj(chunk, merged_file, DOWNLOAD_CHUNK_SIZE) # Bounded memory per chunk
 
         logging.info(f"Merged file saved at: {merged_file_path}")
 
     def split_and_upload_file(self, file_path, file_name, mimetype, file_size, free_space, metadata):
-        return super().split_and_upload_file(file_path, file_name, mimetype, file_size, free_space, metadata)
+        """Split the file across all connected buckets; chunks are read by byte range from file_path."""
+        with open(file_path, "rb") as stream:
+            return ChunkUploader(self.drive_manager).upload(stream, file_name, mimetype, file_size, metadata)
     
     def update_metadata(self, metadata):
         return super().update_metadata(metadata)
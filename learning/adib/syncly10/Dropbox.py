@@ -5,16 +5,20 @@ import logging
 import dropbox
 from dropbox.exceptions import AuthError, ApiError
 from dropbox.oauth import DropboxOAuth2Flow
-from dropbox.files import FileMetadata, FolderMetadata, DeletedMetadata, SearchOptions, SearchOrderBy, FileStatus, SearchMode # Added more imports
+from dropbox.files import FileMetadata, FolderMetadata, DeletedMetadata, SearchOptions, SearchOrderBy, FileStatus, SearchMode, WriteMode, UploadSessionCursor, CommitInfo # Added more imports
 from Service import Service
+from FileHandler import UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE
 from Database import Database
-from typing import List, Dict, Optional
+from ClientRegistry import get_dropbox_session
+from typing import List, Dict, Optional, Iterator, Tuple
 
 # Set up logging
 # logging.basicConfig(level=logging.INFO) # Configure in api.py or main script
 logger = logging.getLogger(__name__)
 
 class DropboxService(Service):
+    provider = "Dropbox" # Name stored in catalog and metadata documents
+
     def __init__(self, token_dir="tokens", app_key=None, app_secret=None):
         self.token_dir = token_dir
         self.app_key = app_key
@@ -107,6 +111,142 @@ class DropboxService(Service):
         return files_list[:max_results] if max_results else files_list
 
 
+    def _catalog_entry(self, entry: FileMetadata) -> Dict:
+        """Normalizes Dropbox FileMetadata into a catalog entry."""
+        return {
+            "id": entry.id,
+            "name": entry.name,
+            "size": entry.size,
+            "mimeType": None,
+            "modifiedTime": entry.server_modified.isoformat() + "Z" if entry.server_modified else None,
+            "content_hash": entry.content_hash,
+            "path_lower": entry.path_lower,
+            # Temporary links expire after a few hours, so the catalog keeps a stable identifier
+            "path": f"dropbox:{entry.path_lower}",
+            "provider": "Dropbox",
+            "bucket": self.bucket_number,
+        }
+
+    def iterFiles(self, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        Yields every file in the account (recursive), following list_folder cursors.
+        No temporary links are requested per file; this feeds the file catalog.
+        Errors are raised so the indexer can keep the previous catalog for this bucket.
+        """
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        result = self.service.files_list_folder(path="", recursive=True, limit=min(page_size, 2000))
+        while True:
+            for entry in result.entries:
+                if isinstance(entry, FileMetadata):
+                    yield self._catalog_entry(entry)
+            if not result.has_more:
+                break
+            result = self.service.files_list_folder_continue(result.cursor)
+
+    def getChangeCursor(self) -> str:
+        """Returns the latest recursive list_folder cursor for the whole account."""
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        return self.service.files_list_folder_get_latest_cursor(path="", recursive=True).cursor
+
+    def listChanges(self, cursor: str) -> Tuple[List[Dict], str]:
+        """
+        Lists changes since the cursor with files_list_folder_continue.
+        Deleted entries only carry a path (a deleted folder removes everything below it).
+        """
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        changes = []
+        result = self.service.files_list_folder_continue(cursor)
+        while True:
+            for entry in result.entries:
+                if isinstance(entry, FileMetadata):
+                    changes.append({"removed": False, "id": entry.id, "path_lower": entry.path_lower, "entry": self._catalog_entry(entry)})
+                elif isinstance(entry, DeletedMetadata):
+                    changes.append({"removed": True, "id": None, "path_lower": entry.path_lower, "entry": None})
+            if not result.has_more:
+                logger.info(f"Dropbox (Bucket {self.bucket_number}) returned {len(changes)} changes since last sync.")
+                return changes, result.cursor
+            result = self.service.files_list_folder_continue(result.cursor)
+
+    def findFile(self, name: str) -> Optional[Dict]:
+        """
+        Looks up a file by exact name: first at the root (where Syncly uploads go),
+        then with a filename search anywhere in the account.
+        """
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        try:
+            entry = self.service.files_get_metadata(f"/{name}")
+            if isinstance(entry, FileMetadata):
+                return self._catalog_entry(entry)
+        except ApiError as err:
+            if not (err.error.is_path() and err.error.get_path().is_not_found()):
+                raise
+        result = self.service.files_search_v2(name, options=SearchOptions(filename_only=True, max_results=20))
+        for match in result.matches:
+            entry = match.metadata.get_metadata()
+            if isinstance(entry, FileMetadata) and entry.name.lower() == name.lower():
+                return self._catalog_entry(entry)
+        return None
+
+    def uploadStream(self, stream, name: str, size: int, mimetype: Optional[str] = None) -> Dict:
+        """
+        Uploads a stream as /name, holding at most UPLOAD_CHUNK_SIZE bytes in memory.
+        Small files use a single files_upload call, larger ones an upload session
+        (files_upload_session_start / append_v2 / finish). Errors are raised to the caller.
+        Existing objects are never overwritten (manifests may share them through dedup):
+        a name taken by different content is autorenamed, so record the returned name and path.
+        """
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        dropbox_path = f"/{name}"
+        if size <= UPLOAD_CHUNK_SIZE:
+            metadata = self.service.files_upload(stream.read(size), dropbox_path, mode=WriteMode("add"), autorename=True)
+        else:
+            session = self.service.files_upload_session_start(stream.read(UPLOAD_CHUNK_SIZE))
+            cursor = UploadSessionCursor(session_id=session.session_id, offset=UPLOAD_CHUNK_SIZE)
+            commit = CommitInfo(path=dropbox_path, mode=WriteMode("add"), autorename=True)
+            while size - cursor.offset > UPLOAD_CHUNK_SIZE:
+                self.service.files_upload_session_append_v2(stream.read(UPLOAD_CHUNK_SIZE), cursor)
+                cursor.offset += UPLOAD_CHUNK_SIZE
+                logger.debug(f"Uploading '{dropbox_path}' to Dropbox (Bucket {self.bucket_number}): {cursor.offset}/{size} bytes")
+            metadata = self.service.files_upload_session_finish(stream.read(size - cursor.offset), cursor, commit)
+        return {"file_id": metadata.id, "name": metadata.name, "path": metadata.path_display, "size": metadata.size}
+
+    def iterDownload(self, file_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields [start, end) of a file in DOWNLOAD_CHUNK_SIZE blocks without buffering the whole body.
+        Whole files stream from files_download; ranges use a temporary link with an HTTP Range header.
+        """
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        if start == 0 and end is None:
+            _, response = self.service.files_download(file_id)
+        else:
+            link = self.service.files_get_temporary_link(file_id).link
+            byte_range = f"bytes={start}-{end - 1}" if end is not None else f"bytes={start}-"
+            response = get_dropbox_session().get(link, headers={"Range": byte_range}, stream=True, timeout=60)
+            response.raise_for_status()
+        with response:
+            for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if block: yield block
+
+    def temporaryLink(self, file_id: str) -> str:
+        """A direct download link for a file (id or path), valid for four hours. Errors are raised."""
+        if not self.service:
+            raise ValueError("Dropbox service not authenticated. Call authenticate() first.")
+        return self.service.files_get_temporary_link(file_id).link
+
+    def deleteFile(self, file_id: str) -> bool:
+        """Deletes a file; Dropbox accepts "id:..." identifiers wherever a path is expected."""
+        if not self.service: logger.error("Service not authenticated."); return False
+        try:
+            self.service.files_delete_v2(file_id)
+            return True
+        except ApiError as err: logger.error(f"Failed to delete Dropbox file {file_id} (Bucket {self.bucket_number}): {err}"); return False
+
     def check_storage(self) -> tuple[int, int]:
         """
         Check the storage quota for the authenticated Dropbox account.
@@ -167,6 +307,7 @@ class DropboxService(Service):
                         "id": metadata.id, "name": metadata.name, "size": metadata.size,
                         "path_lower": metadata.path_lower, "path": file_link,
                         "provider": "Dropbox", "bucket": self.bucket_number,
+                        "revision": metadata.content_hash or metadata.rev,
                         "access_token": access_token
                     })
                     count += 1
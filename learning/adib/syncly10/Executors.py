@@ -0,0 +1,106 @@
+# --- START OF FILE Executors.py ---
+
+import os
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from Database import Database
+
+# --- Async MongoDB Driver ---
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError: AsyncIOMotorClient = None; logging.warning("motor not installed, MongoDB calls from the API run on the 'mongo' thread pool...")
+
+logger = logging.getLogger(__name__)
+
+# Thread pool sizes. Provider pools bound how many calls to one provider run at once across all requests;
+# "drives" runs request work that spans several buckets (loading a user's drives, catalog reads, locating files).
+EXECUTOR_WORKERS = {
+    "GoogleDrive": int(os.getenv("GDRIVE_EXECUTOR_WORKERS", 16)),
+    "Dropbox": int(os.getenv("DROPBOX_EXECUTOR_WORKERS", 16)),
+    "drives": int(os.getenv("DRIVES_EXECUTOR_WORKERS", 16)),
+    "mongo": int(os.getenv("MONGO_EXECUTOR_WORKERS", 8)),
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Returns the shared thread pool for a provider ("GoogleDrive", "Dropbox") or for "drives"/"mongo" work."""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            if name not in EXECUTOR_WORKERS:
+                raise ValueError(f"Unknown executor '{name}'")
+            executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS[name], thread_name_prefix=f"exec-{name}")
+            _executors[name] = executor
+        return executor
+
+
+async def run_in(name: str, fn: Callable, *args, **kwargs) -> Any:
+    """Awaits a blocking call on the named executor, keeping the event loop free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(name), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    """Stops all executors (called on API shutdown); queued calls are cancelled."""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
+
+
+class AsyncCollection:
+    """
+    Awaitable subset of a MongoDB collection for request handlers. Uses motor when it is installed,
+    otherwise the synchronous Database collection on the "mongo" executor.
+    """
+    _motor_db = None
+    _motor_lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @classmethod
+    def _motor_database(cls):
+        with cls._motor_lock:
+            if cls._motor_db is None:
+                mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+                db_name = os.getenv("MONGODB_DB_NAME", "Syncly")
+                cls._motor_db = AsyncIOMotorClient(mongo_uri, serverSelectionTimeoutMS=5000)[db_name]
+                logger.info(f"Motor client created for database '{db_name}'.")
+            return cls._motor_db
+
+    def _sync_collection(self):
+        db = Database.get_instance()
+        collection = getattr(db, f"{self.name}_collection", None) if db else None
+        if collection is None:
+            raise RuntimeError(f"MongoDB collection '{self.name}' unavailable")
+        return collection
+
+    async def _call(self, method: str, *args, **kwargs):
+        if AsyncIOMotorClient:
+            return await getattr(self._motor_database()[self.name], method)(*args, **kwargs)
+        return await run_in("mongo", lambda: getattr(self._sync_collection(), method)(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs) -> Optional[Dict]:
+        return await self._call("find_one", *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._call("insert_one", *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._call("update_one", *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self._call("delete_one", *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs) -> int:
+        return await self._call("count_documents", *args, **kwargs)
+
+# --- END OF FILE Executors.py ---
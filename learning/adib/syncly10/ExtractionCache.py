@@ -0,0 +1,147 @@
+# --- START OF FILE ExtractionCache.py ---
+
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+from pymongo import ASCENDING
+from Database import Database
+
+logger = logging.getLogger(__name__)
+
+# Total size of cached text kept in MongoDB; least recently used entries are evicted beyond this
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", 256))
+# Longer extractions are stored truncated (callers only ever use the head of the text)
+EXTRACTION_CACHE_MAX_TEXT_CHARS = int(os.getenv("EXTRACTION_CACHE_MAX_TEXT_CHARS", 1_000_000))
+# Eviction brings the cache down to this fraction of the cap so it does not run on every insert
+EXTRACTION_CACHE_EVICT_TO = 0.9
+
+
+class ExtractionCache:
+    """
+    Persistent cache of extracted document text, shared by GoogleDriveFile and DropBoxFile.
+    One document per (provider, file_id, revision): the revision is Drive's md5Checksum
+    (modifiedTime for native Docs) or Dropbox's content_hash, so an edited file misses
+    the cache and the stale entry is replaced. Size-bounded with LRU eviction on last_access.
+    """
+    _size_lock = threading.Lock()
+    _total_bytes: Optional[int] = None # Process-local running total, re-read from MongoDB when evicting
+
+    def __init__(self):
+        self.db = Database.get_instance()
+
+    @property
+    def collection(self):
+        return self.db.extraction_cache_collection if self.db else None
+
+    @staticmethod
+    def _key(provider: str, file_id: str, revision: str) -> str:
+        return f"{provider}:{file_id}:{revision}"
+
+    def ensure_indexes(self):
+        """Creates the cache indexes if missing (called from the API startup event)."""
+        if self.collection is None:
+            logger.error("Extraction cache collection unavailable; skipping index setup.")
+            return
+        wanted = {
+            "last_access_index": [("last_access", ASCENDING)],
+            "provider_file_index": [("provider", ASCENDING), ("file_id", ASCENDING)],
+        }
+        existing = self.collection.index_information()
+        for name, keys in wanted.items():
+            if name not in existing:
+                logger.info(f"Creating index '{name}' on 'extraction_cache'...")
+                self.collection.create_index(keys, name=name)
+
+    @staticmethod
+    def _covers(max_chars: Optional[int]) -> Dict:
+        # Entries hold the first max_chars characters of a document (None = all of it)
+        if max_chars is None:
+            return {"max_chars": None}
+        return {"$or": [{"max_chars": None}, {"max_chars": {"$gte": max_chars}}]}
+
+    def get(self, provider: str, file_id: Optional[str], revision: Optional[str], max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Returns cached text for this exact revision (refreshing its LRU position), or None.
+        A partial extraction only satisfies requests whose max_chars is no larger than the one it was made with.
+        """
+        if self.collection is None or not file_id or not revision:
+            return None
+        try:
+            doc = self.collection.find_one_and_update(
+                {"_id": self._key(provider, file_id, revision), **self._covers(max_chars)},
+                {"$set": {"last_access": datetime.utcnow()}},
+                projection={"text": 1}
+            )
+        except Exception as e:
+            logger.warning(f"Extraction cache lookup failed for {provider} file {file_id}: {e}")
+            return None
+        return doc.get("text") if doc else None
+
+    def put(self, provider: str, file_id: Optional[str], revision: Optional[str], text: str, max_chars: Optional[int] = None):
+        """Stores text (extracted with the given max_chars budget) for a file revision, dropping older revisions of the same file."""
+        if self.collection is None or not file_id or not revision or not text:
+            return
+        stored = text[:EXTRACTION_CACHE_MAX_TEXT_CHARS]
+        if len(stored) < len(text):
+            max_chars = min(max_chars or EXTRACTION_CACHE_MAX_TEXT_CHARS, EXTRACTION_CACHE_MAX_TEXT_CHARS)
+        size_bytes = len(stored.encode("utf-8"))
+        now = datetime.utcnow()
+        try:
+            self.collection.delete_many({"provider": provider, "file_id": file_id, "revision": {"$ne": revision}})
+            self.collection.replace_one(
+                {"_id": self._key(provider, file_id, revision)},
+                {"provider": provider, "file_id": file_id, "revision": revision, "text": stored,
+                 "max_chars": max_chars, "size_bytes": size_bytes, "created_at": now, "last_access": now},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Extraction cache store failed for {provider} file {file_id}: {e}")
+            return
+        with self._size_lock:
+            if ExtractionCache._total_bytes is not None:
+                ExtractionCache._total_bytes += size_bytes
+            over = ExtractionCache._total_bytes is None or ExtractionCache._total_bytes > EXTRACTION_CACHE_MAX_MB * 1024 * 1024
+        if over:
+            self._evict()
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is under EXTRACTION_CACHE_EVICT_TO of the cap."""
+        limit = EXTRACTION_CACHE_MAX_MB * 1024 * 1024
+        try:
+            totals = list(self.collection.aggregate([{"$group": {"_id": None, "bytes": {"$sum": "$size_bytes"}}}]))
+            total = totals[0]["bytes"] if totals else 0
+            if total > limit:
+                target = int(limit * EXTRACTION_CACHE_EVICT_TO)
+                victims = []
+                for doc in self.collection.find({}, {"size_bytes": 1}).sort("last_access", ASCENDING):
+                    if total <= target:
+                        break
+                    victims.append(doc["_id"])
+                    total -= doc.get("size_bytes", 0)
+                if victims:
+                    self.collection.delete_many({"_id": {"$in": victims}})
+                    logger.info(f"Extraction cache: evicted {len(victims)} entries, ~{total // (1024 * 1024)} MB remain.")
+        except Exception as e:
+            logger.warning(f"Extraction cache eviction failed: {e}")
+            return
+        with self._size_lock:
+            ExtractionCache._total_bytes = total
+
+    def get_or_extract(self, provider: str, file_id: Optional[str], revision: Optional[str], extract: Callable[[], Optional[str]],
+                       max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Returns cached text for the revision, or runs extract() (download + parse, limited to max_chars) and caches its result.
+        Without a revision the file cannot be validated, so extract() always runs and nothing is stored.
+        """
+        text = self.get(provider, file_id, revision, max_chars)
+        if text is not None:
+            logger.info(f"Extraction cache hit for {provider} file {file_id} (revision {revision}).")
+            return text
+        text = extract()
+        if text:
+            self.put(provider, file_id, revision, text, max_chars)
+        return text
+
+# --- END OF FILE ExtractionCache.py ---
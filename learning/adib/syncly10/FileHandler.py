@@ -1,5 +1,12 @@
+import os
 from abc import ABC, abstractmethod
 
+# Upload window: at most this many bytes of a file are held in memory while uploading.
+# Must be a multiple of 256 KB (Google resumable uploads) and at most 150 MB (Dropbox sessions).
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE_MB", 8)) * 1024 * 1024
+# Download window: size of each ranged request / streamed block when fetching files
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE_MB", 8)) * 1024 * 1024
+
 #abstract class for file upload,split,download,merge,search
 class FileHandler(ABC):
     
@@ -11,6 +18,10 @@ class FileHandler(ABC):
     def upload_file(self, file_path:str,file_name:str,mimetype:str):
         pass
 
+    @abstractmethod
+    def upload_stream(self, stream, file_name:str, mimetype:str, file_size:int):
+        pass
+
     @abstractmethod
     def split_and_upload_file(self,file_path:str, file_name:str, mimetype:str, file_size:str, free_space:str, metadata:str):
         pass
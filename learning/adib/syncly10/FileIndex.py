@@ -0,0 +1,387 @@
+# --- START OF FILE FileIndex.py ---
+
+import os
+import re
+import json
+import time
+import base64
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterable, Tuple
+from pymongo import ASCENDING, UpdateOne, DeleteMany
+from bson import ObjectId
+from Database import Database
+from ChunkTransfer import is_block_name, manifest_refs
+
+logger = logging.getLogger(__name__)
+
+# Catalog entries older than this trigger a background sync on the next listing.
+# Syncs after the first full index are deltas (one round-trip per unchanged bucket), so this can be short.
+FILE_INDEX_REFRESH_SECONDS = int(os.getenv("FILE_INDEX_REFRESH_SECONDS", 60))
+FILE_INDEX_WORKERS = int(os.getenv("FILE_INDEX_WORKERS", 2))
+FILE_INDEX_BATCH_SIZE = 1000 # Documents per bulk_write
+
+# Fields copied from provider entries into catalog documents
+CATALOG_FIELDS = ("name", "size", "mimeType", "modifiedTime", "md5Checksum", "content_hash", "path", "path_lower")
+# Provider of catalog entries for files that live in a chunk manifest rather than one stored object
+MANIFEST_PROVIDER = "Syncly"
+
+
+def encode_page_cursor(name_lower: str, tie_breaker: str) -> str:
+    """Builds the opaque continuation token handed to /viewfiles clients."""
+    payload = json.dumps({"n": name_lower, "i": tie_breaker}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_page_cursor(cursor: str) -> Tuple[str, str]:
+    """Parses a continuation token into (name_lower, tie_breaker). Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(payload["n"]), str(payload["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid page cursor: {e}") from e
+
+
+class FileIndex:
+    """
+    Persistent per-user catalog of files across all buckets, stored in MongoDB
+    next to metadata_collection. One document per (user_id, provider, bucket, file_id).
+    Listing and pagination for /viewfiles are served from here instead of calling
+    listFiles() on every drive.
+    """
+
+    def __init__(self):
+        self.db = Database.get_instance()
+
+    @property
+    def collection(self):
+        return self.db.file_index_collection if self.db else None
+
+    @property
+    def state_collection(self):
+        return self.db.file_index_state_collection if self.db else None
+
+    def ensure_indexes(self):
+        """Creates the catalog indexes if missing (called from the API startup event)."""
+        if self.collection is None or self.state_collection is None:
+            logger.error("File index collections unavailable; skipping index setup.")
+            return
+        wanted = {
+            # Also serves the keyset pagination order (name_lower, _id) used by list_files_page
+            "user_name_lower_id_index": ([("user_id", ASCENDING), ("name_lower", ASCENDING), ("_id", ASCENDING)], {}),
+            "provider_index": ([("provider", ASCENDING)], {}),
+            "bucket_index": ([("bucket", ASCENDING)], {}),
+            "size_index": ([("size", ASCENDING)], {}),
+            "modified_time_index": ([("modifiedTime", ASCENDING)], {}),
+            "user_file_unique_index": ([("user_id", ASCENDING), ("provider", ASCENDING), ("bucket", ASCENDING), ("file_id", ASCENDING)], {"unique": True}),
+            # Content lookups for upload dedup (Drive md5Checksum, Dropbox content_hash)
+            "user_md5_index": ([("user_id", ASCENDING), ("md5Checksum", ASCENDING)], {"sparse": True}),
+            "user_content_hash_index": ([("user_id", ASCENDING), ("content_hash", ASCENDING)], {"sparse": True}),
+        }
+        existing = self.collection.index_information()
+        if "user_name_lower_index" in existing:
+            # Superseded by user_name_lower_id_index
+            self.collection.drop_index("user_name_lower_index")
+        for name, (keys, options) in wanted.items():
+            if name not in existing:
+                logger.info(f"Creating index '{name}' on 'file_index'...")
+                self.collection.create_index(keys, name=name, **options)
+        state_existing = self.state_collection.index_information()
+        if "user_bucket_unique_index" not in state_existing:
+            logger.info("Creating index 'user_bucket_unique_index' on 'file_index_state'...")
+            self.state_collection.create_index([("user_id", ASCENDING), ("bucket_number", ASCENDING)], unique=True, name="user_bucket_unique_index")
+
+    # --- Writes ---
+
+    def _catalog_document(self, entry: Dict, indexed_at: datetime) -> Dict:
+        doc = {field: entry.get(field) for field in CATALOG_FIELDS}
+        doc["name_lower"] = (entry.get("name") or "").lower()
+        doc["indexed_at"] = indexed_at
+        return doc
+
+    def internal_file_ids(self, user_id) -> set:
+        """
+        File ids of objects stored under another name than their file (chunks of split files, autorenamed
+        Dropbox uploads), which are listed through their manifest entry instead.
+        """
+        db = Database.get_instance()
+        if db is None or db.metadata_collection is None:
+            return set()
+        ids = set()
+        query = {"user_id": user_id, "$or": [{"split": True}, {"dedup_of": {"$exists": False}}]} # Aliases may point at the user's own files
+        for doc in db.metadata_collection.find(query, {"file_name": 1, "chunks": 1, "versions.chunks": 1}):
+            ids.update(chunk.get("file_id") for chunk in manifest_refs(doc) if chunk.get("chunk_name") != doc.get("file_name"))
+        return ids
+
+    @staticmethod
+    def _is_internal(entry: Dict, internal_ids: set) -> bool:
+        return is_block_name(entry.get("name")) or entry.get("id") in internal_ids
+
+    def _bulk_upsert(self, user_id, provider: str, bucket_number: int, entries: Iterable[Dict], indexed_at: datetime) -> int:
+        """Upserts catalog entries in batches, returning how many were written. Chunk and block objects are skipped."""
+        count = 0
+        batch = []
+        internal_ids = self.internal_file_ids(user_id)
+        for entry in entries:
+            if not entry.get("id") or self._is_internal(entry, internal_ids):
+                continue
+            batch.append(UpdateOne(
+                {"user_id": user_id, "provider": provider, "bucket": bucket_number, "file_id": entry["id"]},
+                {"$set": self._catalog_document(entry, indexed_at)},
+                upsert=True
+            ))
+            if len(batch) >= FILE_INDEX_BATCH_SIZE:
+                self.collection.bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.collection.bulk_write(batch, ordered=False)
+            count += len(batch)
+        return count
+
+    def replace_bucket(self, user_id, provider: str, bucket_number: int, entries: Iterable[Dict]) -> int:
+        """
+        Rebuilds the catalog of one bucket from a full listing.
+        Entries are upserted as they stream in; documents not seen in this pass are removed afterwards.
+        """
+        indexed_at = datetime.utcnow()
+        count = self._bulk_upsert(user_id, provider, bucket_number, entries, indexed_at)
+        removed = self.collection.delete_many({
+            "user_id": user_id, "provider": provider, "bucket": bucket_number,
+            "indexed_at": {"$lt": indexed_at}
+        }).deleted_count
+        self.set_state(user_id, bucket_number, provider, {"last_full_sync": indexed_at, "last_sync": indexed_at, "file_count": count})
+        logger.info(f"Indexed {count} files for {provider} Bucket {bucket_number} (user {user_id}); removed {removed} stale entries.")
+        return count
+
+    def upsert_files(self, user_id, provider: str, bucket_number: int, entries: Iterable[Dict]) -> int:
+        """Adds or updates individual catalog entries (e.g. right after an upload)."""
+        return self._bulk_upsert(user_id, provider, bucket_number, entries, datetime.utcnow())
+
+    def upsert_manifest(self, user_id, manifest: Dict):
+        """
+        Lists a split, cdc, deduplicated or autorenamed file under its own name. Its chunks are hidden from the catalog,
+        and provider sync passes never remove it (they only touch their own provider and bucket).
+        """
+        entry = {"name": manifest["file_name"], "size": manifest.get("file_size"), "mimeType": manifest.get("mimetype"),
+                 "modifiedTime": datetime.utcnow().isoformat() + "Z", "path": f"syncly:{manifest['file_name']}"}
+        key = {"user_id": user_id, "provider": MANIFEST_PROVIDER, "bucket": None, "file_id": f"manifest:{manifest['file_name']}"}
+        self.collection.update_one(key, {"$set": self._catalog_document(entry, datetime.utcnow())}, upsert=True)
+        if manifest.get("split") or not manifest.get("dedup_of"): # Chunk entries cataloged before the manifest existed
+            self.collection.delete_many({"user_id": user_id, "file_id": {"$in": [c.get("file_id") for c in manifest.get("chunks", [])
+                                                                                   if c.get("chunk_name") != manifest["file_name"]]}})
+
+    def apply_changes(self, user_id, provider: str, bucket_number: int, changes: List[Dict]) -> int:
+        """
+        Applies a delta from Service.listChanges to one bucket's catalog.
+        Removals match on file_id, or on path_lower (and everything below it) for Dropbox.
+        """
+        if not changes:
+            return 0
+        indexed_at = datetime.utcnow()
+        bucket_filter = {"user_id": user_id, "provider": provider, "bucket": bucket_number}
+        internal_ids = self.internal_file_ids(user_id)
+        operations = []
+        for change in changes:
+            if not change.get("removed"):
+                entry = change["entry"]
+                if self._is_internal(entry, internal_ids):
+                    continue
+                operations.append(UpdateOne(dict(bucket_filter, file_id=entry["id"]), {"$set": self._catalog_document(entry, indexed_at)}, upsert=True))
+            elif change.get("id"):
+                operations.append(DeleteMany(dict(bucket_filter, file_id=change["id"])))
+            elif change.get("path_lower"):
+                path_pattern = "^" + re.escape(change["path_lower"]) + "(/|$)"
+                operations.append(DeleteMany(dict(bucket_filter, path_lower={"$regex": path_pattern})))
+        for start in range(0, len(operations), FILE_INDEX_BATCH_SIZE):
+            # Ordered, so a file deleted and re-created within one delta ends up present
+            self.collection.bulk_write(operations[start:start + FILE_INDEX_BATCH_SIZE], ordered=True)
+        return len(operations)
+
+    # --- State ---
+
+    def get_states(self, user_id) -> Dict[int, Dict]:
+        """Returns indexer state documents for a user, keyed by bucket number."""
+        return {s["bucket_number"]: s for s in self.state_collection.find({"user_id": user_id})}
+
+    def set_state(self, user_id, bucket_number: int, provider: str, values: Dict):
+        self.state_collection.update_one(
+            {"user_id": user_id, "bucket_number": bucket_number},
+            {"$set": dict(values, provider=provider)},
+            upsert=True
+        )
+
+    # --- Reads ---
+
+    def _query_filter(self, user_id, query: Optional[str]) -> Dict:
+        filter_ = {"user_id": user_id}
+        if query:
+            filter_["name_lower"] = {"$regex": re.escape(query.lower())}
+        return filter_
+
+    def list_files(self, user_id, query: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict]:
+        """Returns catalog entries sorted by name, shaped like listFiles() results."""
+        cursor = (self.collection.find(self._query_filter(user_id, query))
+                  .sort([("name_lower", ASCENDING), ("_id", ASCENDING)])
+                  .skip(offset).limit(limit))
+        return [self.to_file_info(doc) for doc in cursor]
+
+    def list_files_page(self, user_id, query: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of catalog entries and the continuation token for the next page (None at the end).
+        Pages are bounded by the last (name_lower, _id) seen, so page N costs O(page size) and
+        entries added or removed elsewhere in the list do not shift later pages.
+        """
+        filter_ = self._query_filter(user_id, query)
+        if cursor:
+            name_lower, tie_breaker = decode_page_cursor(cursor)
+            if ObjectId.is_valid(tie_breaker):
+                after = {"$or": [{"name_lower": {"$gt": name_lower}}, {"name_lower": name_lower, "_id": {"$gt": ObjectId(tie_breaker)}}]}
+            else:
+                # Token issued by the live listing fallback, ordered by "provider:file_id" within a name: skip the
+                # entries with that name it already returned, keep the rest (duplicate names across buckets are common)
+                returned = [doc["_id"] for doc in self.collection.find(dict(filter_, name_lower=name_lower), {"provider": 1, "file_id": 1})
+                            if f"{doc.get('provider')}:{doc.get('file_id')}" <= tie_breaker]
+                after = {"$or": [{"name_lower": {"$gt": name_lower}}, {"name_lower": name_lower, "_id": {"$nin": returned}}]}
+            filter_ = {"$and": [filter_, after]}
+        docs = list(self.collection.find(filter_).sort([("name_lower", ASCENDING), ("_id", ASCENDING)]).limit(limit + 1))
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_page_cursor(docs[-1]["name_lower"], str(docs[-1]["_id"]))
+        return [self.to_file_info(doc) for doc in docs], next_cursor
+
+    def find_file(self, user_id, names: List[str]) -> Optional[Dict]:
+        """
+        Returns the catalog entry (FileInfo shape) for the first of names present in the catalog,
+        matching case-insensitively through the (user_id, name_lower) index. None if absent.
+        """
+        if self.collection is None or not names:
+            return None
+        lowered = [name.lower() for name in names]
+        docs = list(self.collection.find({"user_id": user_id, "name_lower": {"$in": lowered}}).limit(50))
+        if not docs:
+            return None
+        # Prefer the earlier candidate name, then an exact-case match
+        docs.sort(key=lambda d: (lowered.index(d["name_lower"]), d.get("name") not in names))
+        return self.to_file_info(docs[0])
+
+    @staticmethod
+    def to_file_info(doc: Dict) -> Dict:
+        """Maps a catalog document onto the FileInfo shape used by the API."""
+        return {
+            "id": doc.get("file_id"), "name": doc.get("name", "Unknown"), "provider": doc.get("provider"),
+            "size": doc.get("size"), "path": doc.get("path") or "N/A", "mimeType": doc.get("mimeType"),
+            "bucket": doc.get("bucket"), "path_lower": doc.get("path_lower"),
+        }
+
+
+class FileIndexer:
+    """
+    Background indexer keeping the FileIndex catalog populated.
+    Runs at most one indexing pass per user at a time on a small thread pool.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(FileIndexer, cls).__new__(cls)
+                    instance.executor = ThreadPoolExecutor(max_workers=FILE_INDEX_WORKERS, thread_name_prefix="file-index")
+                    instance._in_progress = set()
+                    instance._lock = threading.Lock()
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of FileIndexer."""
+        return cls()
+
+    def is_indexed(self, drive_manager) -> bool:
+        """True when every loaded bucket of the user has completed at least one full index."""
+        states = FileIndex().get_states(drive_manager.user_id)
+        return all(getattr(drive, "bucket_number", None) in states and states[drive.bucket_number].get("last_full_sync")
+                   for drive in drive_manager.drives)
+
+    def needs_refresh(self, drive_manager) -> bool:
+        """True when any loaded bucket was last synced more than FILE_INDEX_REFRESH_SECONDS ago."""
+        states = FileIndex().get_states(drive_manager.user_id)
+        now = datetime.utcnow()
+        for drive in drive_manager.drives:
+            state = states.get(getattr(drive, "bucket_number", None))
+            if not state or not state.get("last_sync") or (now - state["last_sync"]).total_seconds() > FILE_INDEX_REFRESH_SECONDS:
+                return True
+        return False
+
+    def schedule(self, drive_manager) -> bool:
+        """Queues a background indexing pass for the user unless one is already running."""
+        key = str(drive_manager.user_id)
+        with self._lock:
+            if key in self._in_progress:
+                return False
+            self._in_progress.add(key)
+        self.executor.submit(self._run, drive_manager, key)
+        logger.info(f"Scheduled background file indexing for user {key}")
+        return True
+
+    def _run(self, drive_manager, key: str):
+        try:
+            self.index_user(drive_manager)
+            # Imported here: SearchIndex builds on this module
+            from SearchIndex import SearchIndexer
+            SearchIndexer.get_instance().schedule(drive_manager) # Re-index new and changed files' content
+        except Exception as e:
+            logger.error(f"Background file indexing failed for user {key}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_progress.discard(key)
+
+    def index_user(self, drive_manager, full: bool = False):
+        """
+        Brings every loaded bucket of the user up to date; one failing bucket keeps its previous catalog.
+        Buckets with a stored change cursor only apply the delta since the last pass; others
+        (or all of them when full is set) are listed completely.
+        """
+        index = FileIndex()
+        states = index.get_states(drive_manager.user_id)
+        started_at = time.monotonic()
+        for drive in drive_manager.drives:
+            bucket_number = getattr(drive, "bucket_number", None)
+            if bucket_number is None:
+                continue
+            provider = drive.provider
+            bucket_started_at = time.monotonic()
+            cursor = None if full else states.get(bucket_number, {}).get("cursor")
+            try:
+                if cursor:
+                    try:
+                        self._sync_bucket_delta(index, drive_manager.user_id, drive, cursor)
+                        logger.info(f"Delta-synced {provider} Bucket {bucket_number} in {time.monotonic() - bucket_started_at:.2f}s")
+                        continue
+                    except Exception as e:
+                        # Expired or reset cursors are recovered with a full listing
+                        logger.warning(f"Delta sync failed for {provider} Bucket {bucket_number}, falling back to full index: {e}")
+                self._sync_bucket_full(index, drive_manager.user_id, drive)
+                logger.info(f"Indexed {provider} Bucket {bucket_number} in {time.monotonic() - bucket_started_at:.2f}s")
+            except Exception as e:
+                logger.error(f"Indexing {provider} Bucket {bucket_number} failed for user {drive_manager.user_id}: {e}", exc_info=True)
+        logger.info(f"File indexing for user {drive_manager.user_id} finished in {time.monotonic() - started_at:.2f}s")
+
+    def _sync_bucket_full(self, index: FileIndex, user_id, drive):
+        # Take the cursor before listing so changes made during the listing are replayed next time
+        cursor = drive.getChangeCursor()
+        index.replace_bucket(user_id, drive.provider, drive.bucket_number, drive.iterFiles())
+        index.set_state(user_id, drive.bucket_number, drive.provider, {"cursor": cursor})
+
+    def _sync_bucket_delta(self, index: FileIndex, user_id, drive, cursor: str):
+        changes, new_cursor = drive.listChanges(cursor)
+        index.apply_changes(user_id, drive.provider, drive.bucket_number, changes)
+        index.set_state(user_id, drive.bucket_number, drive.provider, {"cursor": new_cursor, "last_sync": datetime.utcnow()})
+
+# --- END OF FILE FileIndex.py ---
@@ -2,28 +2,25 @@
 
 import os
 import io
+import shutil
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
 import re
 import logging
-from FileHandler import FileHandler
+from FileHandler import FileHandler, DOWNLOAD_CHUNK_SIZE
 from Database import Database
 from DriveManager import DriveManager
 from GoogleDrive import GoogleDrive
-from typing import Optional, List, Dict
-
-# --- Text Extraction Imports ---
-try:
-    import PyPDF2
-except ImportError: PyPDF2 = None; logging.warning("PyPDF2 not installed...")
-try:
-    import docx
-except ImportError: docx = None; logging.warning("python-docx not installed...")
+from ChunkTransfer import ChunkUploader, ChunkAssembler, use_chunked_upload
+from ContentHash import ContentDedup
+from ClientRegistry import google_thread_http
+from ExtractionCache import ExtractionCache
+from TextExtraction import extract_text, head_bytes_for, SUPPORTED_TEXT_EXTENSIONS
+from typing import Optional, List, Dict, Callable
 
 # --- Constants ---
-SUPPORTED_TEXT_EXTENSIONS = ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml', '.pdf', '.docx')
 MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024 # 50 MB limit
 # List of common file extensions to check
 COMMON_EXTENSIONS = ['.jpg', '.pdf', '.png', '.txt', '.csv', '.docx', '.xlsx', '.java', '.py']
@@ -49,19 +46,16 @@ class GoogleDriveFile(FileHandler):
         return None
 
     def _check_available_space(self, file_size):
-        # Checks storage across GDrive buckets associated with the user
+        # Checks storage across GDrive buckets associated with the user, using the shared quota cache
         free_space = []
         total_free = 0
-        for drive in self.drive_manager.drives:
-            if isinstance(drive, GoogleDrive) and drive.service and hasattr(drive, 'bucket_number'):
-                try:
-                    limit, usage = drive.check_storage() # check_storage is on the GoogleDrive instance
-                    free = limit - usage
-                    if free >= 0:
-                        total_free += free
-                        free_space.append([free, drive.bucket_number]) # Store free space and bucket number
-                except Exception as e:
-                    self.logger.error(f"Error checking storage for GDrive bucket {drive.bucket_number}: {e}")
+        for drive, quota in self.drive_manager.get_drive_quotas():
+            if isinstance(drive, GoogleDrive) and drive.service and hasattr(drive, 'bucket_number') and quota:
+                limit, usage = quota
+                free = limit - usage
+                if free >= 0:
+                    total_free += free
+                    free_space.append([free, drive.bucket_number]) # Store free space and bucket number
 
         if total_free < file_size:
             self.logger.warning(f"Not enough total free space ({total_free} bytes) across GDrive buckets for file size {file_size} bytes.")
@@ -86,32 +80,45 @@ class GoogleDriveFile(FileHandler):
                 self.logger.error("Cannot update metadata: user_id is missing.")
                 return # Stop if user_id is missing
 
+            key = {"user_id": user_id, "file_name": metadata["file_name"]}
+            previous = self.db.metadata_collection.find_one(key)
             self.db.metadata_collection.update_one(
-                {"user_id": user_id, "file_name": metadata["file_name"]},
-                {"$set": metadata},
+                key,
+                {"$set": metadata, "$unset": {"dedup_of": ""}}, # A fresh upload no longer aliases other content
                 upsert=True
             )
             self.logger.info(f"Metadata updated in MongoDB for file: {metadata['file_name']}")
+            if previous: # Re-upload of a name: delete the object it replaced once nothing references it
+                try: ChunkUploader(self.drive_manager).release_unreferenced(previous, key)
+                except Exception as e: self.logger.warning(f"Cleanup of objects replaced by '{metadata['file_name']}' failed: {e}")
         except Exception as e:
              self.logger.error(f"Failed to update metadata in MongoDB: {e}", exc_info=True)
              # Optionally re-raise or handle more gracefully depending on desired behavior
              # raise # Re-raise might stop the upload process entirely
 
-    def _upload_entire_file(self, file_path, file_name, mimetype, best_bucket_info):
-        """Upload the entire file to the best available bucket."""
-        bucket_number = best_bucket_info[1]
-        service = self._get_authenticated_service(bucket_number)
-        if service is None:
-            self.logger.error(f"Failed to get authenticated service for GDrive bucket {bucket_number} during upload.")
+    def _get_drive(self, bucket_number: int) -> Optional[GoogleDrive]:
+        # Finds the authenticated GoogleDrive instance for a given bucket number.
+        for drive in self.drive_manager.drives:
+            if isinstance(drive, GoogleDrive) and getattr(drive, 'bucket_number', None) == bucket_number and drive.service:
+                return drive
+        self.logger.error(f"No matching authenticated GoogleDrive instance found for bucket {bucket_number}.")
+        return None
+
+    def _upload_stream_to_bucket(self, bucket_number, stream, file_name, mimetype, file_size):
+        """
+        Upload a seekable stream to one bucket through a resumable upload session.
+        Only UPLOAD_CHUNK_SIZE bytes are read into memory at a time.
+        """
+        drive = self._get_drive(bucket_number)
+        if drive is None:
             return None
         try:
-            self.logger.info(f"Uploading '{file_name}' to GDrive Bucket {bucket_number}")
-            media = MediaFileUpload(file_path, mimetype=mimetype, resumable=True)
-            file_metadata = {'name': file_name}
-            result = service.files().create(media_body=media, body=file_metadata, fields='id').execute()
-            file_id = result.get("id")
+            self.logger.info(f"Uploading '{file_name}' ({file_size} bytes) to GDrive Bucket {bucket_number}")
+            result = drive.uploadStream(stream, file_name, file_size, mimetype)
+            file_id = result["file_id"]
             self.logger.info(f"Successfully uploaded '{file_name}' to GDrive Bucket {bucket_number}, File ID: {file_id}")
-            return {"chunk_name": file_name, "file_id": file_id, "bucket": bucket_number}
+            self.drive_manager.record_upload(bucket_number, file_size)
+            return {"chunk_name": file_name, "index": 0, "offset": 0, "size": file_size, "provider": drive.provider, "bucket": bucket_number, "file_id": file_id, "path": None}
         except HttpError as error:
             self.logger.error(f"Failed to upload '{file_name}' to GDrive Bucket {bucket_number}: {error}")
             return None
@@ -119,17 +126,35 @@ class GoogleDriveFile(FileHandler):
             self.logger.error(f"Unexpected error uploading '{file_name}' to GDrive Bucket {bucket_number}: {e}", exc_info=True)
             return None
 
+    def _upload_entire_file(self, file_path, file_name, mimetype, best_bucket_info):
+        """Upload the entire file to the best available bucket."""
+        with open(file_path, "rb") as stream:
+            return self._upload_stream_to_bucket(best_bucket_info[1], stream, file_name, mimetype, os.path.getsize(file_path))
+
     def upload_file(self, file_path: str, file_name: str, mimetype: str):
-        """Upload a file to Google Drive and save metadata to MongoDB."""
+        """Upload a file to Google Drive and save metadata to MongoDB. Returns the metadata document."""
         if not os.path.exists(file_path):
              self.logger.error(f"Upload failed: File not found at {file_path}")
              raise FileNotFoundError(f"File not found: {file_path}")
 
-        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as stream:
+            return self.upload_stream(stream, file_name, mimetype, os.path.getsize(file_path))
+
+    def upload_stream(self, stream, file_name: str, mimetype: str, file_size: int):
+        """
+        Upload a seekable binary stream (e.g. the spooled request body) to Google Drive
+        without copying it to a local file first. Returns the metadata document.
+        """
+        # Identical content already stored for this user: record the name, upload nothing
+        linked, content_hashes = ContentDedup(self.drive_manager).check(stream, file_name, mimetype, file_size)
+        if linked:
+            return linked
+
         has_space, free_space_buckets = self._check_available_space(file_size)
-        if not has_space:
-             self.logger.error(f"Upload failed: Not enough space for file '{file_name}' (size: {file_size} bytes)")
-             raise Exception("Not enough storage space available in connected Google Drives.")
+        if not has_space or free_space_buckets[0][0] < file_size or use_chunked_upload(file_size):
+            # No single Google Drive bucket can hold it (or cdc mode is on): split across every connected bucket
+            self.logger.info(f"File '{file_name}' ({file_size} bytes) goes through the chunked pipeline across buckets.")
+            return ChunkUploader(self.drive_manager).upload(stream, file_name, mimetype, file_size, content_hashes)
 
         # Ensure user_id is available in DriveManager
         user_id = getattr(self.drive_manager, 'user_id', None)
@@ -137,30 +162,29 @@ class GoogleDriveFile(FileHandler):
              self.logger.error("Upload failed: Cannot determine user_id from DriveManager.")
              raise Exception("User context missing for metadata.")
 
-        metadata = {"user_id": user_id, "file_name": file_name, "chunks": []} # Add user_id here
+        metadata = {"user_id": user_id, "file_name": file_name, "file_size": file_size, "mimetype": mimetype, "chunks": [], **content_hashes} # Add user_id here
 
         best_bucket_info = free_space_buckets[0]
-
-        if best_bucket_info[0] >= file_size:
-            chunk_metadata = self._upload_entire_file(file_path, file_name, mimetype, best_bucket_info)
-            if chunk_metadata:
-                metadata["chunks"].append(chunk_metadata)
-                self.update_metadata(metadata) # Call corrected metadata update
-            else:
-                 self.logger.error(f"Upload failed for file '{file_name}' due to error in _upload_entire_file.")
-                 raise Exception(f"Failed to upload {file_name} to Google Drive.")
+        chunk_metadata = self._upload_stream_to_bucket(best_bucket_info[1], stream, file_name, mimetype, file_size)
+        if chunk_metadata:
+            metadata["chunks"].append(chunk_metadata)
+            self.update_metadata(metadata) # Call corrected metadata update
+            return metadata
         else:
-            self.logger.warning(f"File '{file_name}' is larger than the single largest free space. Splitting not yet implemented.")
-            raise NotImplementedError("File splitting for Google Drive is not yet implemented.")
+             self.logger.error(f"Upload failed for file '{file_name}' due to error in _upload_stream_to_bucket.")
+             raise Exception(f"Failed to upload {file_name} to Google Drive.")
 
-    def download_file_content_by_id(self, service, file_id: str, file_size: Optional[int] = None) -> Optional[io.BytesIO]:
-        """Downloads file content from Google Drive into an in-memory BytesIO object."""
+    def download_file_content_by_id(self, service, file_id: str, file_size: Optional[int] = None, http=None, max_bytes: Optional[int] = None) -> Optional[io.BytesIO]:
+        """Downloads file content from Google Drive into an in-memory BytesIO object (only the first max_bytes if given)."""
+        if max_bytes:
+            return self._download_head_by_id(service, file_id, max_bytes, http)
         if file_size is not None and file_size > MAX_FILE_SIZE_BYTES:
             self.logger.warning(f"Skipping download for file ID {file_id}: size ({file_size} bytes) exceeds limit ({MAX_FILE_SIZE_BYTES} bytes).")
             return None
         try:
             self.logger.info(f"Attempting to download content for GDrive file ID: {file_id}")
             request = service.files().get_media(fileId=file_id)
+            request.http = http or google_thread_http(service._http.credentials) # httplib2 is not thread-safe: never the service's shared transport
             file_buffer = io.BytesIO()
             downloader = MediaIoBaseDownload(file_buffer, request)
             done = False
@@ -182,49 +206,49 @@ class GoogleDriveFile(FileHandler):
             self.logger.error(f"Unexpected error downloading GDrive file ID {file_id}: {e}", exc_info=True)
             return None
 
-    def extract_text_from_content(self, content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None) -> Optional[str]:
-        """Extracts text from a BytesIO buffer based on filename extension."""
-        extracted_text = None
-        file_ext = os.path.splitext(filename)[1].lower()
-        if not file_ext in SUPPORTED_TEXT_EXTENSIONS:
-            self.logger.debug(f"Skipping text extraction for '{filename}': Unsupported extension '{file_ext}'.")
-            return None
-        self.logger.info(f"Attempting text extraction for '{filename}' (extension: {file_ext})")
+    def _download_head_by_id(self, service, file_id: str, max_bytes: int, http=None) -> Optional[io.BytesIO]:
+        # One ranged request for the leading bytes; the size limit doesn't apply since only the head is fetched
         try:
-            if file_ext == '.pdf':
-                if PyPDF2:
-                    # ... pdf extraction logic ...
-                    pdf_reader = PyPDF2.PdfReader(content_buffer)
-                    text_parts = [page.extract_text() for page in pdf_reader.pages if page.extract_text()]
-                    extracted_text = "\n".join(text_parts).strip()
-                    if not extracted_text: self.logger.warning(f"PyPDF2 extracted no text from '{filename}'.")
-                else: self.logger.warning(f"Cannot extract text from PDF '{filename}': PyPDF2 not available.")
-            elif file_ext == '.docx':
-                if docx:
-                    # ... docx extraction logic ...
-                    document = docx.Document(content_buffer)
-                    extracted_text = "\n".join([para.text for para in document.paragraphs]).strip()
-                else: self.logger.warning(f"Cannot extract text from DOCX '{filename}': python-docx not available.")
-            elif file_ext in ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml'):
-                # ... plain text extraction logic ...
-                 raw_bytes = content_buffer.getvalue()
-                 try: extracted_text = raw_bytes.decode('utf-8').strip()
-                 except UnicodeDecodeError:
-                     self.logger.warning(f"UTF-8 decoding failed for '{filename}', trying latin-1.")
-                     try: extracted_text = raw_bytes.decode('latin-1').strip()
-                     except Exception as decode_err: self.logger.error(f"Could not decode text file '{filename}': {decode_err}")
-            else: self.logger.debug(f"No specific text extraction logic for extension '{file_ext}' in file '{filename}'.")
-        except PyPDF2.errors.PdfReadError as pdf_err: self.logger.error(f"Error reading PDF '{filename}' with PyPDF2: {pdf_err}")
-        except Exception as e: self.logger.error(f"Failed to extract text from '{filename}': {e}", exc_info=True); extracted_text = None
-        if extracted_text: self.logger.info(f"Successfully extracted text from '{filename}' (length: {len(extracted_text)} chars).")
-        else: self.logger.warning(f"Could not extract text from '{filename}' (extension: {file_ext}).")
-        return extracted_text if extracted_text else None
+            request = service.files().get_media(fileId=file_id)
+            request.headers["Range"] = f"bytes=0-{max_bytes - 1}"
+            data = request.execute(http=http or google_thread_http(service._http.credentials))
+            self.logger.info(f"Downloaded first {len(data)} bytes of GDrive file ID: {file_id}")
+            return io.BytesIO(data)
+        except HttpError as error:
+            if error.resp.status == 416: return io.BytesIO() # Empty file
+            self.logger.error(f"HTTP error downloading head of GDrive file ID {file_id}: {error}")
+            return None
+        except Exception as e:
+            self.logger.error(f"Unexpected error downloading head of GDrive file ID {file_id}: {e}", exc_info=True)
+            return None
+
+    def extract_text_from_content(self, content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None, max_chars: Optional[int] = None) -> Optional[str]:
+        """Extracts text from a BytesIO buffer based on filename extension, stopping once max_chars are collected."""
+        return extract_text(content_buffer, filename, mime_type, max_chars)
+
+    def extract_text_by_id(self, service, file_id: str, file_name: str, mime_type: Optional[str] = None,
+                           file_size: Optional[int] = None, revision: Optional[str] = None,
+                           parse: Optional[Callable] = None, http=None, max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Extracted text of a Drive file, served from the extraction cache when this revision was parsed before.
+        parse(buffer, name, mime_type, max_chars) replaces the in-thread parser (e.g. TextExtraction.extract_text_in_pool).
+        With max_chars, plain-text files are fetched with a ranged request and PDF/DOCX parsing stops early.
+        """
+        def _download_and_extract():
+            buffer = self.download_file_content_by_id(service, file_id, file_size, http=http, max_bytes=head_bytes_for(file_name, max_chars))
+            if buffer is None:
+                return None
+            try: return (parse or self.extract_text_from_content)(buffer, file_name, mime_type, max_chars)
+            finally: buffer.close()
+        return ExtractionCache().get_or_extract("GoogleDrive", file_id, revision, _download_and_extract, max_chars)
 
     def download_file(self, service, file_id: str, save_path: str):
         """Download a file from Google Drive."""
         try:
+            http = google_thread_http(service._http.credentials)
             request = service.files().get_media(fileId=file_id)
-            file_metadata = service.files().get(fileId=file_id, fields="name").execute()
+            request.http = http
+            file_metadata = service.files().get(fileId=file_id, fields="name").execute(http=http)
             file_name = file_metadata.get("name")  # Preserve the original file name with extension
             save_file_path = os.path.join(save_path, file_name)
             
@@ -247,16 +271,22 @@ class GoogleDriveFile(FileHandler):
         with open(merged_file_path, "wb") as merged_file:
             for chunk_path in file_paths:
                 with open(chunk_path, "rb") as chunk:
-                    merged_file.write(chunk.read())
+                    shutil.copyfileobj(chunk, merged_file, DOWNLOAD_CHUNK_SIZE) # Bounded memory per chunk
         print(f"Merged file saved at: {merged_file_path}")
 
     def download_and_merge_chunks(self, service, file_name: str, save_path: str = "downloads"):
         """Download and merge file chunks into a single file."""
         os.makedirs(save_path, exist_ok=True)
 
+        # Files uploaded through ChunkUploader have a manifest: fetch chunks in parallel, straight into place
+        assembler = ChunkAssembler(self.drive_manager)
+        manifest = assembler.find_manifest(file_name)
+        if manifest:
+            return assembler.assemble(manifest, os.path.join(save_path, file_name))
+
         # Check if the full file exists first
         query = f"name contains '{file_name}' and not name contains '.part'"
-        result = service.files().list(q=query, fields="files(id, name)").execute()
+        result = service.files().list(q=query, fields="files(id, name)").execute(http=google_thread_http(service._http.credentials))
         files = result.get("files", [])
         
         if files:
@@ -266,7 +296,7 @@ class GoogleDriveFile(FileHandler):
         
         # If full file not found, check for chunks
         query = f"name contains '{file_name}.part'"
-        results = service.files().list(q=query, fields="files(id, name)").execute()
+        results = service.files().list(q=query, fields="files(id, name)").execute(http=google_thread_http(service._http.credentials))
         chunk_files = results.get("files", [])
         
         # Sort chunks numerically by part number
@@ -293,73 +323,21 @@ class GoogleDriveFile(FileHandler):
         return merged_file_path
 
     def download_from_all_buckets(self, file_name: str, save_path: str = "downloads"):
-        """Download a file from all buckets."""
+        """
+        Download a file from whichever bucket(s) hold it.
+        The file is located through DriveManager.locate_file (manifest, then catalog, then one
+        concurrent search); names without an extension also try COMMON_EXTENSIONS in the indexed lookups.
+        """
         # Remove quotation marks from the save path (if any)
         save_path = save_path.strip('"').strip("'")
-
-        # Create the save directory if it doesn't exist
         os.makedirs(save_path, exist_ok=True)
 
-        bucket_numbers = self.drive_manager.get_all_authenticated_buckets()
-        if not bucket_numbers:
-            print("No authenticated buckets found. Please add a new bucket first.")
-            return
-
-        # Check if the full file exists in any bucket
-        for bucket in bucket_numbers:
-            try:
-                print(f"Authenticating bucket {bucket}...")
-                service = self.google_drive.authenticate(int(bucket), self.drive_manager.user_id)  # Pass user_id here
-                if service is None:
-                    print(f"Failed to authenticate bucket {bucket}.")
-                    continue
-                
-                # Search for the file in the current bucket
-                query = f"name contains '{file_name}' and not name contains '.part'"
-                result = service.files().list(q=query, fields="files(id, name)").execute()
-                files = result.get("files", [])
-
-                if files:
-                    file_id = files[0]["id"]
-                    print(f"Downloading file from bucket {bucket}...")
-                    downloaded_file = self.download_file(service, file_id, save_path)
-                    if downloaded_file:
-                        print(f"Download complete: {downloaded_file}")
-                        return downloaded_file
-                else:
-                    print(f"File not found in bucket {bucket}.")
-            except Exception as e:
-                print(f"Error downloading from bucket {bucket}: {e}")
-
-            # If the exact file name is not found, try with common extensions
-            for ext in COMMON_EXTENSIONS:
-                full_file_name = f"{file_name}{ext}"
-                for bucket in bucket_numbers:
-                    try:
-                        print(f"Authenticating bucket {bucket} for file {full_file_name}...")
-                        service = self.google_drive.authenticate(int(bucket), self.drive_manager.user_id)  # Pass user_id here
-                        if service is None:
-                            print(f"Failed to authenticate bucket {bucket}.")
-                            continue
-                        
-                        # Search for the file in the current bucket
-                        query = f"name contains '{full_file_name}' and not name contains '.part'"
-                        result = service.files().list(q=query, fields="files(id, name)").execute()
-                        files = result.get("files", [])
-
-                        if files:
-                            file_id = files[0]["id"]
-                            print(f"Downloading file from bucket {bucket}...")
-                            downloaded_file = self.download_file(service, file_id, save_path)
-                            if downloaded_file:
-                                print(f"Download complete: {downloaded_file}")
-                                return downloaded_file
-                        else:
-                            print(f"File not found in bucket {bucket}.")
-                    except Exception as e:
-                        print(f"Error downloading from bucket {bucket}: {e}")
-
-        print("File not found in any bucket.")
+        manifest = self.drive_manager.locate_file(file_name, extensions=COMMON_EXTENSIONS if not os.path.splitext(file_name)[1] else ())
+        if not manifest:
+            self.logger.info(f"File '{file_name}' not found in any bucket.")
+            return None
+        output_path = os.path.join(save_path, os.path.basename(manifest.get("file_name") or file_name))
+        return ChunkAssembler(self.drive_manager).assemble(manifest, output_path)
 
     def search_file(self):
         """Search for files in Google Drive."""
@@ -368,32 +346,12 @@ class GoogleDriveFile(FileHandler):
             self.drive_manager.list_files_from_all_buckets(query=query)
 
     def split_and_upload_file(self, file_path, file_name, mimetype, file_size, free_space, metadata):
-        """Split the file into chunks and upload them to available buckets."""
-        offset = 0
-        chunk_index = 0
-
-        with open(file_path, "rb") as file:
-            while offset < file_size:
-                selected_bucket = self._find_bucket_with_space(free_space)
-                if not selected_bucket:
-                    print("No available accounts with free space.")
-                    break
-
-                chunk_size = min(selected_bucket[0], file_size - offset)
-                chunk_filename = self._create_chunk_file(file_path, chunk_index, chunk_size)
-
-                uploaded = self._upload_chunk_to_bucket(chunk_filename, selected_bucket, file_name, chunk_index)
-                if not uploaded:
-                    raise RuntimeError("Failed to upload chunk after retries")
-
-                chunk_name = f"{file_name}_part{chunk_index}"
-                self._update_metadata_and_space(metadata, chunk_name, selected_bucket, chunk_size)
-
-                offset += chunk_size
-                chunk_index += 1
-                os.remove(chunk_filename)
-
-        return metadata
+        """
+        Split the file into chunks and upload them to available buckets (Google Drive and Dropbox).
+        Chunks are read by byte range from file_path; free_space is recomputed from current quotas.
+        """
+        with open(file_path, "rb") as stream:
+            return ChunkUploader(self.drive_manager).upload(stream, file_name, mimetype, file_size, metadata)
 
     def upload_chunk(self, service, chunk_filename: str, mimetype: str, file_name: str, chunk_index: int):
         """
@@ -402,7 +360,7 @@ class GoogleDriveFile(FileHandler):
         media = MediaFileUpload(chunk_filename, mimetype=mimetype, resumable=True)
         chunk_name = f"{file_name}_part{chunk_index + 1}"
         file_metadata = {'name': chunk_name}
-        result = service.files().create(media_body=media, body=file_metadata).execute()
+        result = service.files().create(media_body=media, body=file_metadata).execute(http=google_thread_http(service._http.credentials))
         return result.get("id")
 
 
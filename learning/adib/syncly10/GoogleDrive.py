@@ -5,15 +5,20 @@ import logging
 import io # Keep io import if used elsewhere, not directly needed here
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 from Service import Service
+from FileHandler import UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE
 from Database import Database
-from typing import List, Dict, Optional
+from ClientRegistry import google_thread_http
+from typing import List, Dict, Optional, Iterator, Tuple
 
 # Set up logging
 # logging.basicConfig(level=logging.INFO) # Configure in api.py or main script
 logger = logging.getLogger(__name__)
 
 class GoogleDrive(Service):
+    provider = "GoogleDrive" # Name stored in catalog and metadata documents
+
     def __init__(self, token_dir="tokens", credentials_file="credentials.json"):
         self.token_dir = token_dir
         self.credentials_file = credentials_file
@@ -72,7 +77,7 @@ class GoogleDrive(Service):
                     q=query_filter,
                     # Use default corpora and spaces (usually 'user' and 'drive')
                     orderBy="name" # Sort alphabetically
-                ).execute()
+                ).execute(http=self.thread_http())
 
                 page_files = results.get("files", [])
                 logger.debug(f"Got {len(page_files)} files from Google Drive page.")
@@ -113,6 +118,150 @@ class GoogleDrive(Service):
         return files_list[:max_results] if max_results else files_list
 
 
+    # Fields requested for catalog entries (see iterFiles)
+    CATALOG_FIELDS = "id, name, mimeType, size, modifiedTime, md5Checksum, webViewLink"
+    FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+    def _catalog_entry(self, file: Dict) -> Dict:
+        """Normalizes a Drive file resource into a catalog entry."""
+        return {
+            "id": file.get("id"),
+            "name": file.get("name", "Unknown"),
+            "size": int(file["size"]) if file.get("size") else None, # Google Docs have no size
+            "mimeType": file.get("mimeType"),
+            "modifiedTime": file.get("modifiedTime"),
+            "md5Checksum": file.get("md5Checksum"),
+            "path": file.get("webViewLink", f"https://drive.google.com/file/d/{file.get('id')}/view"),
+            "provider": "GoogleDrive",
+            "bucket": self.bucket_number,
+        }
+
+    def iterFiles(self, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        Yields every non-trashed file (folders excluded) in the Drive, page by page.
+        Unlike listFiles there is no INTERNAL_FETCH_LIMIT; this feeds the file catalog.
+        Errors are raised so the indexer can keep the previous catalog for this bucket.
+        """
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                pageSize=min(page_size, 1000),
+                fields=f"nextPageToken, files({self.CATALOG_FIELDS})",
+                pageToken=page_token,
+                q="trashed = false",
+            ).execute(http=self.thread_http())
+            for file in results.get("files", []):
+                if file.get("mimeType") == self.FOLDER_MIME_TYPE:
+                    continue
+                yield self._catalog_entry(file)
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+
+    def getChangeCursor(self) -> str:
+        """Returns the current start page token of the Drive changes feed."""
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        return self.service.changes().getStartPageToken().execute(http=self.thread_http())["startPageToken"]
+
+    def listChanges(self, cursor: str) -> Tuple[List[Dict], str]:
+        """
+        Lists Drive changes since the given page token using changes().list.
+        An unchanged Drive costs a single request that only returns newStartPageToken.
+        """
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        changes = []
+        page_token = cursor
+        while True:
+            results = self.service.changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                spaces="drive",
+                includeRemoved=True,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({self.CATALOG_FIELDS}, trashed))"
+            ).execute(http=self.thread_http())
+            for change in results.get("changes", []):
+                file = change.get("file")
+                if change.get("removed") or not file or file.get("trashed"):
+                    changes.append({"removed": True, "id": change.get("fileId"), "path_lower": None, "entry": None})
+                elif file.get("mimeType") != self.FOLDER_MIME_TYPE:
+                    changes.append({"removed": False, "id": file.get("id"), "path_lower": None, "entry": self._catalog_entry(file)})
+            if "newStartPageToken" in results:
+                logger.info(f"Google Drive (Bucket {self.bucket_number}) returned {len(changes)} changes since last sync.")
+                return changes, results["newStartPageToken"]
+            page_token = results.get("nextPageToken")
+
+    def findFile(self, name: str) -> Optional[Dict]:
+        """Looks up a non-trashed file by exact name with one files.list call."""
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        escaped = name.replace("\\", "\\\\").replace("'", "\\'")
+        results = self.service.files().list(
+            q=f"name = '{escaped}' and trashed = false and mimeType != '{self.FOLDER_MIME_TYPE}'",
+            pageSize=1,
+            fields=f"files({self.CATALOG_FIELDS})",
+        ).execute(http=self.thread_http())
+        files = results.get("files", [])
+        return self._catalog_entry(files[0]) if files else None
+
+    def thread_http(self):
+        """
+        Returns an authorized HTTP transport owned by the calling thread.
+        httplib2 connections are not thread-safe, so concurrent chunk uploads to the same
+        bucket must not share self.service's transport; the credentials are shared.
+        The transport is kept in ClientRegistry, so its connection outlives this instance.
+        """
+        return google_thread_http(self.service._http.credentials)
+
+    def uploadStream(self, stream, name: str, size: int, mimetype: Optional[str] = None) -> Dict:
+        """
+        Uploads a seekable stream through a resumable upload session, reading only
+        UPLOAD_CHUNK_SIZE bytes at a time. Safe to call from several threads at once.
+        Errors are raised to the caller.
+        """
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        media = MediaIoBaseUpload(stream, mimetype=mimetype or "application/octet-stream", chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = self.service.files().create(media_body=media, body={'name': name}, fields='id')
+        http = self.thread_http()
+        result = None
+        while result is None:
+            status, result = request.next_chunk(http=http, num_retries=2)
+            if status: logger.debug(f"Uploading '{name}' to Google Drive (Bucket {self.bucket_number}): {int(status.progress() * 100)}%")
+        return {"file_id": result.get("id"), "path": None, "size": size}
+
+    def iterDownload(self, file_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields [start, end) of a file using ranged get_media requests of DOWNLOAD_CHUNK_SIZE,
+        so only one block is held in memory. Safe to call from several threads at once.
+        """
+        if not self.service:
+            raise ValueError("Google Drive service not authenticated. Call authenticate() first.")
+        http = self.thread_http()
+        if end is None:
+            end = int(self.service.files().get(fileId=file_id, fields="size").execute(http=http).get("size", 0))
+        position = start
+        while position < end:
+            block_end = min(position + DOWNLOAD_CHUNK_SIZE, end)
+            request = self.service.files().get_media(fileId=file_id)
+            request.headers["Range"] = f"bytes={position}-{block_end - 1}"
+            data = request.execute(http=http, num_retries=2)
+            if not data:
+                break
+            position += len(data)
+            yield data
+
+    def deleteFile(self, file_id: str) -> bool:
+        """Deletes a file permanently (bypassing the trash)."""
+        if not self.service: logger.error("Service not authenticated."); return False
+        try:
+            self.service.files().delete(fileId=file_id).execute(http=self.thread_http())
+            return True
+        except HttpError as error: logger.error(f"Failed to delete Google Drive file {file_id} (Bucket {self.bucket_number}): {error}"); return False
+
     def check_storage(self) -> tuple[int, int]:
         """
         Check the storage quota for the authenticated Google Drive account.
@@ -120,7 +269,7 @@ class GoogleDrive(Service):
         """
         if not self.service: logger.error("Service not authenticated."); return 0, 0
         try:
-            res = self.service.about().get(fields='storageQuota').execute()
+            res = self.service.about().get(fields='storageQuota').execute(http=self.thread_http())
             limit = int(res['storageQuota'].get('limit', 0)); usage = int(res['storageQuota'].get('usage', 0))
             logger.info(f"Google Drive Storage (Bucket {self.bucket_number}): {usage / (1024**3):.2f} GB used / {limit / (1024**3):.2f} GB total.")
             return limit, usage
@@ -129,6 +278,34 @@ class GoogleDrive(Service):
 
 # In GoogleDrive.py
 
+    # Fields requested for search results (see _search_entry)
+    SEARCH_FIELDS = "id, name, mimeType, size, webViewLink, md5Checksum, modifiedTime"
+
+    @staticmethod
+    def search_query(query: str) -> Optional[str]:
+        """
+        Builds the files.list q expression matching ANY of the space-separated keywords
+        in name or content (OR logic), or None when there are no keywords.
+        """
+        query_parts = []
+        for keyword in query.split():
+            safe_keyword = keyword.replace("'", "\\'") # Escape single quotes
+            query_parts.append(f"name contains '{safe_keyword}'")
+            query_parts.append(f"fullText contains '{safe_keyword}'")
+        if not query_parts:
+            return None
+        return f"({' or '.join(query_parts)}) and trashed = false"
+
+    def _search_entry(self, file: Dict) -> Dict:
+        """Normalizes a Drive file resource into a search result."""
+        return {
+            "id": file.get("id"), "name": file.get("name", "Unknown"),
+            "size": file.get("size"), "mimeType": file.get("mimeType"),
+            "path": file.get("webViewLink", f"https://drive.google.com/file/d/{file.get('id')}/view"),
+            "provider": "GoogleDrive", "bucket": self.bucket_number,
+            "revision": file.get("md5Checksum") or file.get("modifiedTime") # Native Docs have no md5
+        }
+
     def searchFiles(self, query: str, limit: int = 10) -> List[Dict]:
         """
         Searches for files matching the query string (keywords) in name or content using OR logic.
@@ -140,27 +317,11 @@ class GoogleDrive(Service):
         files_list = []
         page_token = None
 
-        # --- Build OR Query ---
-        keywords = query.split() # Assumes keywords are space-separated
-        if not keywords:
+        search_query = self.search_query(query)
+        if not search_query:
              logger.warning("Empty keyword list received for GDrive search.")
              return []
 
-        query_parts = []
-        for keyword in keywords:
-            safe_keyword = keyword.replace("'", "\\'") # Escape single quotes
-            if safe_keyword: # Avoid empty strings
-                query_parts.append(f"name contains '{safe_keyword}'")
-                query_parts.append(f"fullText contains '{safe_keyword}'")
-
-        if not query_parts:
-             logger.warning("No valid query parts generated for GDrive search.")
-             return []
-
-        # Combine parts with 'or', add 'trashed = false'
-        search_query = f"({' or '.join(query_parts)}) and trashed = false"
-        # --- End Build OR Query ---
-
         logger.info(f"Executing Google Drive OR search (Bucket {self.bucket_number}) with query: {search_query}")
 
         try:
@@ -169,19 +330,13 @@ class GoogleDrive(Service):
                 page_size = min(limit - len(files_list), 100)
                 results = self.service.files().list(
                     pageSize=page_size,
-                    fields="nextPageToken, files(id, name, mimeType, size, webViewLink)",
+                    fields=f"nextPageToken, files({self.SEARCH_FIELDS})",
                     pageToken=page_token,
-                    q=search_query,
-                    orderBy="modifiedTime desc" # Prioritize recently modified? Or relevance? Drive default might be okay.
-                ).execute()
+                    q=search_query # No orderBy: fullText queries come back in Drive's relevance order
+                ).execute(http=self.thread_http()) # Searches of several buckets run concurrently
 
                 for file in results.get("files", []):
-                    files_list.append({
-                        "id": file.get("id"), "name": file.get("name", "Unknown"),
-                        "size": file.get("size"), "mimeType": file.get("mimeType"),
-                        "path": file.get("webViewLink", f"https://drive.google.com/file/d/{file.get('id')}/view"),
-                        "provider": "GoogleDrive", "bucket": self.bucket_number
-                    })
+                    files_list.append(self._search_entry(file))
                     if len(files_list) >= limit: break
                 if len(files_list) >= limit: break
 
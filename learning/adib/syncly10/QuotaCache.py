@@ -0,0 +1,111 @@
+# --- START OF FILE QuotaCache.py ---
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Quota values younger than this are served without asking the provider
+QUOTA_CACHE_TTL_SECONDS = int(os.getenv("QUOTA_CACHE_TTL_SECONDS", 60))
+# Older values are still served (and refreshed in the background) up to this age
+QUOTA_CACHE_MAX_STALE_SECONDS = int(os.getenv("QUOTA_CACHE_MAX_STALE_SECONDS", 10 * 60))
+QUOTA_REFRESH_WORKERS = int(os.getenv("QUOTA_REFRESH_WORKERS", 8))
+
+
+class QuotaCache:
+    """
+    Process-wide cache of (limit, usage) per user bucket.
+    Shared by DriveManager, GoogleDriveFile and DropBoxFile so one upload checks
+    quotas once, and updated locally after our own uploads so the value stays
+    usable without another provider round-trip.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(QuotaCache, cls).__new__(cls)
+                    instance._entries: Dict[Tuple[str, int], Dict] = {}
+                    instance._refreshing = set() # Keys with a background refresh in flight
+                    instance._lock = threading.Lock()
+                    instance.executor = ThreadPoolExecutor(max_workers=QUOTA_REFRESH_WORKERS, thread_name_prefix="quota")
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of QuotaCache."""
+        return cls()
+
+    @staticmethod
+    def _key(user_id, bucket_number) -> Tuple[str, int]:
+        return str(user_id), int(bucket_number)
+
+    def get(self, user_id, bucket_number) -> Tuple[Optional[Tuple[int, int]], bool]:
+        """
+        Returns ((limit, usage), is_fresh) for a bucket.
+        The value is None when nothing usable is cached (missing or older than the max staleness).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(self._key(user_id, bucket_number))
+        if entry is None:
+            return None, False
+        age = now - entry["fetched_at"]
+        if age > QUOTA_CACHE_MAX_STALE_SECONDS:
+            return None, False
+        return (entry["limit"], entry["usage"]), age <= QUOTA_CACHE_TTL_SECONDS
+
+    def put(self, user_id, bucket_number, limit: int, usage: int):
+        """Stores a quota value freshly read from the provider."""
+        with self._lock:
+            self._entries[self._key(user_id, bucket_number)] = {"limit": limit, "usage": usage, "fetched_at": time.monotonic()}
+
+    def record_upload(self, user_id, bucket_number, bytes_written: int):
+        """Accounts for bytes we just wrote so the cached free space stays accurate."""
+        if bucket_number is None or not bytes_written:
+            return
+        with self._lock:
+            entry = self._entries.get(self._key(user_id, bucket_number))
+            if entry is not None:
+                entry["usage"] += bytes_written
+        logger.debug(f"QuotaCache: recorded {bytes_written} bytes written to bucket {bucket_number} for user {user_id}")
+
+    def invalidate(self, user_id, bucket_number=None):
+        """Drops cached quotas for one bucket or for all buckets of a user."""
+        user_key = str(user_id)
+        with self._lock:
+            if bucket_number is not None:
+                self._entries.pop(self._key(user_id, bucket_number), None)
+            else:
+                for key in [k for k in self._entries if k[0] == user_key]:
+                    del self._entries[key]
+
+    def refresh_in_background(self, user_id, bucket_number, fetch):
+        """Schedules fetch() -> (limit, usage) to refresh a stale bucket, at most once at a time."""
+        key = self._key(user_id, bucket_number)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                limit, usage = fetch()
+                if limit or usage:
+                    self.put(user_id, bucket_number, limit, usage)
+            except Exception as e:
+                logger.warning(f"Background quota refresh failed for bucket {bucket_number} (user {user_id}): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self.executor.submit(_run)
+
+# --- END OF FILE QuotaCache.py ---
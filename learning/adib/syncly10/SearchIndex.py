@@ -0,0 +1,365 @@
+# --- START OF FILE SearchIndex.py ---
+
+import io
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from pymongo import ASCENDING, UpdateOne, DeleteOne
+from Database import Database
+from FileIndex import FileIndex, FILE_INDEX_BATCH_SIZE
+from ExtractionCache import ExtractionCache
+from TextExtraction import SUPPORTED_TEXT_EXTENSIONS, head_bytes_for, extract_text_in_pool
+from VectorIndex import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Characters of extracted text indexed per file
+SEARCH_INDEX_MAX_CHARS = int(os.getenv("SEARCH_INDEX_MAX_CHARS", 100_000))
+# Files larger than this are indexed by name only
+SEARCH_INDEX_MAX_FILE_MB = int(os.getenv("SEARCH_INDEX_MAX_FILE_MB", 50))
+SEARCH_INDEX_WORKERS = int(os.getenv("SEARCH_INDEX_WORKERS", 2))
+# In-memory indexes are reloaded from MongoDB this often, to pick up passes run by other API processes
+SEARCH_INDEX_RELOAD_SECONDS = int(os.getenv("SEARCH_INDEX_RELOAD_SECONDS", 300))
+# Users whose postings are kept in memory; the least recently searched are dropped (and reloaded on demand)
+SEARCH_INDEX_MAX_USERS = int(os.getenv("SEARCH_INDEX_MAX_USERS", 256))
+# A name token counts as this many content tokens
+SEARCH_NAME_BOOST = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercased word tokens; single characters and very long runs (hashes, base64) are dropped."""
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(text.lower()) if 1 < len(token) <= 64]
+
+
+def catalog_revision(doc: Dict) -> Optional[str]:
+    """Revision of a catalog entry, matching the keys used by the extraction cache."""
+    return doc.get("md5Checksum") or doc.get("content_hash") or doc.get("modifiedTime")
+
+
+def _doc_key(provider: str, bucket: int, file_id: str) -> Tuple[str, int, str]:
+    return provider, bucket, file_id
+
+
+class _UserIndex:
+    """BM25 postings for one user's files, held in memory. Callers hold lock while reading or changing it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Dict[Tuple, int]] = {}
+        self.doc_terms: Dict[Tuple, List[str]] = {} # Lets remove() touch only the file's own postings
+        self.lengths: Dict[Tuple, int] = {}
+        self.files: Dict[Tuple, Dict] = {}
+        self.total_length = 0
+        self.generation = 0
+        self.loaded_at = time.monotonic()
+
+    def add(self, key: Tuple, file_info: Dict, terms: List[List]):
+        self.remove(key)
+        length = 0
+        for term, tf in terms:
+            self.postings.setdefault(term, {})[key] = tf
+            length += tf
+        self.doc_terms[key] = [term for term, _ in terms]
+        self.lengths[key] = length
+        self.files[key] = file_info
+        self.total_length += length
+
+    def remove(self, key: Tuple):
+        if key not in self.files:
+            return
+        for term in self.doc_terms.pop(key, []):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(key, 0)
+        del self.files[key]
+
+    def search(self, terms: List[str], limit: int) -> List[Dict]:
+        if not self.files or not terms:
+            return []
+        n_docs = len(self.files)
+        avg_length = self.total_length / n_docs or 1
+        scores: Dict[Tuple, float] = {}
+        for term in set(terms):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.files[item[0]].get("name", "").lower()))
+        return [dict(self.files[key], score=round(score, 4)) for key, score in ranked[:limit]]
+
+
+class SearchIndex:
+    """
+    Local BM25 full-text index over file names and extracted text, shared by /search_files and /llm/ask.
+    Term frequencies are stored per file in MongoDB (search_index) by SearchIndexer; queries run
+    against an in-memory copy per user, so ranking is the same for every provider and costs no round-trips.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(SearchIndex, cls).__new__(cls)
+                    instance._users: "OrderedDict[str, _UserIndex]" = OrderedDict() # LRU, guarded by _lock
+                    instance._generations: Dict[str, int] = {} # Bumped by apply(); a load started before it misses that pass
+                    instance._reloading = set()
+                    instance._lock = threading.Lock()
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of SearchIndex."""
+        return cls()
+
+    @property
+    def collection(self):
+        db = Database.get_instance()
+        return db.search_index_collection if db else None
+
+    def ensure_indexes(self):
+        """Creates the search index collection's indexes if missing (called from the API startup event)."""
+        if self.collection is None:
+            logger.error("Search index collection unavailable; skipping index setup.")
+            return
+        if "user_file_unique_index" not in self.collection.index_information():
+            logger.info("Creating index 'user_file_unique_index' on 'search_index'...")
+            self.collection.create_index([("user_id", ASCENDING), ("provider", ASCENDING), ("bucket", ASCENDING), ("file_id", ASCENDING)],
+                                         unique=True, name="user_file_unique_index")
+
+    def is_ready(self, drive_manager) -> bool:
+        """True when every loaded bucket of the user has been through at least one search indexing pass."""
+        states = FileIndex().get_states(drive_manager.user_id)
+        return bool(drive_manager.drives) and all(
+            states.get(getattr(drive, "bucket_number", None), {}).get("search_synced_at") for drive in drive_manager.drives)
+
+    def _load(self, user_id) -> _UserIndex:
+        index = _UserIndex()
+        with self._lock:
+            index.generation = self._generations.get(str(user_id), 0)
+        for doc in self.collection.find({"user_id": user_id}, {"provider": 1, "bucket": 1, "file_id": 1, "file": 1, "terms": 1}):
+            index.add(_doc_key(doc["provider"], doc["bucket"], doc["file_id"]), doc.get("file") or {}, doc.get("terms") or [])
+        logger.info(f"Loaded search index for user {user_id}: {len(index.files)} files, {len(index.postings)} terms.")
+        return index
+
+    def _store(self, key: str, index: _UserIndex):
+        with self._lock:
+            if index.generation != self._generations.get(key, 0) and key in self._users:
+                return # An indexing pass was applied while loading; keep the updated copy, the next query reloads
+            self._users[key] = index
+            self._users.move_to_end(key)
+            while len(self._users) > SEARCH_INDEX_MAX_USERS:
+                self._users.popitem(last=False)
+
+    def _user_index(self, user_id) -> _UserIndex:
+        key = str(user_id)
+        with self._lock:
+            index = self._users.get(key)
+            if index is not None: self._users.move_to_end(key)
+        if index is None:
+            index = self._load(user_id)
+            self._store(key, index)
+        elif time.monotonic() - index.loaded_at > SEARCH_INDEX_RELOAD_SECONDS:
+            self._reload_in_background(user_id)
+        return index
+
+    def _reload_in_background(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            if key in self._reloading:
+                return
+            self._reloading.add(key)
+
+        def _run():
+            try:
+                self._store(key, self._load(user_id))
+            except Exception as e:
+                logger.warning(f"Search index reload failed for user {user_id}: {e}")
+            finally:
+                with self._lock:
+                    self._reloading.discard(key)
+
+        threading.Thread(target=_run, name="search-index-reload", daemon=True).start()
+
+    def search(self, user_id, query: str, limit: int = 10) -> List[Dict]:
+        """Returns up to limit files (FileInfo shape plus score) ranked by BM25 over name and content."""
+        if self.collection is None:
+            return []
+        started_at = time.perf_counter()
+        index = self._user_index(user_id)
+        with index.lock: # Per user: other users' searches and index updates are not held up
+            results = index.search(tokenize(query), limit)
+        logger.info(f"Local search for '{query}' (user {user_id}) returned {len(results)} files in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        return results
+
+    def apply(self, user_id, upserts: List[Dict], removed: List[Tuple]):
+        """Mirrors a SearchIndexer pass into the in-memory index, if this process has one loaded for the user."""
+        key = str(user_id)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            index = self._users.get(key)
+        if index is None:
+            return
+        with index.lock:
+            for key in removed:
+                index.remove(key)
+            for doc in upserts:
+                index.add(_doc_key(doc["provider"], doc["bucket"], doc["file_id"]), doc["file"], doc["terms"])
+
+
+class SearchIndexer:
+    """
+    Background job bringing search_index in line with the FileIndex catalog.
+    Only files that are new or whose revision changed since the last pass are downloaded and parsed
+    (through the extraction cache); files gone from the catalog are dropped.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(SearchIndexer, cls).__new__(cls)
+                    instance.executor = ThreadPoolExecutor(max_workers=SEARCH_INDEX_WORKERS, thread_name_prefix="search-index")
+                    instance._in_progress = set()
+                    instance._lock = threading.Lock()
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of SearchIndexer."""
+        return cls()
+
+    def schedule(self, drive_manager) -> bool:
+        """Queues a background search indexing pass for the user unless one is already running."""
+        key = str(drive_manager.user_id)
+        with self._lock:
+            if key in self._in_progress:
+                return False
+            self._in_progress.add(key)
+        self.executor.submit(self._run, drive_manager, key)
+        logger.info(f"Scheduled background search indexing for user {key}")
+        return True
+
+    def _run(self, drive_manager, key: str):
+        try:
+            self.index_user(drive_manager)
+        except Exception as e:
+            logger.error(f"Background search indexing failed for user {key}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_progress.discard(key)
+
+    def index_user(self, drive_manager):
+        """Indexes new and changed catalog files of every loaded bucket and drops removed ones."""
+        catalog, search = FileIndex(), SearchIndex.get_instance()
+        if catalog.collection is None or search.collection is None:
+            logger.error("Search indexing skipped: catalog or search index collection unavailable.")
+            return
+        user_id = drive_manager.user_id
+        started_at = time.monotonic()
+        indexed = {(doc["provider"], doc["bucket"], doc["file_id"]): (doc.get("revision"), doc.get("vector_model"))
+                   for doc in search.collection.find({"user_id": user_id}, {"provider": 1, "bucket": 1, "file_id": 1, "revision": 1, "vector_model": 1})}
+        for drive in drive_manager.drives:
+            bucket_number = getattr(drive, "bucket_number", None)
+            if bucket_number is None:
+                continue
+            try:
+                self._index_bucket(catalog, search, user_id, drive, indexed)
+            except Exception as e:
+                logger.error(f"Search indexing {drive.provider} Bucket {bucket_number} failed for user {user_id}: {e}", exc_info=True)
+        logger.info(f"Search indexing for user {user_id} finished in {time.monotonic() - started_at:.2f}s")
+
+    def _index_bucket(self, catalog: FileIndex, search: SearchIndex, user_id, drive, indexed: Dict[Tuple, Tuple]):
+        provider, bucket_number = drive.provider, drive.bucket_number
+        vector_model = VectorIndex.get_instance().model_name # A model change re-embeds every file
+        seen = set()
+        upserts: List[Dict] = []
+        for entry in catalog.collection.find({"user_id": user_id, "provider": provider, "bucket": bucket_number}):
+            key = _doc_key(provider, bucket_number, entry["file_id"])
+            seen.add(key)
+            revision = catalog_revision(entry)
+            if indexed.get(key) == (revision, vector_model):
+                continue
+            upserts.append(self._search_document(user_id, drive, entry, revision))
+            if len(upserts) >= FILE_INDEX_BATCH_SIZE:
+                self._write(search, user_id, upserts, [])
+                upserts = []
+        removed = [key for key in indexed if key[0] == provider and key[1] == bucket_number and key not in seen]
+        self._write(search, user_id, upserts, removed)
+        catalog.set_state(user_id, bucket_number, provider, {"search_synced_at": datetime.utcnow()})
+        logger.info(f"Search index for {provider} Bucket {bucket_number}: {len(seen)} files, removed {len(removed)}.")
+
+    def _write(self, search: SearchIndex, user_id, upserts: List[Dict], removed: List[Tuple]):
+        operations = [UpdateOne({"user_id": user_id, "provider": doc["provider"], "bucket": doc["bucket"], "file_id": doc["file_id"]},
+                                {"$set": doc}, upsert=True) for doc in upserts]
+        operations += [DeleteOne({"user_id": user_id, "provider": p, "bucket": b, "file_id": f}) for p, b, f in removed]
+        vectors = VectorIndex.get_instance()
+        vectors.remove_files(user_id, removed)
+        if operations:
+            search.collection.bulk_write(operations, ordered=False)
+            search.apply(user_id, upserts, removed)
+            vectors.invalidate(user_id) # Once per batch: the passages of upserts were embedded while building them
+
+    def _search_document(self, user_id, drive, entry: Dict, revision: Optional[str]) -> Dict:
+        file_info = dict(FileIndex.to_file_info(entry), revision=revision)
+        counts = Counter()
+        for token in tokenize(os.path.splitext(entry.get("name") or "")[0]):
+            counts[token] += SEARCH_NAME_BOOST
+        try:
+            text = self._extract(drive, entry, revision)
+        except Exception as e:
+            # Indexed by name for now; no stored revision means the next pass tries the content again
+            logger.warning(f"Could not extract '{entry.get('name')}' for the search index, indexing its name only: {e}")
+            text, revision = None, None
+        counts.update(tokenize(text))
+        vectors = VectorIndex.get_instance()
+        vector_model = vectors.model_name
+        try:
+            vectors.index_file(user_id, drive.provider, drive.bucket_number, entry["file_id"], file_info, text)
+        except Exception as e:
+            logger.warning(f"Could not embed '{entry.get('name')}' for the vector index: {e}")
+            vector_model = None # Retried on the next pass
+        return {"user_id": user_id, "provider": drive.provider, "bucket": drive.bucket_number, "file_id": entry["file_id"],
+                "revision": revision, "vector_model": vector_model, "file": file_info, "terms": [[term, tf] for term, tf in counts.items()],
+                "content_indexed": text is not None, "indexed_at": datetime.utcnow()}
+
+    def _extract(self, drive, entry: Dict, revision: Optional[str]) -> Optional[str]:
+        """Text of a supported file, from the extraction cache or a fresh (budget-limited) download."""
+        name, size = entry.get("name") or "", entry.get("size")
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_TEXT_EXTENSIONS or not size:
+            return None # Unsupported, empty, or a native Google Doc (no downloadable body)
+        head = head_bytes_for(name, SEARCH_INDEX_MAX_CHARS)
+        if head is None and size > SEARCH_INDEX_MAX_FILE_MB * 1024 * 1024:
+            return None
+
+        def _download_and_extract():
+            data = b"".join(drive.iterDownload(entry["file_id"], 0, min(head, size)) if head else drive.iterDownload(entry["file_id"]))
+            return extract_text_in_pool(io.BytesIO(data), name, entry.get("mimeType"), SEARCH_INDEX_MAX_CHARS)
+
+        return ExtractionCache().get_or_extract(drive.provider, entry["file_id"], revision, _download_and_extract, SEARCH_INDEX_MAX_CHARS)
+
+# --- END OF FILE SearchIndex.py ---
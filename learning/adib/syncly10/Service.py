@@ -2,7 +2,7 @@
 
 #import libraries for abstraction
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional # Added typing imports
+from typing import List, Dict, Optional, Iterator, AsyncIterator, Tuple # Added typing imports
 
 class Service(ABC):
     #abstract methods for service classes
@@ -23,4 +23,92 @@ class Service(ABC):
     def searchFiles(self, query: str, limit: int = 10) -> List[Dict]:
         """Searches for files matching the query string."""
         pass
+
+    @abstractmethod
+    def iterFiles(self, page_size: int = 1000) -> Iterator[Dict]:
+        """Yields metadata for every file in the account, without any fetch limit."""
+        pass
+
+    @abstractmethod
+    def getChangeCursor(self) -> str:
+        """Returns a cursor marking "now" in the account's change feed."""
+        pass
+
+    @abstractmethod
+    def listChanges(self, cursor: str) -> Tuple[List[Dict], str]:
+        """
+        Returns (changes, new_cursor) for everything that changed since cursor.
+        Each change is {"removed": bool, "id": ..., "path_lower": ..., "entry": catalog entry or None}.
+        """
+        pass
+
+    @abstractmethod
+    def findFile(self, name: str) -> Optional[Dict]:
+        """Returns the catalog entry of a file with exactly this name, or None."""
+        pass
+
+    @abstractmethod
+    def uploadStream(self, stream, name: str, size: int, mimetype: Optional[str] = None) -> Dict:
+        """
+        Uploads size bytes read from a seekable stream as a new file called name.
+        Returns {"file_id": ..., "path": ... or None, "size": ...}; errors are raised.
+        """
+        pass
+
+    @abstractmethod
+    def iterDownload(self, file_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields the bytes [start, end) of a file in blocks of at most DOWNLOAD_CHUNK_SIZE
+        (end=None reads to the end of the file). Errors are raised.
+        """
+        pass
+
+    @abstractmethod
+    def deleteFile(self, file_id: str) -> bool:
+        """Deletes a file by its provider id. Returns True on success."""
+        pass
+
+
+class AsyncUpload(ABC):
+    """Write side of AsyncService.aopen_write: write() the file's bytes in order, then close()."""
+    @abstractmethod
+    async def write(self, data: bytes):
+        pass
+
+    @abstractmethod
+    async def close(self) -> Dict:
+        """Sends what is left and returns {"file_id": ..., "path": ... or None, "size": ...}; errors are raised."""
+        pass
+
+
+class AsyncService(ABC):
+    """
+    Asyncio counterpart of Service for one authenticated bucket, returning the same dicts.
+    Implementations wrap a loaded Service instance (see AsyncProviders.async_service_for).
+    """
+    provider: str
+    bucket_number: Optional[int]
+
+    @abstractmethod
+    async def alist_files(self, query: Optional[str] = None, max_results: Optional[int] = None) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def asearch(self, query: str, limit: int = 10) -> List[Dict]:
+        """Searches for files matching the query string (same results as Service.searchFiles)."""
+        pass
+
+    @abstractmethod
+    async def acheck_storage(self) -> tuple[int, int]:
+        pass
+
+    @abstractmethod
+    def aopen_read(self, file_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Async iterator over the bytes [start, end) of a file in blocks of at most DOWNLOAD_CHUNK_SIZE."""
+        pass
+
+    @abstractmethod
+    async def aopen_write(self, name: str, size: int, mimetype: Optional[str] = None) -> AsyncUpload:
+        """Starts an upload of size bytes as a new file called name."""
+        pass
 # --- END OF FILE Service.py ---
\ No newline at end of file
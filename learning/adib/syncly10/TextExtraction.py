@@ -0,0 +1,175 @@
+# --- START OF FILE TextExtraction.py ---
+
+import io
+import os
+import codecs
+import zipfile
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Iterator, Iterable, List
+from xml.etree import ElementTree
+
+# --- Text Extraction Imports ---
+try:
+    import PyPDF2
+except ImportError: PyPDF2 = None; logging.warning("PyPDF2 not installed...")
+try:
+    import docx
+except ImportError: docx = None; logging.warning("python-docx not installed...")
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TEXT_EXTENSIONS = ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml', '.pdf', '.docx')
+PLAIN_TEXT_EXTENSIONS = ('.txt', '.md', '.py', '.js', '.json', '.csv', '.html', '.css', '.xml', '.log', '.c', '.cpp', '.h', '.java', '.sh', '.yaml', '.yml')
+# CPU-bound formats parsed in worker processes so they don't hold the API process's GIL
+PROCESS_PARSED_EXTENSIONS = ('.pdf', '.docx')
+PARSE_PROCESS_WORKERS = int(os.getenv("PARSE_PROCESS_WORKERS", 2))
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_PARAGRAPH, _DOCX_TEXT, _DOCX_TAB = _WORD_NS + "p", _WORD_NS + "t", _WORD_NS + "tab"
+
+
+def head_bytes_for(filename: str, max_chars: Optional[int]) -> Optional[int]:
+    """
+    Bytes worth downloading to get max_chars characters of a plain-text file, or None when the
+    whole file is needed (PDF/DOCX keep their index at the end, so they can't be read from the head).
+    """
+    if not max_chars or os.path.splitext(filename)[1].lower() not in PLAIN_TEXT_EXTENSIONS:
+        return None
+    return max_chars * 4 # Worst case for UTF-8
+
+
+def _iter_pdf_pages(content_buffer: io.BytesIO) -> Iterator[str]:
+    # PdfReader only parses a page's content stream when the page is accessed
+    for page in PyPDF2.PdfReader(content_buffer).pages:
+        text = page.extract_text()
+        if text:
+            yield text
+
+
+def _iter_docx_paragraphs(content_buffer: io.BytesIO) -> Iterator[str]:
+    # Streams word/document.xml instead of building python-docx's full object tree
+    with zipfile.ZipFile(content_buffer) as archive, archive.open("word/document.xml") as document:
+        parts: List[str] = []
+        for event, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag == _DOCX_TEXT:
+                parts.append(element.text or "")
+            elif element.tag == _DOCX_TAB:
+                parts.append("\t")
+            elif element.tag == _DOCX_PARAGRAPH:
+                yield "".join(parts)
+                parts = []
+                element.clear()
+
+
+def _join_until(parts: Iterable[str], max_chars: Optional[int]) -> str:
+    """Joins parts with newlines, pulling no more parts once max_chars characters are collected."""
+    collected: List[str] = []
+    total = 0
+    for part in parts:
+        collected.append(part)
+        total += len(part) + 1
+        if max_chars and total >= max_chars:
+            break
+    return "\n".join(collected)
+
+
+def _decode_head(raw_bytes: bytes, filename: str) -> Optional[str]:
+    # An incremental decoder drops a multi-byte character cut off by a ranged download instead of failing
+    try: return codecs.getincrementaldecoder('utf-8')().decode(raw_bytes, final=False)
+    except UnicodeDecodeError:
+        logger.warning(f"UTF-8 decoding failed for '{filename}', trying latin-1.")
+        try: return raw_bytes.decode('latin-1')
+        except Exception as decode_err: logger.error(f"Could not decode text file '{filename}': {decode_err}")
+    return None
+
+
+def extract_text(content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Extracts text from a BytesIO buffer based on filename extension.
+    With max_chars, PDF pages and DOCX paragraphs stop being parsed once that many characters are collected;
+    plain text is expected to arrive already cut to its head (see head_bytes_for).
+    """
+    extracted_text = None
+    file_ext = os.path.splitext(filename)[1].lower()
+    if not file_ext in SUPPORTED_TEXT_EXTENSIONS:
+        logger.debug(f"Skipping text extraction for '{filename}': Unsupported extension '{file_ext}'.")
+        return None
+    logger.info(f"Attempting text extraction for '{filename}' (extension: {file_ext})")
+    try:
+        if file_ext == '.pdf':
+            if PyPDF2:
+                extracted_text = _join_until(_iter_pdf_pages(content_buffer), max_chars).strip()
+                if not extracted_text: logger.warning(f"PyPDF2 extracted no text from '{filename}'.")
+            else: logger.warning(f"Cannot extract text from PDF '{filename}': PyPDF2 not available.")
+        elif file_ext == '.docx':
+            if max_chars:
+                extracted_text = _join_until(_iter_docx_paragraphs(content_buffer), max_chars).strip()
+            elif docx:
+                document = docx.Document(content_buffer)
+                extracted_text = "\n".join([para.text for para in document.paragraphs]).strip()
+            else: logger.warning(f"Cannot extract text from DOCX '{filename}': python-docx not available.")
+        elif file_ext in PLAIN_TEXT_EXTENSIONS:
+             extracted_text = _decode_head(content_buffer.getvalue(), filename)
+             if extracted_text: extracted_text = extracted_text.strip()
+        else: logger.debug(f"No specific text extraction logic for extension '{file_ext}' in file '{filename}'.")
+    except Exception as e:
+        if PyPDF2 and isinstance(e, PyPDF2.errors.PdfReadError): logger.error(f"Error reading PDF '{filename}' with PyPDF2: {e}")
+        else: logger.error(f"Failed to extract text from '{filename}': {e}", exc_info=True)
+        extracted_text = None
+    if extracted_text: logger.info(f"Successfully extracted text from '{filename}' (length: {len(extracted_text)} chars).")
+    else: logger.warning(f"Could not extract text from '{filename}' (extension: {file_ext}).")
+    return extracted_text if extracted_text else None
+
+
+def _extract_bytes(data: bytes, filename: str, mime_type: Optional[str], max_chars: Optional[int]) -> Optional[str]:
+    # Worker-process entry point: buffers don't pickle, bytes do
+    return extract_text(io.BytesIO(data), filename, mime_type, max_chars)
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Returns the shared process pool for document parsing, creating it on first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn, not fork: the API process has live threads and Mongo/HTTP clients
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def shutdown_parse_pool():
+    """Stops the parse workers (called on API shutdown)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def extract_text_in_pool(content_buffer: io.BytesIO, filename: str, mime_type: Optional[str] = None, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Same as extract_text, but PDF/DOCX parsing runs in the shared process pool.
+    Blocks the calling (worker) thread until the result is ready; plain text is decoded inline.
+    """
+    if os.path.splitext(filename)[1].lower() not in PROCESS_PARSED_EXTENSIONS:
+        return extract_text(content_buffer, filename, mime_type, max_chars)
+    global _parse_pool
+    pool = get_parse_pool()
+    try:
+        return pool.submit(_extract_bytes, content_buffer.getvalue(), filename, mime_type, max_chars).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. a pathological PDF): drop the pool so the next call gets a fresh one
+        logger.error(f"Parse worker crashed on '{filename}'; skipping it and restarting the pool.")
+        with _parse_pool_lock:
+            if _parse_pool is pool:
+                _parse_pool = None
+        return None
+
+# --- END OF FILE TextExtraction.py ---
@@ -0,0 +1,174 @@
+# --- START OF FILE TokenRefresher.py ---
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from pymongo import UpdateOne
+from Database import Database
+
+logger = logging.getLogger(__name__)
+
+# How often the background thread looks for tokens about to expire
+TOKEN_REFRESH_INTERVAL_SECONDS = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", 60))
+# Tokens expiring within this margin are refreshed (must exceed the interval)
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", 10 * 60))
+# Credentials not used by any request for this long are dropped instead of refreshed
+TOKEN_REFRESH_IDLE_SECONDS = int(os.getenv("TOKEN_REFRESH_IDLE_SECONDS", 2 * 60 * 60))
+TOKEN_REFRESH_WORKERS = int(os.getenv("TOKEN_REFRESH_WORKERS", 4))
+
+
+def expiry_to_str(expiry: Optional[datetime]) -> Optional[str]:
+    """Google's authorized-user format for expiry (naive UTC, as google-auth keeps it)."""
+    return expiry.strftime("%Y-%m-%dT%H:%M:%SZ") if expiry else None
+
+
+class _Registration:
+    def __init__(self, user_id, bucket_number: int, service_type: str, client):
+        self.user_id = user_id
+        self.bucket_number = bucket_number
+        self.service_type = service_type
+        self.client = client # google.oauth2 Credentials or dropbox.Dropbox
+        self.last_used = time.monotonic()
+
+    @property
+    def expiry(self) -> Optional[datetime]:
+        if self.service_type == "GoogleDrive":
+            return self.client.expiry
+        return getattr(self.client, "_oauth2_access_token_expiration", None)
+
+
+class TokenRefresher:
+    """
+    Keeps the OAuth access tokens of loaded buckets fresh from a background thread.
+    AuthManager registers the credentials it authenticates with and asks for them first
+    on the next load, so requests reuse in-memory credentials that are never expired
+    instead of reading tokens_collection and refreshing inline. Tokens expiring within
+    TOKEN_REFRESH_MARGIN_SECONDS are refreshed together and saved with one bulk write.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(TokenRefresher, cls).__new__(cls)
+                    instance._registrations: Dict[Tuple[str, int, str], _Registration] = {}
+                    instance._lock = threading.Lock()
+                    instance._stop = threading.Event()
+                    instance._thread: Optional[threading.Thread] = None
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of TokenRefresher."""
+        return cls()
+
+    @staticmethod
+    def _key(user_id, bucket_number, service_type: str) -> Tuple[str, int, str]:
+        return str(user_id), bucket_number, service_type
+
+    # --- Lifecycle (API startup/shutdown) ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self._thread.start()
+        logger.info(f"Token refresher started (every {TOKEN_REFRESH_INTERVAL_SECONDS}s, margin {TOKEN_REFRESH_MARGIN_SECONDS}s).")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(TOKEN_REFRESH_INTERVAL_SECONDS):
+            try: self.refresh_due()
+            except Exception as e: logger.error(f"Token refresh pass failed: {e}", exc_info=True)
+
+    # --- Registry used by AuthManager ---
+
+    def register(self, user_id, bucket_number: int, service_type: str, client):
+        """Tracks credentials (GoogleDrive: Credentials, Dropbox: dropbox.Dropbox) a bucket was authenticated with."""
+        with self._lock:
+            self._registrations[self._key(user_id, bucket_number, service_type)] = _Registration(user_id, bucket_number, service_type, client)
+
+    def lookup(self, user_id, bucket_number: int, service_type: str):
+        """Registered credentials for the bucket, or None when there are none that are still valid."""
+        with self._lock:
+            registration = self._registrations.get(self._key(user_id, bucket_number, service_type))
+            if registration is None:
+                return None
+            registration.last_used = time.monotonic()
+        expiry = registration.expiry
+        if expiry is not None and expiry <= datetime.utcnow():
+            return None # Refresh failed or the refresher is not running; let AuthManager reload
+        return registration.client
+
+    def forget(self, user_id, bucket_number: int, service_type: str):
+        with self._lock:
+            self._registrations.pop(self._key(user_id, bucket_number, service_type), None)
+
+    # --- Refreshing ---
+
+    def refresh_due(self) -> int:
+        """Refreshes every registered token expiring within the margin and persists them. Returns how many were refreshed."""
+        now = time.monotonic()
+        due_before = datetime.utcnow() + timedelta(seconds=TOKEN_REFRESH_MARGIN_SECONDS)
+        with self._lock:
+            idle = [key for key, r in self._registrations.items() if now - r.last_used > TOKEN_REFRESH_IDLE_SECONDS]
+            for key in idle: del self._registrations[key]
+            due = [r for r in self._registrations.values() if r.expiry is not None and r.expiry <= due_before]
+        if idle: logger.info(f"Token refresher dropped {len(idle)} idle credentials.")
+        if not due:
+            return 0
+        started_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(TOKEN_REFRESH_WORKERS, len(due)), thread_name_prefix="token-refresh") as executor:
+            updates = [update for update in executor.map(self._refresh, due) if update is not None]
+        if updates:
+            db = Database.get_instance()
+            try:
+                if db and db.tokens_collection is not None: db.tokens_collection.bulk_write(updates, ordered=False)
+            except Exception as e: logger.error(f"Could not save {len(updates)} refreshed tokens: {e}")
+        logger.info(f"Refreshed {len(updates)}/{len(due)} expiring tokens in {time.monotonic() - started_at:.2f}s.")
+        return len(updates)
+
+    def _refresh(self, registration: _Registration) -> Optional[UpdateOne]:
+        """Refreshes one token in place (the clients in use see it at once) and returns its tokens_collection update."""
+        try:
+            if registration.service_type == "GoogleDrive":
+                from google.auth.transport.requests import Request
+                registration.client.refresh(Request())
+                fields = {"access_token": registration.client.token, "expiry": expiry_to_str(registration.client.expiry)}
+            else:
+                registration.client.refresh_access_token()
+                fields = {"access_token": registration.client._oauth2_access_token, "expires_at": registration.expiry}
+        except Exception as e:
+            self._on_refresh_error(registration, e)
+            return None
+        return UpdateOne({"user_id": registration.user_id, "bucket_number": registration.bucket_number, "service_type": registration.service_type},
+                         {"$set": fields})
+
+    def _on_refresh_error(self, registration: _Registration, error: Exception):
+        from google.auth.exceptions import RefreshError
+        from dropbox.exceptions import AuthError
+        if not isinstance(error, (RefreshError, AuthError)):
+            logger.warning(f"Token refresh for {registration.service_type} Bucket {registration.bucket_number} (user {registration.user_id}) failed, retrying next pass: {error}")
+            return
+        # Revoked or expired refresh token: stop refreshing and make the next request re-authenticate
+        logger.error(f"Token for {registration.service_type} Bucket {registration.bucket_number} (user {registration.user_id}) can no longer be refreshed: {error}")
+        self.forget(registration.user_id, registration.bucket_number, registration.service_type)
+        from ClientRegistry import discard_google_drive_service, discard_dropbox_client
+        client = registration.client
+        if registration.service_type == "GoogleDrive": discard_google_drive_service(client)
+        else: discard_dropbox_client(access_token=client._oauth2_access_token, refresh_token=client._oauth2_refresh_token, app_key=client._app_key)
+        from DrivePool import invalidate_drive_manager
+        invalidate_drive_manager(registration.user_id, f"{registration.service_type} token refresh failed")
+
+# --- END OF FILE TokenRefresher.py ---
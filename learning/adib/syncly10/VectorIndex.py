@@ -0,0 +1,267 @@
+# --- START OF FILE VectorIndex.py ---
+
+import os
+import re
+import zlib
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from pymongo import ASCENDING
+from bson import Binary
+from Database import Database
+
+# --- Embedding Imports ---
+try:
+    import numpy as np
+except ImportError: np = None; logging.warning("numpy not installed, semantic retrieval disabled...")
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError: SentenceTransformer = None; logging.warning("sentence-transformers not installed, using hashed bag-of-words embeddings...")
+try:
+    from stop_words import get_stop_words
+except ImportError: get_stop_words = None
+
+logger = logging.getLogger(__name__)
+
+VECTOR_EMBEDDING_MODEL = os.getenv("VECTOR_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Dimension of the fallback hashed embeddings (used when sentence-transformers is missing)
+VECTOR_HASHING_DIM = int(os.getenv("VECTOR_HASHING_DIM", 1024))
+# Passages are cut on whitespace to about this many characters, overlapping by VECTOR_PASSAGE_OVERLAP
+VECTOR_PASSAGE_CHARS = int(os.getenv("VECTOR_PASSAGE_CHARS", 800))
+VECTOR_PASSAGE_OVERLAP = int(os.getenv("VECTOR_PASSAGE_OVERLAP", 100))
+VECTOR_EMBED_BATCH_SIZE = 32
+# Passages scoring below this cosine similarity are not worth sending to the LLM
+VECTOR_MIN_SIMILARITY = float(os.getenv("VECTOR_MIN_SIMILARITY", 0.2 if SentenceTransformer else 0.1))
+# In-memory matrices are reloaded from MongoDB this often, to pick up passes run by other API processes
+VECTOR_INDEX_RELOAD_SECONDS = int(os.getenv("VECTOR_INDEX_RELOAD_SECONDS", 300))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def split_passages(text: Optional[str]) -> List[str]:
+    """Splits text into overlapping passages of about VECTOR_PASSAGE_CHARS, ending on whitespace."""
+    if not text:
+        return []
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + VECTOR_PASSAGE_CHARS, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + VECTOR_PASSAGE_CHARS // 2, end)
+            end = cut if cut > 0 else end
+        passage = text[start:end].strip()
+        if passage:
+            passages.append(passage)
+        if end >= len(text):
+            break
+        # Overlap with the previous passage, starting on a word boundary
+        next_start = text.find(" ", end - VECTOR_PASSAGE_OVERLAP, end)
+        start = next_start + 1 if next_start > start else end
+    return passages
+
+
+class _Embedder:
+    """Local CPU embedding model; falls back to signed feature hashing of words and word pairs."""
+
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+        self.name = VECTOR_EMBEDDING_MODEL if SentenceTransformer else f"hashing-{VECTOR_HASHING_DIM}"
+        self._stop_words = set(get_stop_words("english")) if get_stop_words and not SentenceTransformer else set()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                started_at = time.monotonic()
+                self._model = SentenceTransformer(VECTOR_EMBEDDING_MODEL, device="cpu")
+                logger.info(f"Loaded embedding model '{VECTOR_EMBEDDING_MODEL}' in {time.monotonic() - started_at:.1f}s")
+        return self._model
+
+    def _hash(self, text: str):
+        vector = np.zeros(VECTOR_HASHING_DIM, dtype=np.float32)
+        words = [word for word in _WORD_RE.findall(text.lower()) if word not in self._stop_words]
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % VECTOR_HASHING_DIM] += 1.0 if h & 0x80000000 else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector)) # Dampen repeated words
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts: List[str]):
+        """Returns an (n, dim) float32 matrix of L2-normalized embeddings."""
+        if SentenceTransformer:
+            return np.asarray(self._load().encode(texts, batch_size=VECTOR_EMBED_BATCH_SIZE, normalize_embeddings=True), dtype=np.float32)
+        return np.stack([self._hash(text) for text in texts]) if texts else np.zeros((0, VECTOR_HASHING_DIM), dtype=np.float32)
+
+
+class _UserVectors:
+    """One user's passage embeddings as a single matrix, searched by brute-force dot product."""
+
+    def __init__(self, matrix, passages: List[Dict], generation: int):
+        self.matrix = matrix
+        self.passages = passages
+        self.generation = generation # VectorIndex generation of the user when loading started
+        self.loaded_at = time.monotonic()
+
+    def search(self, query_vector, limit: int) -> List[Dict]:
+        if not self.passages:
+            return []
+        scores = self.matrix @ query_vector
+        top = np.argpartition(-scores, min(limit, len(scores) - 1))[:limit] if len(scores) > limit else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.passages[i], score=round(float(scores[i]), 4)) for i in top if scores[i] >= VECTOR_MIN_SIMILARITY]
+
+
+class VectorIndex:
+    """
+    Passage-level embedding index over extracted document text, used by /llm/ask to pick context
+    by similarity to the question (no keyword-extraction LLM call). Passages and their embeddings are
+    written by SearchIndexer in the same pass that builds the BM25 index, stored in MongoDB
+    (vector_index, one document per file) and searched from an in-memory matrix per user.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(VectorIndex, cls).__new__(cls)
+                    instance.embedder = _Embedder() if np is not None else None
+                    instance._users: Dict[str, _UserVectors] = {}
+                    instance._generations: Dict[str, int] = {} # Bumped by invalidate(); a load started before it is stale
+                    instance._load_locks: Dict[str, threading.Lock] = {}
+                    instance._reloading = set()
+                    instance._lock = threading.Lock()
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the singleton instance of VectorIndex."""
+        return cls()
+
+    @property
+    def enabled(self) -> bool:
+        return self.embedder is not None
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return self.embedder.name if self.embedder else None
+
+    @property
+    def collection(self):
+        db = Database.get_instance()
+        return db.vector_index_collection if db else None
+
+    def ensure_indexes(self):
+        """Creates the vector index collection's indexes if missing (called from the API startup event)."""
+        if self.collection is None:
+            logger.error("Vector index collection unavailable; skipping index setup.")
+            return
+        if "user_file_unique_index" not in self.collection.index_information():
+            logger.info("Creating index 'user_file_unique_index' on 'vector_index'...")
+            self.collection.create_index([("user_id", ASCENDING), ("provider", ASCENDING), ("bucket", ASCENDING), ("file_id", ASCENDING)],
+                                         unique=True, name="user_file_unique_index")
+
+    # --- Writes (from SearchIndexer) ---
+
+    def index_file(self, user_id, provider: str, bucket: int, file_id: str, file_info: Dict, text: Optional[str]):
+        """Embeds a file's passages and stores them, replacing the previous revision's. Call invalidate() once the batch is written."""
+        if not self.enabled or self.collection is None:
+            return
+        key = {"user_id": user_id, "provider": provider, "bucket": bucket, "file_id": file_id}
+        passages = split_passages(text)
+        if not passages:
+            self.collection.delete_one(key)
+        else:
+            matrix = self.embedder.embed(passages)
+            self.collection.replace_one(key, dict(key, file=file_info, model=self.model_name, dim=int(matrix.shape[1]), passages=passages,
+                                                  embeddings=Binary(matrix.astype(np.float32).tobytes()), indexed_at=datetime.utcnow()), upsert=True)
+
+    def remove_files(self, user_id, keys: List[Tuple]):
+        if not self.enabled or self.collection is None or not keys:
+            return
+        self.collection.delete_many({"user_id": user_id, "$or": [{"provider": p, "bucket": b, "file_id": f} for p, b, f in keys]})
+
+    def invalidate(self, user_id):
+        """
+        Marks the user's in-memory matrix stale. The next query reloads it in the background and keeps
+        answering from the loaded one meanwhile; a load that was already running is not kept.
+        """
+        key = str(user_id)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    # --- Reads ---
+
+    def _load(self, user_id) -> _UserVectors:
+        with self._lock:
+            generation = self._generations.get(str(user_id), 0)
+        rows, passages = [], []
+        for doc in self.collection.find({"user_id": user_id, "model": self.model_name}):
+            matrix = np.frombuffer(doc["embeddings"], dtype=np.float32).reshape(-1, doc["dim"])
+            rows.append(matrix)
+            passages.extend({**doc["file"], "passage": text} for text in doc["passages"])
+        dim = rows[0].shape[1] if rows else 1
+        vectors = _UserVectors(np.vstack(rows) if rows else np.zeros((0, dim), dtype=np.float32), passages, generation)
+        logger.info(f"Loaded vector index for user {user_id}: {len(passages)} passages.")
+        return vectors
+
+    def _store(self, key: str, vectors: _UserVectors):
+        with self._lock:
+            if vectors.generation == self._generations.get(key, 0): # Not invalidated while it was loading
+                self._users[key] = vectors
+
+    def _user_vectors(self, user_id) -> _UserVectors:
+        key = str(user_id)
+        with self._lock:
+            vectors = self._users.get(key)
+            generation = self._generations.get(key, 0)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        if vectors is None:
+            with load_lock: # Concurrent first queries share one load
+                with self._lock:
+                    vectors = self._users.get(key)
+                if vectors is None:
+                    vectors = self._load(user_id)
+                    self._store(key, vectors)
+        elif vectors.generation != generation or time.monotonic() - vectors.loaded_at > VECTOR_INDEX_RELOAD_SECONDS:
+            self._reload_in_background(user_id)
+        return vectors
+
+    def _reload_in_background(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            if key in self._reloading:
+                return
+            self._reloading.add(key)
+
+        def _run():
+            try:
+                self._store(key, self._load(user_id))
+            except Exception as e:
+                logger.warning(f"Vector index reload failed for user {user_id}: {e}")
+            finally:
+                with self._lock:
+                    self._reloading.discard(key)
+
+        threading.Thread(target=_run, name="vector-index-reload", daemon=True).start()
+
+    def has_vectors(self, user_id) -> bool:
+        return self.enabled and self.collection is not None and bool(self._user_vectors(user_id).passages)
+
+    def search(self, user_id, question: str, limit: int = 6) -> List[Dict]:
+        """Returns the passages most similar to question: FileInfo fields plus 'passage' and 'score'."""
+        if not self.enabled or self.collection is None:
+            return []
+        started_at = time.perf_counter()
+        vectors = self._user_vectors(user_id)
+        query_vector = self.embedder.embed([question])[0]
+        results = vectors.search(query_vector, limit)
+        logger.info(f"Vector search (user {user_id}) returned {len(results)} passages in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        return results
+
+# --- END OF FILE VectorIndex.py ---
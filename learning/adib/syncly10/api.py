@@ -4,7 +4,8 @@ import asyncio
 import base64
 import hashlib
 import io
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Query, Body, Path
+import threading
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Query, Body, Path, Response, Header
 from fastapi.security import OAuth2PasswordBearer # Keep for get_current_user
 from pydantic import BaseModel, Field
 from jose import JWTError, jwt
@@ -14,20 +15,30 @@ import uuid # Needed for link_id
 from pymongo import ASCENDING # Needed for index creation
 from AuthManager import AuthManager
 from DriveManager import DriveManager
+from DrivePool import get_drive_manager, invalidate_drive_manager
 from fastapi.staticfiles import StaticFiles
-import shutil
 from bson import ObjectId
 import dropbox
+from google.auth.exceptions import RefreshError
 import logging
 import mimetypes
 from typing import List, Optional, Dict, Tuple, Union, Any # Added Union, Any
-from fastapi.responses import FileResponse, RedirectResponse, JSONResponse # Added JSONResponse
+from fastapi.responses import FileResponse, RedirectResponse, JSONResponse, StreamingResponse # Added JSONResponse
 from Database import Database # Use the corrected Database class
 from GoogleDrive import GoogleDrive
 from Dropbox import DropboxService
-from GDriveFile import GoogleDriveFile, SUPPORTED_TEXT_EXTENSIONS
+from GDriveFile import GoogleDriveFile, SUPPORTED_TEXT_EXTENSIONS, COMMON_EXTENSIONS
 from DropBoxFile import DropBoxFile
-from groq import Groq
+from ChunkTransfer import ChunkAssembler, is_logical_file
+from FileIndex import FileIndex, FileIndexer, encode_page_cursor, decode_page_cursor
+from ExtractionCache import ExtractionCache
+from SearchIndex import SearchIndex
+from VectorIndex import VectorIndex
+from TextExtraction import extract_text_in_pool, shutdown_parse_pool
+from Executors import run_in, shutdown_executors, AsyncCollection
+from AsyncProviders import close_http_client
+from ClientRegistry import get_groq_client
+from TokenRefresher import TokenRefresher
 from dotenv import load_dotenv
 from collections import defaultdict
 import re
@@ -75,6 +86,7 @@ class StorageSummary(BaseModel): storages: List[StorageInfo]; total_storage_gb:
 class FileInfo(BaseModel):
     id: Optional[str] = None; name: str; provider: str; size: Optional[int] = None; path: str
     mimeType: Optional[str] = None; bucket: Optional[int] = None; path_lower: Optional[str] = None
+    revision: Optional[str] = None # md5Checksum/modifiedTime (Drive) or content_hash (Dropbox), keys the extraction cache
     # Exclude token from default serialization unless specifically requested
     access_token: Optional[str] = Field(None, exclude=True) # Correct use of Field(exclude=True)
 class AddDriveRequest(BaseModel): drive_type: str
@@ -138,10 +150,51 @@ async def startup_event():
             logger.info(f"Index '{tg_id_index_name}' created.")
         else: logger.info(f"Index '{tg_id_index_name}' already exists.")
 
+        # Setup metadata (chunk manifest) lookup index used by downloads
+        metadata_collection = db_instance.metadata_collection
+        if metadata_collection is not None:
+            manifest_index_name = "user_file_name_index"
+            if manifest_index_name not in metadata_collection.index_information():
+                logger.info(f"Creating index '{manifest_index_name}' on 'metadata.user_id, file_name'...")
+                metadata_collection.create_index([("user_id", ASCENDING), ("file_name", ASCENDING)], name=manifest_index_name)
+                logger.info(f"Index '{manifest_index_name}' created.")
+            else: logger.info(f"Index '{manifest_index_name}' already exists.")
+            content_index_name = "user_content_sha256_index"
+            if content_index_name not in metadata_collection.index_information():
+                logger.info(f"Creating index '{content_index_name}' on 'metadata.user_id, content_sha256'...")
+                metadata_collection.create_index([("user_id", ASCENDING), ("content_sha256", ASCENDING)], sparse=True, name=content_index_name)
+                logger.info(f"Index '{content_index_name}' created.")
+            else: logger.info(f"Index '{content_index_name}' already exists.")
+            block_index_name = "user_chunk_sha256_index"
+            if block_index_name not in metadata_collection.index_information():
+                logger.info(f"Creating index '{block_index_name}' on 'metadata.user_id, chunks.sha256'...")
+                metadata_collection.create_index([("user_id", ASCENDING), ("chunks.sha256", ASCENDING)], sparse=True, name=block_index_name)
+                logger.info(f"Index '{block_index_name}' created.")
+            else: logger.info(f"Index '{block_index_name}' already exists.")
+
+        # Setup file catalog indexes (user_id + name_lower, provider, bucket, size, modifiedTime)
+        FileIndex().ensure_indexes()
+        # Extracted-text cache used by /llm/ask (LRU on last_access)
+        ExtractionCache().ensure_indexes()
+        # Local full-text search index (one document per file)
+        SearchIndex.get_instance().ensure_indexes()
+        VectorIndex.get_instance().ensure_indexes()
+
         logger.info("DB index setup check complete.")
     except Exception as e:
         logger.error(f"DB index setup error during startup: {e}", exc_info=True)
         # Depending on severity, might want to stop the app here
+    TokenRefresher.get_instance().start() # Refreshes OAuth tokens of loaded buckets ahead of expiry
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_parse_pool() # Stop PDF/DOCX parse workers used by /llm/ask
+    shutdown_executors()
+    TokenRefresher.get_instance().stop()
+    await close_http_client() # Provider keep-alive connections
+
+# --- Async collections for request handlers (motor, or pymongo on the 'mongo' executor) ---
+async_users = AsyncCollection("users"); async_pending_links = AsyncCollection("pending_links"); async_drives = AsyncCollection("drives")
 
 # --- Helper functions ---
 def get_password_hash(password: str) -> str: sha256_hash = hashlib.sha256(password.encode('utf-8')).digest(); return base64.b64encode(sha256_hash).decode('utf-8')
@@ -159,13 +212,56 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
     if not db or db.users_collection is None:
         logger.error("DB unavailable for get_current_user.")
         raise HTTPException(status_code=503, detail="Database service unavailable")
-    user = db.users_collection.find_one({"username": username})
+    user = await async_users.find_one({"username": username})
     if user is None: logger.warning(f"User '{username}' not found during JWT validation."); raise credentials_exception
     user["user_id_str"] = str(user["_id"]); # Add string version of ObjectId
     user["telegram_id"] = user.get("telegram_id") # Include if present
     return user
 
 
+# --- Drive Pool Helper ---
+def invalidate_on_auth_error(user_id, error: Exception) -> bool:
+    """Drops the user's pooled drives if a provider call failed because its token could not be refreshed."""
+    if isinstance(error, (RefreshError, dropbox.exceptions.AuthError)):
+        invalidate_drive_manager(user_id, f"provider auth error: {type(error).__name__}")
+        return True
+    return False
+
+
+# --- File Catalog Helper ---
+def catalog_uploaded_file(user_id, provider: str, manifest: Optional[Dict], file_size: int, mime_type: Optional[str]):
+    """Adds freshly uploaded objects to the file catalog so they are listed without waiting for the indexer."""
+    if not manifest: return
+    chunks = manifest.get("chunks", [])
+    try:
+        if is_logical_file(manifest): FileIndex().upsert_manifest(user_id, manifest); return # Split/cdc/dedup: list the file, not its chunks
+        for chunk in chunks:
+            entry = {"id": chunk.get("file_id"), "name": chunk.get("chunk_name"), "size": chunk.get("size", file_size if len(chunks) == 1 else None),
+                     "mimeType": mime_type, "modifiedTime": datetime.utcnow().isoformat() + "Z", "path_lower": (chunk.get("path") or "").lower() or None,
+                     "path": f"dropbox:{chunk.get('path').lower()}" if chunk.get("path") else f"https://drive.google.com/file/d/{chunk.get('file_id')}/view"}
+            FileIndex().upsert_files(user_id, chunk.get("provider", provider), chunk.get("bucket"), [entry])
+    except Exception as e: logger.warning(f"Could not add uploaded file to catalog: {e}")
+
+
+# --- Download Helper ---
+def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single "bytes=a-b" / "bytes=a-" / "bytes=-n" Range header into (start, end_exclusive).
+    Returns None for headers we do not honour (multiple ranges, other units) or that are invalid, such as a last
+    byte before the first (RFC 7233 2.1: the header is ignored); raises 416 when a valid range is unsatisfiable.
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", range_header)
+    if not match or not (match.group(1) or match.group(2)): return None
+    if match.group(1) and match.group(2) and int(match.group(2)) < int(match.group(1)): return None
+    if match.group(1):
+        start = int(match.group(1)); end = min(int(match.group(2)) + 1, file_size) if match.group(2) else file_size
+    else: # Suffix range: the last n bytes
+        start = max(file_size - int(match.group(2)), 0); end = file_size
+    if start >= file_size or start >= end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.", headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
+
+
 # --- Keyword Extraction Helpers (Keep as is) ---
 def extract_keywords_simple(text: str, min_len: int = 3) -> str:
     if not text: return ""
@@ -195,7 +291,7 @@ async def get_search_keywords_from_llm(question: str) -> str:
     )
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": f"User Question: '{question}'"}]
     try:
-        logger.info(f"LLM keyword extraction for: '{question[:50]}...'"); client = Groq(api_key=GROQ_API_KEY)
+        logger.info(f"LLM keyword extraction for: '{question[:50]}...'"); client = get_groq_client(GROQ_API_KEY)
         completion = await asyncio.to_thread(client.chat.completions.create, model=keyword_model, messages=messages, temperature=0.1, max_tokens=60)
         raw_keywords = completion.choices[0].message.content.strip(); logger.info(f"LLM keywords raw: '{raw_keywords}'")
         keywords = raw_keywords.lower(); prefixes = ["keywords:", "output:", "keywords ", "output "];
@@ -214,10 +310,10 @@ async def get_search_keywords_from_llm(question: str) -> str:
 async def register(user_data: UserCreate): # Keep as is
     db = Database.get_instance()
     if not db or db.users_collection is None: raise HTTPException(status_code=503, detail="Database error")
-    if db.users_collection.find_one({"username": {"$regex": f"^{user_data.username}$", "$options": "i"}}): raise HTTPException(status_code=400, detail="Username exists")
-    if db.users_collection.find_one({"email": {"$regex": f"^{user_data.email}$", "$options": "i"}}): raise HTTPException(status_code=400, detail="Email exists")
+    if await async_users.find_one({"username": {"$regex": f"^{user_data.username}$", "$options": "i"}}): raise HTTPException(status_code=400, detail="Username exists")
+    if await async_users.find_one({"email": {"$regex": f"^{user_data.email}$", "$options": "i"}}): raise HTTPException(status_code=400, detail="Email exists")
     hashed_password = get_password_hash(user_data.password); user_doc = {"username": user_data.username, "password": hashed_password, "email": user_data.email, "drives": [], "created_at": datetime.utcnow(), "telegram_id": None}
-    result = db.users_collection.insert_one(user_doc); logger.info(f"User '{user_data.username}' registered ID: {result.inserted_id}"); return {"message": "User registered"}
+    result = await async_users.insert_one(user_doc); logger.info(f"User '{user_data.username}' registered ID: {result.inserted_id}"); return {"message": "User registered"}
 
 # --- Corrected /token Endpoint (Handles both flows) ---
 @app.post("/token", response_model=Union[Token, Dict[str, str]], tags=["Auth"])
@@ -227,7 +323,7 @@ async def login_for_access_token_or_link(form_data: TokenRequestForm = Body(...)
         logger.error("Login failed: DB connection or required collection missing.")
         raise HTTPException(status_code=503, detail="Database service unavailable")
 
-    user = db.users_collection.find_one({"username": form_data.username})
+    user = await async_users.find_one({"username": form_data.username})
     if not user or not verify_password(form_data.password, user["password"]):
         logger.warning(f"Login failed for user: {form_data.username}")
         raise HTTPException(status_code=401, detail="Incorrect username or password")
@@ -237,7 +333,7 @@ async def login_for_access_token_or_link(form_data: TokenRequestForm = Body(...)
     # --- Bot Link Flow ---
     if link_id:
         logger.info(f"Processing login via link flow for link_id: {link_id}")
-        pending_link = db.pending_links_collection.find_one({"link_id": link_id, "expires_at": {"$gt": datetime.utcnow()}})
+        pending_link = await async_pending_links.find_one({"link_id": link_id, "expires_at": {"$gt": datetime.utcnow()}})
 
         if not pending_link:
             logger.warning(f"Link ID {link_id} not found or expired.")
@@ -248,7 +344,7 @@ async def login_for_access_token_or_link(form_data: TokenRequestForm = Body(...)
             raise HTTPException(status_code=410, detail="Login link has already been used. Please try /login again.") # 410 Gone
 
         # Atomically update the link document: set validated=True and user_id
-        update_result = db.pending_links_collection.update_one(
+        update_result = await async_pending_links.update_one(
             {"link_id": link_id, "validated": False}, # Ensure it wasn't validated concurrently
             {"$set": {"user_id": user_id, "validated": True}}
         )
@@ -262,7 +358,7 @@ async def login_for_access_token_or_link(form_data: TokenRequestForm = Body(...)
             # Or if the document structure was unexpected.
             logger.error(f"Failed to update pending link {link_id} state (modified_count={update_result.modified_count}).")
             # Check again if it was already validated by another request
-            check_again = db.pending_links_collection.find_one({"link_id": link_id})
+            check_again = await async_pending_links.find_one({"link_id": link_id})
             if check_again and check_again.get('validated'):
                  raise HTTPException(status_code=410, detail="Login link was already used.")
             else:
@@ -288,7 +384,7 @@ async def create_auth_link(request: CreateLinkRequest):
 
     try:
         # Insert the new pending link document
-        insert_result = db.pending_links_collection.insert_one({
+        insert_result = await async_pending_links.insert_one({
             "link_id": link_id,
             "telegram_id": request.telegram_id,
             "user_id": None, # Initially null
@@ -318,7 +414,7 @@ async def complete_auth_link(request: CompleteLinkRequest):
     logger.info(f"Attempting to complete link_id: {request.link_id} for telegram_id: {request.telegram_id}")
 
     # Find the link, ensuring it hasn't expired (TTL index handles deletion, but check anyway)
-    link_data = db.pending_links_collection.find_one({"link_id": request.link_id, "expires_at": {"$gt": datetime.utcnow()}})
+    link_data = await async_pending_links.find_one({"link_id": request.link_id, "expires_at": {"$gt": datetime.utcnow()}})
 
     if not link_data:
         logger.warning(f"Complete link failed: Link {request.link_id} not found or expired.")
@@ -338,12 +434,12 @@ async def complete_auth_link(request: CompleteLinkRequest):
         raise HTTPException(status_code=400, detail="Link process not completed via web login yet.")
 
     user_id = link_data["user_id"]
-    user = db.users_collection.find_one({"_id": ObjectId(user_id)}) # Ensure user_id is ObjectId
+    user = await async_users.find_one({"_id": ObjectId(user_id)}) # Ensure user_id is ObjectId
 
     if not user:
         logger.error(f"User (ID: {user_id}) associated with link {request.link_id} not found in users collection.")
         # Clean up the invalid link
-        db.pending_links_collection.delete_one({"link_id": request.link_id})
+        await async_pending_links.delete_one({"link_id": request.link_id})
         raise HTTPException(status_code=404, detail="Associated user account not found.")
 
     username = user["username"]
@@ -351,7 +447,7 @@ async def complete_auth_link(request: CompleteLinkRequest):
     # --- Associate Telegram ID with User Account in DB (if not already set) ---
     # This helps link the Telegram identity to the Syncly account permanently
     if user.get("telegram_id") != request.telegram_id:
-        update_res = db.users_collection.update_one(
+        update_res = await async_users.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {"telegram_id": request.telegram_id}}
         )
@@ -366,7 +462,7 @@ async def complete_auth_link(request: CompleteLinkRequest):
     access_token = create_access_token(data={"sub": username})
 
     # --- CRITICAL: Delete the used link ---
-    delete_result = db.pending_links_collection.delete_one({"link_id": request.link_id})
+    delete_result = await async_pending_links.delete_one({"link_id": request.link_id})
     if delete_result.deleted_count == 1:
         logger.info(f"Successfully completed and deleted link {request.link_id} for user {username}")
     else:
@@ -383,7 +479,7 @@ async def validate_token(token: str = Query(...)):
     if username is None: raise HTTPException(status_code=401, detail="Invalid token: No username")
     db = Database.get_instance();
     if not db or db.users_collection is None : raise HTTPException(status_code=503, detail="Database unavailable")
-    if not db.users_collection.find_one({"username": username}): raise HTTPException(status_code=401, detail="Invalid token: User not found")
+    if not await async_users.find_one({"username": username}): raise HTTPException(status_code=401, detail="Invalid token: User not found")
     return {"username": username}
 
 # --- User Endpoints (Keep as is) ---
@@ -393,9 +489,9 @@ async def read_users_me(current_user: Dict = Depends(get_current_user)): return
 # --- Storage Endpoints (Keep as is) ---
 @app.get("/storage", response_model=StorageSummary, tags=["Storage"])
 async def get_storage_info(current_user: Dict = Depends(get_current_user)):
-    user_id = current_user["_id"]; drive_manager = DriveManager(user_id=user_id)
+    user_id = current_user["_id"]; drive_manager = await run_in("drives", get_drive_manager, user_id)
     if not drive_manager.drives: return StorageSummary(storages=[], total_storage_gb=0, used_storage_gb=0, free_storage_gb=0)
-    storages_info, total_limit, total_usage = drive_manager.check_all_storages()
+    storages_info, total_limit, total_usage = await run_in("drives", drive_manager.check_all_storages)
     storage_details = []
     for s in storages_info:
          limit_gb = s.get("Storage Limit (bytes)", 0) / (1024**3) if s.get("Storage Limit (bytes)") else 0; used_gb = s.get("Used Storage (bytes)", 0) / (1024**3) if s.get("Used Storage (bytes)") else 0; free_gb = s.get("Free Storage", 0) / (1024**3) if s.get("Free Storage") else 0
@@ -405,40 +501,52 @@ async def get_storage_info(current_user: Dict = Depends(get_current_user)):
 
 @app.post("/drives", tags=["Storage"])
 async def add_drive(request: AddDriveRequest, current_user: Dict = Depends(get_current_user)):
-    user_id = current_user["_id"]; drive_manager = DriveManager(user_id=user_id); db = Database.get_instance()
+    user_id = current_user["_id"]; drive_manager = await run_in("drives", get_drive_manager, user_id); db = Database.get_instance()
     if not db or db.drives_collection is None: raise HTTPException(status_code=503, detail="Database unavailable")
-    existing_drives_count = db.drives_collection.count_documents({"user_id": user_id}); bucket_number = existing_drives_count + 1
+    existing_drives_count = await async_drives.count_documents({"user_id": user_id}); bucket_number = existing_drives_count + 1
     logger.info(f"Adding {request.drive_type} as bucket {bucket_number} for {current_user['username']}")
     try:
-        if request.drive_type == "GoogleDrive": instance = GoogleDrive(); drive_manager.add_drive(instance, bucket_number, "GoogleDrive"); return {"status": "success", "message": f"Google Drive bucket {bucket_number} added."}
-        elif request.drive_type == "Dropbox": key=os.getenv("DROPBOX_APP_KEY"); secret=os.getenv("DROPBOX_APP_SECRET"); assert key and secret and key != "YOUR_DROPBOX_APP_KEY"; instance = DropboxService(app_key=key, app_secret=secret); drive_manager.add_drive(instance, bucket_number, "Dropbox"); return {"status": "success", "message": f"Dropbox bucket {bucket_number} added."}
+        if request.drive_type == "GoogleDrive": instance = await run_in("GoogleDrive", GoogleDrive); await run_in("GoogleDrive", drive_manager.add_drive, instance, bucket_number, "GoogleDrive"); invalidate_drive_manager(user_id, "bucket added"); return {"status": "success", "message": f"Google Drive bucket {bucket_number} added."}
+        elif request.drive_type == "Dropbox": key=os.getenv("DROPBOX_APP_KEY"); secret=os.getenv("DROPBOX_APP_SECRET"); assert key and secret and key != "YOUR_DROPBOX_APP_KEY"; instance = await run_in("Dropbox", DropboxService, app_key=key, app_secret=secret); await run_in("Dropbox", drive_manager.add_drive, instance, bucket_number, "Dropbox"); invalidate_drive_manager(user_id, "bucket added"); return {"status": "success", "message": f"Dropbox bucket {bucket_number} added."}
         else: raise HTTPException(status_code=400, detail="Invalid drive type.")
     except AssertionError: raise HTTPException(status_code=500, detail="Server Error: Dropbox app keys not configured.")
     except Exception as e: logger.error(f"Failed add drive: {e}", exc_info=True); raise HTTPException(status_code=500, detail=f"Failed to add drive: {e}")
 
 # --- File Endpoints (Keep as is, ensuring FileInfo(**data) works) ---
+def _list_catalog_files(drive_manager: DriveManager, user_id, query: Optional[str], limit: int, offset: int, cursor: Optional[str], use_keyset: bool) -> Optional[Tuple[List[Dict], Optional[str]]]:
+    """A page of (files, next cursor) from the file catalog once every bucket is indexed, else None after scheduling the index build (blocking)."""
+    indexer = FileIndexer.get_instance()
+    if not indexer.is_indexed(drive_manager): indexer.schedule(drive_manager); return None
+    if indexer.needs_refresh(drive_manager): indexer.schedule(drive_manager)
+    if use_keyset: return FileIndex().list_files_page(user_id, query=query, limit=limit, cursor=cursor)
+    return FileIndex().list_files(user_id, query=query, limit=limit, offset=offset), None
+
 @app.get("/viewfiles", response_model=List[FileInfo], tags=["Files"])
-async def list_files( query: Optional[str] = Query(None), limit: int = Query(50, ge=1, le=200), offset: int = Query(0, ge=0), current_user: Dict = Depends(get_current_user)):
-    user_id = current_user["_id"]; drive_manager = DriveManager(user_id=user_id); username = current_user['username']
+async def list_files( response: Response, query: Optional[str] = Query(None), limit: int = Query(50, ge=1, le=200), offset: int = Query(0, ge=0), cursor: Optional[str] = Query(None, description="Continuation token from the X-Next-Cursor header of the previous page"), current_user: Dict = Depends(get_current_user)):
+    user_id = current_user["_id"]; drive_manager = await run_in("drives", get_drive_manager, user_id); username = current_user['username']
     if not drive_manager.drives: return []
-    all_files_data = [] # Use list for raw data
-    logger.info(f"Listing files for {username} (q='{query}', l={limit}, o={offset})")
-    for drive in drive_manager.drives:
-        provider = type(drive).__name__
-        try:
-            files_data = drive.listFiles(query=query) # listFiles should return list of dicts
-            # Ensure provider and potentially access_token are added if missing
-            for file_d in files_data:
-                if "provider" not in file_d: file_d["provider"] = provider
-                if "bucket" not in file_d and hasattr(drive, "bucket_number"): file_d["bucket"] = drive.bucket_number
-                # Include token for Dropbox if needed downstream
-                if provider == "Dropbox" and "access_token" not in file_d:
-                     token = None
-                     if hasattr(drive.service, 'session'): token = drive.service.session.access_token
-                     elif hasattr(drive.service, '_oauth2_access_token'): token = drive.service._oauth2_access_token
-                     file_d["access_token"] = token # Add token to the dict
-            all_files_data.extend(files_data)
-        except Exception as e: logger.error(f"Error listing from {provider}: {e}", exc_info=True)
+    logger.info(f"Listing files for {username} (q='{query}', l={limit}, o={offset}, cursor={'yes' if cursor else 'no'})")
+    page_cursor = None
+    if cursor:
+        try: page_cursor = decode_page_cursor(cursor)
+        except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    use_keyset = cursor is not None or offset == 0 # offset is kept for older clients
+
+    # Serve from the file catalog once every bucket has been indexed
+    catalog_page = await run_in("drives", _list_catalog_files, drive_manager, user_id, query, limit, offset, cursor, use_keyset)
+    if catalog_page is not None:
+        files_data, next_cursor = catalog_page
+        if next_cursor: response.headers["X-Next-Cursor"] = next_cursor
+        files_data = await drive_manager.aresolve_links(files_data) # The catalog keeps dropbox: paths, the list opens links
+        results = []
+        for file_data in files_data:
+            try: results.append(FileInfo(**file_data))
+            except Exception as model_err: logger.warning(f"Skipping catalog entry model creation error: {model_err}. Data: {file_data}")
+        logger.info(f"Returning {len(results)} catalog files for {username}"); return results
+
+    # First listing for this user (catalog build now scheduled): list every bucket live through the async provider clients
+    all_files_data, list_errors = await drive_manager.alist_files(query=query) # Use list for raw data
+    for _, error in list_errors: invalidate_on_auth_error(user_id, error)
 
     # De-duplicate based on a unique identifier
     unique_files_dict = {}
@@ -449,12 +557,18 @@ async def list_files( query: Optional[str] = Query(None), limit: int = Query(50,
          if key not in unique_files_dict:
              unique_files_dict[key] = file_data
 
-    # Sort unique files
-    sorted_unique_files_data = sorted(unique_files_dict.values(), key=lambda x: x.get("name", "").lower())
+    # Sort unique files (provider:id breaks ties between equal names, matching the cursor format)
+    sort_key = lambda x: (x.get("name", "").lower(), f"{x.get('provider', '?')}:{x.get('id', x.get('path_lower', ''))}")
+    sorted_unique_files_data = sorted(unique_files_dict.values(), key=sort_key)
     total_unique = len(sorted_unique_files_data)
 
     # Paginate the final list
-    paginated_files_data = sorted_unique_files_data[offset : offset + limit]
+    if use_keyset:
+        if page_cursor: sorted_unique_files_data = [f for f in sorted_unique_files_data if sort_key(f) > page_cursor]
+        paginated_files_data = sorted_unique_files_data[:limit]
+        if len(sorted_unique_files_data) > limit: response.headers["X-Next-Cursor"] = encode_page_cursor(*sort_key(paginated_files_data[-1]))
+    else: paginated_files_data = sorted_unique_files_data[offset : offset + limit]
+    paginated_files_data = await drive_manager.aresolve_links(paginated_files_data)
 
     # Convert to Pydantic models safely
     results = []
@@ -470,12 +584,13 @@ async def list_files( query: Optional[str] = Query(None), limit: int = Query(50,
     logger.info(f"Returning {len(results)}/{total_unique} unique files for {username}"); return results
 
 @app.get("/search_files", response_model=List[FileInfo], tags=["Files"])
-async def search_files_endpoint( query: str = Query(...), limit: int = Query(10, ge=1, le=50), current_user: Dict = Depends(get_current_user)):
-    user_id = current_user["_id"]; drive_manager = DriveManager(user_id=user_id); username = current_user['username']
+async def search_files_endpoint( response: Response, query: str = Query(...), limit: int = Query(10, ge=1, le=50), current_user: Dict = Depends(get_current_user)):
+    user_id = current_user["_id"]; drive_manager = await run_in("drives", get_drive_manager, user_id); username = current_user['username']
     if not drive_manager.drives: return []
     logger.info(f"{username} searching '{query}' (limit {limit})")
     try:
-        matching_files_data = drive_manager.search_files_for_llm(query=query, limit_per_drive=limit, total_limit=limit) # Returns list of dicts
+        matching_files_data, partial = await drive_manager.asearch_files_with_status(query=query, limit_per_drive=limit, total_limit=limit) # Returns list of dicts
+        if partial: response.headers["X-Partial-Buckets"] = ",".join(f"{p['provider']}:{p['bucket']}:{p['reason']}" for p in partial)
         results = []
         for file_data in matching_files_data:
              try:
@@ -485,32 +600,29 @@ async def search_files_endpoint( query: str = Query(...), limit: int = Query(10,
                  results.append(FileInfo(**file_data)) # Unpack dict into model
              except Exception as model_err: logger.warning(f"Skipping search result model creation error: {model_err}. Data: {file_data}")
         logger.info(f"Returning {len(results)} search results for '{query}' for {username}"); return results
-    except Exception as e: logger.error(f"Search error: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Error searching files.")
+    except Exception as e: logger.error(f"Search error: {e}", exc_info=True); invalidate_on_auth_error(user_id, e); raise HTTPException(status_code=500, detail="Error searching files.")
 
 @app.post("/files/upload", tags=["Files"])
 async def upload_file_endpoint( file: UploadFile = File(...), current_user: Dict = Depends(get_current_user)):
-    user_id = current_user["_id"]; username = current_user["username"]; upload_dir = "uploads"; os.makedirs(upload_dir, exist_ok=True)
-    # Ensure filename is safe for filesystem path
+    user_id = current_user["_id"]; username = current_user["username"]
+    # Ensure filename is safe for provider paths
     safe_filename = os.path.basename(file.filename or "uploaded_file").replace("..", "").replace("/", "").replace("\\", "")
     if not safe_filename: safe_filename = "uploaded_file" # Handle empty case
-    temp_file_location = os.path.join(upload_dir, f"{user_id}_{safe_filename}")
-    try:
-        with open(temp_file_location, "wb") as buffer: shutil.copyfileobj(file.file, buffer); logger.info(f"Temp file saved: {temp_file_location}")
-    except Exception as e: logger.error(f"Failed save temp upload: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Failed to save upload.")
-    finally: file.file.close()
+    # The multipart body is already spooled by Starlette; stream straight from it instead of copying to uploads/
+    stream = file.file; stream.seek(0, os.SEEK_END); file_size = stream.tell(); stream.seek(0)
+    mime_type = file.content_type or mimetypes.guess_type(safe_filename)[0] or "application/octet-stream"
 
-    drive_manager = DriveManager(user_id=user_id);
+    drive_manager = await run_in("drives", get_drive_manager, user_id);
     try:
         if not drive_manager.drives: raise HTTPException(status_code=400, detail="No drives connected.")
-        sorted_buckets_info = drive_manager.get_sorted_buckets()
+        sorted_buckets_info = await run_in("drives", drive_manager.get_sorted_buckets)
         if not sorted_buckets_info: raise HTTPException(status_code=400, detail="No available storage space.")
         best_drive_instance = sorted_buckets_info[0][1]; best_bucket_number = getattr(best_drive_instance, 'bucket_number', None)
         if best_bucket_number is None: raise HTTPException(status_code=500, detail="Internal error determining upload bucket.")
-        provider = type(best_drive_instance).__name__; logger.info(f"Uploading '{safe_filename}' to {provider} Bucket {best_bucket_number}")
+        provider = type(best_drive_instance).__name__; logger.info(f"Uploading '{safe_filename}' ({file_size} bytes) to {provider} Bucket {best_bucket_number}")
 
         if isinstance(best_drive_instance, GoogleDrive):
-            handler = GoogleDriveFile(drive_manager); mime_type = file.content_type or mimetypes.guess_type(safe_filename)[0] or "application/octet-stream"
-            handler.upload_file(temp_file_location, safe_filename, mime_type)
+            handler = GoogleDriveFile(drive_manager)
         elif isinstance(best_drive_instance, DropboxService):
              access_token = None;
              # Get token from the specific service instance
@@ -518,71 +630,166 @@ async def upload_file_endpoint( file: UploadFile = File(...), current_user: Dict
              elif hasattr(best_drive_instance.service, '_oauth2_access_token'): access_token = best_drive_instance.service._oauth2_access_token
              if not access_token: raise Exception("Failed to get Dropbox access token for upload.")
              handler = DropBoxFile(access_token, drive_manager); # Instantiate handler with token
-             handler.upload_file(temp_file_location, safe_filename) # Upload method handles the rest
         else: raise HTTPException(status_code=400, detail=f"Unsupported drive type selected: {provider}")
-
+        # Provider SDKs are blocking; chunks are sent from the provider's executor
+        manifest = await run_in(best_drive_instance.provider, handler.upload_stream, stream, safe_filename, mime_type, file_size)
+        if manifest and "dedup_of" in manifest:
+            logger.info(f"Upload of '{safe_filename}' deduplicated against '{manifest['dedup_of']}'")
+            await run_in("mongo", catalog_uploaded_file, user_id, best_drive_instance.provider, manifest, file_size, mime_type)
+            return {"status": "success", "message": f"File '{safe_filename}' already stored (same content as '{manifest['dedup_of']}'), no upload needed"}
+        await run_in("mongo", catalog_uploaded_file, user_id, best_drive_instance.provider, manifest, file_size, mime_type)
+
+        chunks = manifest.get("chunks", []) if manifest else []
+        if len(chunks) > 1:
+            logger.info(f"Upload success: '{safe_filename}' split into {len(chunks)} chunks")
+            return {"status": "success", "message": f"File '{safe_filename}' split into {len(chunks)} chunks across {len({(c['provider'], c['bucket']) for c in chunks})} buckets"}
         logger.info(f"Upload success: '{safe_filename}' to {provider} Bucket {best_bucket_number}")
         return {"status": "success", "message": f"File '{safe_filename}' uploaded to {provider} (Bucket {best_bucket_number})"}
     except Exception as e: # Catch any exception during drive logic or upload
         logger.error(f"Upload failed for {safe_filename}: {e}", exc_info=True)
         if isinstance(e, HTTPException): raise e
+        invalidate_on_auth_error(user_id, e)
         if isinstance(e, NotImplementedError): raise HTTPException(status_code=501, detail=str(e))
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
-    finally: # Ensure cleanup happens
-        if os.path.exists(temp_file_location):
-            try: os.remove(temp_file_location); logger.info(f"Cleaned up temp upload file: {temp_file_location}")
-            except OSError as e: logger.warning(f"Could not remove temp upload file {temp_file_location}: {e}")
+    finally: await file.close() # Releases Starlette's spooled temp file
 
 @app.get("/files/download", tags=["Files"])
-async def download_file_endpoint( file_name: str = Query(...), current_user: Dict = Depends(get_current_user)): # Keep as is
-    user_id = current_user["_id"]; username = current_user["username"]; drive_manager = DriveManager(user_id=user_id); download_dir = "downloads"; os.makedirs(download_dir, exist_ok=True)
-    logger.info(f"{username} requesting download: '{file_name}'")
+async def download_file_endpoint( file_name: str = Query(...), version: Optional[int] = Query(None, ge=0, description="Older version of a cdc-chunked file (1 = previous upload)"),
+                                  range_header: Optional[str] = Header(None, alias="Range"), current_user: Dict = Depends(get_current_user)):
+    user_id = current_user["_id"]; username = current_user["username"]; drive_manager = await run_in("drives", get_drive_manager, user_id)
+    logger.info(f"{username} requesting download: '{file_name}'{f' ({range_header})' if range_header else ''}")
     if not drive_manager.drives: raise HTTPException(status_code=404, detail="No drives connected.")
-    try: # GDrive
-        gdrive_handler = GoogleDriveFile(drive_manager); user_dl_path = os.path.join(download_dir, str(user_id))
-        downloaded_path = gdrive_handler.download_from_all_buckets(file_name, user_dl_path) # Assumes this method exists and works
-        if downloaded_path and os.path.exists(downloaded_path):
-            mime, _ = mimetypes.guess_type(downloaded_path); fname=os.path.basename(downloaded_path); logger.info(f"Returning GDrive file: '{fname}'"); return FileResponse(path=downloaded_path, filename=fname, media_type=mime or "application/octet-stream", headers={"Content-Disposition": f"attachment; filename=\"{fname}\""})
-    except Exception as e: logger.error(f"GDrive download check failed: {e}", exc_info=True) # Continue
-    try: # Dropbox
-        dbx_accounts = [d for d in drive_manager.drives if isinstance(d, DropboxService) and d.service]
-        for dbx_instance in dbx_accounts:
-             token = None;
-             if hasattr(dbx_instance.service, 'session'): token = dbx_instance.service.session.access_token
-             elif hasattr(dbx_instance.service, '_oauth2_access_token'): token = dbx_instance.service._oauth2_access_token
-             if not token: logger.warning(f"Skipping DBX Bucket {dbx_instance.bucket_number}: No token."); continue
-             dbx_handler = DropBoxFile(token, drive_manager); dbx_api_path = dbx_handler.search_file(file_name) # Assumes returns path_lower or None
-             if dbx_api_path:
-                 user_dl_path = os.path.join(download_dir, str(user_id)); os.makedirs(user_dl_path, exist_ok=True); local_path = os.path.join(user_dl_path, os.path.basename(dbx_api_path))
-                 downloaded_path = dbx_handler.download_file(dbx_api_path, local_path) # Assumes downloads to local path
-                 if downloaded_path and os.path.exists(downloaded_path):
-                     mime, _ = mimetypes.guess_type(downloaded_path); fname=os.path.basename(downloaded_path); logger.info(f"Returning Dropbox file: '{fname}'"); return FileResponse(path=downloaded_path, filename=fname, media_type=mime or "application/octet-stream", headers={"Content-Disposition": f"attachment; filename=\"{fname}\""})
-                 else: logger.error(f"Dropbox download found but failed for {local_path}"); break # Stop if found but failed download
-    except Exception as e: logger.error(f"Dropbox download check failed: {e}", exc_info=True)
-    logger.warning(f"File '{file_name}' not found for download by {username}.")
-    raise HTTPException(status_code=404, detail=f"File '{file_name}' not found.")
+    extensions = COMMON_EXTENSIONS if not os.path.splitext(file_name)[1] else () # Bare names also match e.g. report.pdf
+    try: source = await run_in("drives", drive_manager.locate_file, file_name, extensions)
+    except Exception as e: logger.error(f"Download lookup failed for '{file_name}': {e}", exc_info=True); invalidate_on_auth_error(user_id, e); raise HTTPException(status_code=500, detail="Error locating file.")
+    if not source:
+        logger.warning(f"File '{file_name}' not found for download by {username}.")
+        raise HTTPException(status_code=404, detail=f"File '{file_name}' not found.")
+    try: source = ChunkAssembler.version_manifest(source, version)
+    except LookupError as e: raise HTTPException(status_code=404, detail=str(e))
+
+    fname = os.path.basename(source.get("file_name") or file_name); file_size = source.get("file_size")
+    mime = source.get("mimetype") or mimetypes.guess_type(fname)[0] or "application/octet-stream"
+    headers = {"Content-Disposition": f"attachment; filename=\"{fname}\"", "Accept-Ranges": "bytes" if file_size is not None else "none"}
+    byte_range = parse_range_header(range_header, file_size) if range_header and file_size is not None else None
+    start, end = byte_range if byte_range else (0, file_size)
+    if file_size is not None:
+        headers["Content-Length"] = str(end - start)
+        if byte_range: headers["Content-Range"] = f"bytes {start}-{end - 1}/{file_size}"
+
+    # Check every needed bucket and fetch the first block before answering, so these errors still map to a status code
+    assembler = ChunkAssembler(drive_manager)
+    try: assembler.check_available(source, start, end)
+    except LookupError as e: logger.error(f"Download of '{fname}' unavailable: {e}"); raise HTTPException(status_code=503, detail=str(e))
+    blocks = assembler.iter_range(source, start, end)
+    try: first_block = await run_in("drives", next, blocks, b"") # Chunks may live on different providers
+    except Exception as e:
+        logger.error(f"Download of '{fname}' failed: {e}", exc_info=True); invalidate_on_auth_error(user_id, e)
+        raise HTTPException(status_code=502, detail="Error reading file from storage provider.")
+
+    def stream_blocks():
+        sent = len(first_block)
+        if first_block: yield first_block
+        try:
+            for block in blocks: sent += len(block); yield block
+            if end is not None and sent < end - start: raise IOError(f"storage returned {sent} of {end - start} bytes")
+        except Exception as e:
+            # Headers are gone: re-raise so the server aborts the connection instead of ending a short body as if complete
+            logger.error(f"Download of '{fname}' aborted mid-stream: {e}", exc_info=True); invalidate_on_auth_error(user_id, e)
+            raise
+    logger.info(f"Streaming '{fname}' ({len(source['chunks'])} chunk(s), bytes {start}-{end}) to {username}")
+    return StreamingResponse(stream_blocks(), status_code=206 if byte_range else 200, media_type=mime, headers=headers)
 
 # --- LLM Endpoints (Keep as is, ensure FileInfo model is correctly used for extraction) ---
-def _get_drive_service_instance(drive_manager: DriveManager, provider: str, bucket: int) -> Optional[object]: # Keep as is
+def _get_drive_instance(drive_manager: DriveManager, provider: str, bucket: int) -> Optional[object]:
     target_class = GoogleDrive if provider == "GoogleDrive" else DropboxService if provider == "Dropbox" else None;
     if not target_class: return None
     for drive in drive_manager.drives:
-        if isinstance(drive, target_class) and hasattr(drive, 'bucket_number') and drive.bucket_number == bucket: return drive.service
+        if isinstance(drive, target_class) and hasattr(drive, 'bucket_number') and drive.bucket_number == bucket: return drive
+    return None
+
+def _get_drive_service_instance(drive_manager: DriveManager, provider: str, bucket: int) -> Optional[object]:
+    drive = _get_drive_instance(drive_manager, provider, bucket); return drive.service if drive else None
+
+def _extract_context_file(file: FileInfo, drive_manager: DriveManager, gdrive_handler: GoogleDriveFile, stop: threading.Event, max_chars: int) -> Optional[str]:
+    """Downloads and extracts one /llm/ask context file. Blocking: runs in a worker thread, parsing goes to the process pool."""
+    if stop.is_set(): return None
+    def parse(buffer, name, mime_type=None, max_chars=None): return None if stop.is_set() else extract_text_in_pool(buffer, name, mime_type, max_chars) # Budget filled while downloading
+    if file.provider == "GoogleDrive" and file.id and file.bucket:
+        drive = _get_drive_instance(drive_manager, "GoogleDrive", file.bucket)
+        if drive and drive.service: return gdrive_handler.extract_text_by_id(drive.service, file.id, file.name, file.mimeType, file.size, file.revision, parse=parse, http=drive.thread_http(), max_chars=max_chars)
+    elif file.provider == "Dropbox" and file.path_lower and file.access_token: # Need access_token from FileInfo
+        dbx_handler = DropBoxFile(file.access_token, drive_manager) # Instantiate with token from FileInfo
+        return dbx_handler.extract_text_by_path(file.path_lower, file.name, file.id, file.revision, parse=parse, max_chars=max_chars)
     return None
 
+async def gather_context_snippets(files: List[FileInfo], drive_manager: DriveManager, max_len: int, total_max: int) -> List[str]:
+    """
+    Downloads and extracts files concurrently off the event loop, keeping snippets in search order.
+    Each file is only read up to max_len characters (head download for text, early stop for PDF/DOCX).
+    Stops taking results once total_max characters are collected and cancels the remaining work.
+    """
+    stop = threading.Event(); gdrive_handler = GoogleDriveFile(drive_manager)
+    tasks = {asyncio.create_task(run_in(f.provider, _extract_context_file, f, drive_manager, gdrive_handler, stop, max_len)): i for i, f in enumerate(files)}
+    pending = set(tasks); results: Dict[int, List[str]] = {}; total_len = 0
+    try:
+        while pending and total_len < total_max:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.get): # Same-batch results in search order
+                file = files[tasks[task]]
+                if total_len >= total_max: pending.add(task); continue # Over budget: counts as omitted
+                try: extracted = task.result()
+                except Exception as ex_err: logger.error(f"Extract error {file.name}: {ex_err}", exc_info=True); extracted = None
+                if extracted: snippet = extracted[:max_len] + ("..." if len(extracted) > max_len else ""); results[tasks[task]] = [f"\n--- Snippet: {file.name} ---", snippet, f"--- End: {file.name} ---"]; total_len += len(snippet)
+                else: results[tasks[task]] = [f"\n(Could not extract text from {file.name})"]
+    finally:
+        stop.set() # Worker threads skip their remaining download/parse steps
+        for task in pending: task.cancel()
+    snippet_lines = ["\n\nExtracted Content Snippets:"]
+    for i in sorted(results): snippet_lines.extend(results[i])
+    if pending: logger.warning("Max snippet length reached."); snippet_lines.append("\n(More snippets omitted...)")
+    return snippet_lines
+
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", 6)) # Passages sent to the LLM from semantic retrieval
+
+def _retrieve_passages(user_id: str, question: str) -> List[Dict]:
+    """Passages most similar to the question, or [] when the user's files are not embedded yet (blocking)."""
+    vector_index = VectorIndex.get_instance()
+    if not vector_index.enabled: return []
+    try:
+        drive_manager = get_drive_manager(user_id)
+        if not drive_manager.drives or not SearchIndex.get_instance().is_ready(drive_manager): return []
+        indexer = FileIndexer.get_instance()
+        if indexer.needs_refresh(drive_manager): indexer.schedule(drive_manager) # Catalog delta, then re-embed changed files
+        return vector_index.search(user_id, question, VECTOR_TOP_K)
+    except Exception as e: logger.error(f"Vector retrieval failed, falling back to keyword search: {e}", exc_info=True); return []
+
+def passage_context(passages: List[Dict], total_max: int) -> Tuple[str, str]:
+    """Builds the file list and snippet sections of the LLM context from retrieved passages, best first."""
+    names = list(dict.fromkeys(f"- {p.get('name')} ({p.get('provider')})" for p in passages))
+    snippet_lines = ["\n\nExtracted Content Snippets:"]; total_len = 0
+    for p in passages:
+        if total_len >= total_max: snippet_lines.append("\n(More snippets omitted...)"); break
+        passage = p["passage"][:total_max - total_len]; total_len += len(passage)
+        snippet_lines.extend([f"\n--- Snippet: {p.get('name')} ---", passage, f"--- End: {p.get('name')} ---"])
+    return "\n".join(["Found relevant files:"] + names), "\n".join(snippet_lines)
+
 @app.post("/llm/ask", tags=["LLM"])
 async def llm_ask_endpoint( request_data: AskRequest, current_user: Dict = Depends(get_current_user)):
     original_question = request_data.question; telegram_user_id = request_data.user_id
     user_id = current_user["_id"]; username = current_user["username"]
     if not GROQ_API_KEY: raise HTTPException(status_code=503, detail="LLM unavailable.")
     logger.info(f"{username} (TG:{telegram_user_id}) asking: '{original_question}'")
-    search_query = await get_search_keywords_from_llm(original_question)
+    # Semantic retrieval answers from the vector index directly; keywords (an extra LLM call) only when it has nothing
+    passages = await run_in("drives", _retrieve_passages, user_id, original_question)
+    search_query = "" if passages else await get_search_keywords_from_llm(original_question)
     file_metadata_context = ""; extracted_snippets_context = ""; relevant_files: List[FileInfo] = [] # Use Pydantic model
-    if not search_query: file_metadata_context = "\n(Note: Could not find keywords.)"
+    if passages: file_metadata_context, extracted_snippets_context = passage_context(passages, 8000); logger.info(f"Using {len(passages)} retrieved passages.")
+    elif not search_query: file_metadata_context = "\n(Note: Could not find keywords.)"
     else:
         logger.info(f"Using keywords: '{search_query}'");
         try:
-            drive_manager = DriveManager(user_id=user_id); raw_files = drive_manager.search_files_for_llm(query=search_query, limit_per_drive=5, total_limit=10)
+            drive_manager = await run_in("drives", get_drive_manager, user_id); raw_files, _ = await drive_manager.asearch_files_with_status(query=search_query, limit_per_drive=5, total_limit=10)
             if raw_files:
                 parsed_files = []
                 for data in raw_files:
@@ -608,28 +815,8 @@ async def llm_ask_endpoint( request_data: AskRequest, current_user: Dict = Depen
 
                 if files_to_extract:
                     logger.info(f"Attempting extraction from (up to {MAX_EXTRACT}): {[f.name for f in files_to_extract]}")
-                    snippet_lines = ["\n\nExtracted Content Snippets:"]; MAX_LEN=2500; TOTAL_MAX=8000; total_len=0
-                    gdrive_handler = GoogleDriveFile(drive_manager)
-
-                    for file in files_to_extract: # Iterate through FileInfo again
-                        if total_len >= TOTAL_MAX: logger.warning("Max snippet length reached."); snippet_lines.append("\n(More snippets omitted...)"); break
-                        extracted = None; buffer = None
-                        try:
-                            if file.provider == "GoogleDrive" and file.id and file.bucket:
-                                service = _get_drive_service_instance(drive_manager, "GoogleDrive", file.bucket)
-                                if service: buffer = gdrive_handler.download_file_content_by_id(service, file.id, file.size)
-                                if buffer: extracted = gdrive_handler.extract_text_from_content(buffer, file.name, file.mimeType)
-                            elif file.provider == "Dropbox" and file.path_lower and file.access_token: # Need access_token from FileInfo
-                                 dbx_handler = DropBoxFile(file.access_token, drive_manager) # Instantiate with token from FileInfo
-                                 buffer = dbx_handler.download_file_content_by_path(file.path_lower)
-                                 if buffer: extracted = dbx_handler.extract_text_from_content(buffer, file.name)
-                        except Exception as ex_err: logger.error(f"Extract error {file.name}: {ex_err}", exc_info=True)
-                        finally:
-                             if buffer:
-                                 try: buffer.close()
-                                 except: pass
-                        if extracted: snippet = extracted[:MAX_LEN] + ("..." if len(extracted) > MAX_LEN else ""); snippet_lines.extend([f"\n--- Snippet: {file.name} ---", snippet, f"--- End: {file.name} ---"]); total_len += len(snippet)
-                        else: snippet_lines.append(f"\n(Could not extract text from {file.name})")
+                    MAX_LEN=2500; TOTAL_MAX=8000
+                    snippet_lines = await gather_context_snippets(files_to_extract, drive_manager, MAX_LEN, TOTAL_MAX)
                     if len(snippet_lines) > 1: extracted_snippets_context = "\n".join(snippet_lines); logger.info("Generated snippets context.")
 
         except Exception as e: logger.error(f"File search/extract error: {e}", exc_info=True); file_metadata_context = "\n(Note: Error getting file context.)"; extracted_snippets_context = ""
@@ -641,7 +828,7 @@ async def llm_ask_endpoint( request_data: AskRequest, current_user: Dict = Depen
         "Answer the user's questions concisely based *primarily* on the provided conversation history and the relevant file context."
         "The File Context includes:\n"
         "1. A list of potentially relevant files found by searching the user's cloud drives based on keywords from the latest question.\n"
-        "2. Extracted text snippets from the beginning of some of those text-based files (like PDF, DOCX, TXT).\n"
+        "2. Extracted text snippets from some of those text-based files (like PDF, DOCX, TXT).\n"
         "Prioritize information from the extracted snippets if they are relevant to the question. "
         "If the snippets don't answer the question, use the file list and conversation history. "
         "If no relevant context is found (empty file list or snippets), state that clearly and answer based on general knowledge if appropriate. "
@@ -656,7 +843,7 @@ async def llm_ask_endpoint( request_data: AskRequest, current_user: Dict = Depen
     if len(non_system) > MAX_MEMORY: full_messages = [m for m in full_messages if m['role'] == 'system'] + non_system[-MAX_MEMORY:]
 
     try: # Call Groq
-        logger.debug(f"Sending to Groq (Snippets: {extracted_snippets_context[:100]}...)"); client = Groq(api_key=GROQ_API_KEY)
+        logger.debug(f"Sending to Groq (Snippets: {extracted_snippets_context[:100]}...)"); client = get_groq_client(GROQ_API_KEY)
         completion = await asyncio.to_thread(client.chat.completions.create, model="llama-3.3-70b-versatile", messages=full_messages, temperature=0.7) # Corrected Llama 3.1 model name
         response_text = completion.choices[0].message.content.strip(); logger.info(f"Groq answer received.")
         current_memory = session_memory[telegram_user_id]; current_memory.append({"role": "user", "content": original_question}); current_memory.append({"role": "assistant", "content": response_text})
@@ -1,4 +1,4 @@
-let offset = 0;
+let nextCursor = null; // Continuation token from the X-Next-Cursor response header
 const limit = 50;
 
 async function loadFiles(append = false) {
@@ -15,8 +15,9 @@ async function loadFiles(append = false) {
     }
 
     try {
-        console.log(`Fetching files with JWT: ${jwt}, offset: ${offset}, limit: ${limit}`);
-        const response = await fetch(`http://127.0.0.1:8000/viewfiles?limit=${limit}&offset=${offset}`, {
+        const cursorParam = append && nextCursor ? `&cursor=${encodeURIComponent(nextCursor)}` : '';
+        console.log(`Fetching files with JWT: ${jwt}, limit: ${limit}, continuation: ${Boolean(cursorParam)}`);
+        const response = await fetch(`http://127.0.0.1:8000/viewfiles?limit=${limit}${cursorParam}`, {
             method: 'GET',
             headers: {
                 'Authorization': `Bearer ${jwt}`,
@@ -31,8 +32,9 @@ async function loadFiles(append = false) {
 
         const files = await response.json();
         console.log("Files response:", files);
+        nextCursor = response.headers.get('X-Next-Cursor');
 
-        if (files.length === 0 && offset === 0) {
+        if (files.length === 0 && !append) {
             filesTableBody.innerHTML = '<tr><td colspan="4">No files found.</td></tr>';
             viewMoreBtn.style.display = 'none';
             return;
@@ -54,8 +56,8 @@ async function loadFiles(append = false) {
             `;
         });
 
-        // Show "View More" if there might be more files
-        if (files.length === limit) {
+        // Show "View More" only if the server handed out a cursor for the next page
+        if (nextCursor) {
             viewMoreBtn.style.display = 'block';
         } else {
             viewMoreBtn.style.display = 'none';
@@ -69,7 +71,6 @@ async function loadFiles(append = false) {
 }
 
 function viewMore() {
-    offset += limit;
     loadFiles(true); // Append new files
 }
 
@@ -1,5 +1,6 @@
 # --- START OF FILE synclybot.py ---
 
+import io
 import logging
 import requests
 from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup # Added Inline buttons
@@ -40,6 +41,11 @@ def sanitize_filename(filename: str) -> str:
     sanitized = re.sub(r'_+', '_', sanitized); return sanitized if sanitized else "downloaded_file"
 
 
+def clear_listing_state(context: CallbackContext) -> None:
+    """Forgets /list pagination state (continuation cursor, files shown, page size)."""
+    for key in ("list_cursor", "list_shown", "list_limit"): context.user_data.pop(key, None)
+
+
 # --- Authentication Check Helper ---
 async def check_and_complete_auth(update: Update, context: CallbackContext) -> bool:
     """
@@ -258,8 +264,7 @@ async def logout(update: Update, context: CallbackContext) -> None:
     if "pending_link_id" in context.user_data: context.user_data.pop("pending_link_id"); state_cleared = True
     if "pending_link_expiry" in context.user_data: context.user_data.pop("pending_link_expiry"); state_cleared = True
     # Clear listing state too
-    if "list_offset" in context.user_data: context.user_data.pop("list_offset"); state_cleared = True
-    if "list_limit" in context.user_data: context.user_data.pop("list_limit"); state_cleared = True
+    if "list_limit" in context.user_data: clear_listing_state(context); state_cleared = True
 
     if state_cleared:
         logger.info(f"User {user_id} logged out / session cleared.")
@@ -306,7 +311,7 @@ async def list_files(update: Update, context: CallbackContext) -> None:
     if context.args:
         try: limit = int(context.args[0]); assert 0 < limit <= 100
         except: await update.message.reply_text("❌ Invalid limit (1-100)."); return
-    context.user_data["list_offset"] = 0; context.user_data["list_limit"] = limit
+    context.user_data["list_cursor"] = None; context.user_data["list_shown"] = 0; context.user_data["list_limit"] = limit
     await update.message.reply_text(f"⏳ Fetching first {limit} files..."); await fetch_and_display_files(update, context, False)
 
 
@@ -316,35 +321,38 @@ async def more_files(update: Update, context: CallbackContext) -> None:
 
     if not await check_and_complete_auth(update, context): await update.message.reply_text("❌ Please use /login first."); return
     # Auth succeeded, proceed...
-    offset = context.user_data.get("list_offset"); limit = context.user_data.get("list_limit")
-    if offset is None or limit is None: await update.message.reply_text("ℹ️ Use /list first to start viewing files."); return
-    context.user_data["list_offset"] = offset + limit
+    cursor = context.user_data.get("list_cursor"); limit = context.user_data.get("list_limit")
+    if cursor is None or limit is None: await update.message.reply_text("ℹ️ Use /list first to start viewing files."); return
     await update.message.reply_text(f"⏳ Fetching next {limit} files..."); await fetch_and_display_files(update, context, True)
 
 
 async def fetch_and_display_files(update: Update, context: CallbackContext, is_continuation: bool):
     # This helper assumes auth was checked by the caller
-    jwt = context.user_data.get("jwt"); offset = context.user_data.get("list_offset"); limit = context.user_data.get("list_limit")
+    jwt = context.user_data.get("jwt"); cursor = context.user_data.get("list_cursor"); limit = context.user_data.get("list_limit")
+    shown = context.user_data.get("list_shown", 0) # Files already displayed, for numbering only
     user = update.effective_user; username = context.user_data.get('username', f'User_{user.id if user else "?"}')
     effective_message = update.effective_message # Use this for replies
 
     if not effective_message: logger.error("INTERNAL ERROR: fetch_and_display_files called without message context."); return
     if not jwt: logger.error("INTERNAL ERROR: fetch_and_display_files called without JWT."); await effective_message.reply_text("Error: Authentication missing."); return
-    if offset is None or limit is None: logger.error("INTERNAL ERROR: fetch_and_display_files called without pagination state."); await effective_message.reply_text("Error: Listing state lost, please use /list again."); return
+    if limit is None or (is_continuation and cursor is None): logger.error("INTERNAL ERROR: fetch_and_display_files called without pagination state."); await effective_message.reply_text("Error: Listing state lost, please use /list again."); return
 
     try:
-        logger.info(f"Fetching files: user={username} ({user.id}), limit={limit}, offset={offset}")
-        response = requests.get(f"{API_BASE_URL.rstrip('/')}/viewfiles", params={"limit": limit, "offset": offset}, headers={"Authorization": f"Bearer {jwt}"}, timeout=25)
+        logger.info(f"Fetching files: user={username} ({user.id}), limit={limit}, continuation={is_continuation}")
+        params = {"limit": limit}
+        if cursor: params["cursor"] = cursor # Opaque continuation token from the previous page
+        response = requests.get(f"{API_BASE_URL.rstrip('/')}/viewfiles", params=params, headers={"Authorization": f"Bearer {jwt}"}, timeout=25)
         response.raise_for_status()
         files = response.json(); logger.debug(f"API file list response count: {len(files)}")
+        next_cursor = response.headers.get("X-Next-Cursor")
 
         if not files:
             msg = "✅ No more files to show." if is_continuation else "📂 No files found in your connected drives."
             await effective_message.reply_text(msg)
-            context.user_data.pop("list_offset", None); context.user_data.pop("list_limit", None) # Clear state
+            clear_listing_state(context)
             return
 
-        lines = []; current_num = offset + 1
+        lines = []; current_num = shown + 1
         for file in files:
             size_display = "Unknown"; size_bytes = file.get('size');
             if isinstance(size_bytes, int):
@@ -354,14 +362,15 @@ async def fetch_and_display_files(update: Update, context: CallbackContext, is_c
                 else: size_display = f"{size_bytes / (1024*1024):.2f} MB"
             lines.append(f"{current_num}. 📄 {file.get('name','Unknown File')} ({file.get('provider','?')}, {size_display})"); current_num += 1
 
-        start_num = offset + 1; end_num = offset + len(files)
+        start_num = shown + 1; end_num = shown + len(files)
         message = f"📂 Files {start_num}-{end_num}:\n\n" + "\n".join(lines)
 
-        if len(files) == limit: # Potentially more files exist
+        if next_cursor: # More files exist
+            context.user_data["list_cursor"] = next_cursor; context.user_data["list_shown"] = end_num
             message += "\n\nℹ️ Type /more to see the next set, or /exitlist to stop."
         else: # Reached the end
             message += "\n\n✅ Reached the end of your files."
-            context.user_data.pop("list_offset", None); context.user_data.pop("list_limit", None) # Clear state
+            clear_listing_state(context)
 
         await effective_message.reply_text(message) # Send plain text
 
@@ -369,17 +378,17 @@ async def fetch_and_display_files(update: Update, context: CallbackContext, is_c
         # Use helper to check for 401, otherwise log and inform user
         if not await handle_api_error(e, update, context, "list files"):
              # If it wasn't 401, clear listing state as we failed
-             context.user_data.pop("list_offset", None); context.user_data.pop("list_limit", None)
+             clear_listing_state(context)
     except Exception as e:
         logger.error(f"Unexpected error fetching/displaying files for user {user.id}: {e}", exc_info=True)
         await effective_message.reply_text("❌ An unexpected error occurred while fetching files.")
-        context.user_data.pop("list_offset", None); context.user_data.pop("list_limit", None) # Clear state
+        clear_listing_state(context)
 
 
 async def exit_listing(update: Update, context: CallbackContext) -> None: # Keep as is
     user = update.effective_user; logger.info(f"/exitlist from user: {user.id if user else '?'}")
-    if "list_offset" in context.user_data or "list_limit" in context.user_data:
-        context.user_data.pop("list_offset", None); context.user_data.pop("list_limit", None); await update.message.reply_text("✅ Exited file listing mode.")
+    if "list_limit" in context.user_data:
+        clear_listing_state(context); await update.message.reply_text("✅ Exited file listing mode.")
     else: await update.message.reply_text("ℹ️ You weren't in file listing mode.")
 
 
@@ -421,32 +430,24 @@ async def upload_file(update: Update, context: CallbackContext) -> None:
     jwt = context.user_data.get("jwt")
 
     if not update.message or not update.message.document: await update.message.reply_text("❓ Please send the file you want to upload as a document."); return
-    doc = update.message.document; original_filename = doc.file_name or "untitled_upload"; sanitized_filename = sanitize_filename(original_filename)
+    doc = update.message.document; original_filename = doc.file_name or "untitled_upload"
     file_size = doc.file_size; mime_type = doc.mime_type or mimetypes.guess_type(original_filename)[0] or "application/octet-stream"
 
     await update.message.reply_text(f"⏳ Receiving '{original_filename}' ({file_size / (1024*1024):.2f} MB)...")
-    temp_dir = os.path.join("downloads", str(user.id)); os.makedirs(temp_dir, exist_ok=True); temp_file_path = os.path.join(temp_dir, sanitized_filename)
     username = context.user_data.get('username', '?')
 
     try:
-        tg_file = await context.bot.get_file(doc.file_id); await tg_file.download_to_drive(custom_path=temp_file_path); logger.info(f"File downloaded to temporary path: {temp_file_path}")
+        # Bot API documents are capped at 20 MB, so relay them through memory instead of downloads/
+        tg_file = await context.bot.get_file(doc.file_id); buffer = io.BytesIO()
+        await tg_file.download_to_memory(out=buffer); buffer.seek(0); logger.info(f"Received {buffer.getbuffer().nbytes} bytes from Telegram for user {user.id}")
         await update.message.reply_text("⬆️ Uploading to Syncly storage...")
-        with open(temp_file_path, "rb") as f:
-            files_payload = {"file": (original_filename, f, mime_type)} # Send original name to API
-            response = requests.post(f"{API_BASE_URL.rstrip('/')}/files/upload", files=files_payload, headers={"Authorization": f"Bearer {jwt}"}, timeout=300) # Longer timeout for large uploads
-            response.raise_for_status()
+        files_payload = {"file": (original_filename, buffer, mime_type)} # Send original name to API
+        response = requests.post(f"{API_BASE_URL.rstrip('/')}/files/upload", files=files_payload, headers={"Authorization": f"Bearer {jwt}"}, timeout=300) # Longer timeout for large uploads
+        response.raise_for_status()
         upload_result = response.json(); logger.info(f"File upload API response for user {user.id}: {upload_result}")
         await update.message.reply_text(upload_result.get("message", "✅ File uploaded successfully!"))
     except requests.exceptions.RequestException as e: await handle_api_error(e, update, context, "file upload")
     except Exception as e: logger.error(f"Error during file upload process for user {user.id}: {e}", exc_info=True); await update.message.reply_text("❌ An error occurred during the file upload process.")
-    finally:
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path); logger.info(f"Temporary file {temp_file_path} cleaned up.")
-                try:
-                    if not os.listdir(temp_dir): os.rmdir(temp_dir); logger.info(f"Removed empty temporary directory: {temp_dir}")
-                except OSError: logger.debug(f"Temporary directory {temp_dir} not empty or couldn't be removed.")
-            except OSError as e: logger.warning(f"Could not clean up temporary file {temp_file_path}: {e}")
 
 
 # --- START OF UPDATED storage_info FUNCTION ---
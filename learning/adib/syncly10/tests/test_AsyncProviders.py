@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+
+pytest.importorskip("pymongo")
+
+import AsyncProviders
+from AsyncProviders import _byte_range, _AuthorizedClient, AsyncGoogleDrive
+
+
+def test_byte_range_headers():
+    assert _byte_range(0, None) is None # Whole file: no Range header
+    assert _byte_range(0, 10) == "bytes=0-9"
+    assert _byte_range(5, 6) == "bytes=5-5"
+    assert _byte_range(100, None) == "bytes=100-"
+
+
+class _Drive:
+    provider = "GoogleDrive"
+    bucket_number = 1
+
+
+class _Client(AsyncGoogleDrive):
+    def __init__(self):
+        super().__init__(_Drive())
+        self.token, self.refreshes = "stale", 0
+
+    def _access_token(self): return self.token
+    def _token_expired(self): return False
+    def _refresh_token(self): self.refreshes += 1; self.token = "fresh"
+
+
+@pytest.fixture
+def mock_transport(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["Authorization"])
+        if request.headers["Authorization"] == "Bearer stale":
+            return httpx.Response(401)
+        return httpx.Response(200, content=b"payload")
+
+    monkeypatch.setattr(AsyncProviders, "_http_client", None)
+    monkeypatch.setattr(AsyncProviders, "get_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return seen
+
+
+def test_abstract_hooks_must_be_implemented():
+    with pytest.raises(TypeError):
+        _AuthorizedClient(_Drive())
+
+
+def test_request_refreshes_once_on_401(mock_transport):
+    client = _Client()
+    response = asyncio.run(client._request("GET", "https://example.test/file"))
+    assert response.content == b"payload" and client.refreshes == 1
+    assert mock_transport == ["Bearer stale", "Bearer fresh"]
+
+
+def test_stream_refreshes_once_on_401(mock_transport):
+    async def read(client):
+        return b"".join([block async for block in client._stream("GET", "https://example.test/file", {})])
+
+    client = _Client()
+    assert asyncio.run(read(client)) == b"payload" and client.refreshes == 1
+    assert mock_transport == ["Bearer stale", "Bearer fresh"]
@@ -0,0 +1,355 @@
+import copy
+import hashlib
+import io
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+import ChunkTransfer
+from ChunkTransfer import RangeReader, plan_chunks
+
+MB = 1024 * 1024
+
+
+class FakeDrive:
+    def __init__(self, provider, bucket_number):
+        self.provider = provider
+        self.bucket_number = bucket_number
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_FREE_SPACE_MARGIN", 1 * MB)
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_MAX_CHUNK_SIZE", 4 * MB)
+
+
+def test_plan_chunks_covers_file_in_order(small_limits):
+    a, b = FakeDrive("GoogleDrive", 1), FakeDrive("Dropbox", 2)
+    plan = plan_chunks(10 * MB, [(3 * MB, b), (9 * MB, a)])
+    assert [(p["offset"], p["size"], p["drive"]) for p in plan] == [(0, 4 * MB, a), (4 * MB, 4 * MB, a), (8 * MB, 2 * MB, b)]
+    assert [p["index"] for p in plan] == [0, 1, 2]
+
+
+def test_plan_chunks_fills_largest_bucket_first_and_stops_when_done(small_limits):
+    a, b = FakeDrive("GoogleDrive", 1), FakeDrive("Dropbox", 2)
+    plan = plan_chunks(2 * MB, [(5 * MB, b), (20 * MB, a)])
+    assert len(plan) == 1 and plan[0]["drive"] is a and plan[0]["size"] == 2 * MB
+
+
+def test_plan_chunks_keeps_margin_free(small_limits):
+    a = FakeDrive("GoogleDrive", 1)
+    with pytest.raises(ValueError):
+        plan_chunks(5 * MB, [(5 * MB, a)]) # Only 4 MB usable after the margin
+
+
+def test_plan_chunks_ignores_buckets_smaller_than_margin(small_limits):
+    a, b = FakeDrive("GoogleDrive", 1), FakeDrive("Dropbox", 2)
+    plan = plan_chunks(3 * MB, [(MB // 2, b), (5 * MB, a)])
+    assert {p["drive"] for p in plan} == {a}
+
+
+def test_range_reader_reads_only_its_window():
+    source = io.BytesIO(bytes(range(100)))
+    reader = RangeReader(source, 10, 20)
+    assert reader.read(5) == bytes(range(10, 15))
+    assert reader.read() == bytes(range(15, 30))
+    assert reader.read() == b""
+
+
+def test_range_reader_seek_is_clamped_and_relative_to_window():
+    reader = RangeReader(io.BytesIO(bytes(range(100))), 50, 10)
+    assert reader.seek(-3, io.SEEK_END) == 7
+    assert reader.read() == bytes(range(57, 60))
+    assert reader.seek(100) == 10 and reader.read() == b""
+    assert reader.seek(-5) == 0 and reader.read(1) == bytes([50])
+
+
+def test_range_readers_share_one_source():
+    source = io.BytesIO(b"aaaabbbbcccc")
+    first, second = RangeReader(source, 0, 4), RangeReader(source, 4, 4)
+    assert second.read(2) == b"bb"
+    assert first.read() == b"aaaa"
+    assert second.read() == b"bb"
+
+
+class StoredDrive(FakeDrive):
+    """Serves byte ranges of in-memory objects, like Service.iterDownload."""
+    service = True
+
+    def __init__(self, provider, bucket_number, objects, block_size=3):
+        super().__init__(provider, bucket_number)
+        self.objects = objects
+        self.block_size = block_size
+
+    def iterDownload(self, file_id, start=0, end=None):
+        data = self.objects[file_id][start:end]
+        for i in range(0, len(data), self.block_size):
+            yield data[i:i + self.block_size]
+
+
+class FakeDriveManager:
+    user_id = "user"
+
+    def __init__(self, drives):
+        self.drives = drives
+
+
+@pytest.fixture
+def assembler(monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "Database", lambda: type("NoDatabase", (), {"get_instance": lambda self: None})())
+    drive_a = StoredDrive("GoogleDrive", 1, {"c0": b"0123456789"})
+    drive_b = StoredDrive("Dropbox", 2, {"c1": b"abcdefghij", "c2": b"KLMNO"})
+    return ChunkTransfer.ChunkAssembler(FakeDriveManager([drive_a, drive_b]))
+
+
+MANIFEST = {"file_name": "f.bin", "file_size": 25, "chunks": [
+    {"chunk_name": "f.bin.part1", "index": 1, "offset": 10, "size": 10, "provider": "Dropbox", "bucket": 2, "file_id": "c1"},
+    {"chunk_name": "f.bin.part0", "index": 0, "offset": 0, "size": 10, "provider": "GoogleDrive", "bucket": 1, "file_id": "c0"},
+    {"chunk_name": "f.bin.part2", "index": 2, "offset": 20, "size": 5, "provider": "Dropbox", "bucket": 2, "file_id": "c2"},
+]}
+WHOLE = b"0123456789abcdefghijKLMNO"
+
+
+@pytest.mark.parametrize("start, end", [(0, None), (0, 25), (5, 15), (10, 20), (19, 21), (24, 25), (3, 4)])
+def test_iter_range_returns_exact_bytes_across_chunks(assembler, start, end):
+    assert b"".join(assembler.iter_range(MANIFEST, start, end)) == WHOLE[start:end]
+
+
+def test_check_available_only_requires_buckets_in_range(assembler):
+    manifest = dict(MANIFEST, chunks=[dict(c, bucket=9) if c["index"] == 2 else c for c in MANIFEST["chunks"]])
+    assembler.check_available(manifest, 0, 20)
+    with pytest.raises(LookupError):
+        assembler.check_available(manifest, 15, 25)
+
+
+@pytest.fixture
+def small_cdc(monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "CDC_MIN_SIZE", 1024)
+    monkeypatch.setattr(ChunkTransfer, "CDC_AVG_SIZE", 4096)
+    monkeypatch.setattr(ChunkTransfer, "CDC_MAX_SIZE", 16384)
+
+
+def random_bytes(size, seed):
+    import random
+    return random.Random(seed).randbytes(size)
+
+
+def blocks_of(data):
+    return list(ChunkTransfer.cdc_blocks(io.BytesIO(data), len(data)))
+
+
+def test_cdc_blocks_cover_the_file_within_bounds(small_cdc):
+    data = random_bytes(300_000, 1)
+    blocks = blocks_of(data)
+    offset = 0
+    for i, (block_offset, size, sha) in enumerate(blocks):
+        assert block_offset == offset
+        assert size <= 16384
+        assert size >= 1024 or i == len(blocks) - 1
+        assert sha == hashlib.sha256(data[offset:offset + size]).hexdigest()
+        offset += size
+    assert offset == len(data)
+
+
+def test_cdc_cuts_follow_anchor_bytes(small_cdc):
+    data = random_bytes(300_000, 2)
+    for offset, size, _ in blocks_of(data)[:-1]:
+        if size < 16384: # Not forced by the maximum size
+            assert data[offset + size - 1:offset + size] == ChunkTransfer.CDC_ANCHOR
+
+
+def test_cdc_boundaries_realign_after_an_insertion(small_cdc):
+    data = random_bytes(300_000, 3)
+    edited = data[:5000] + b"inserted bytes" + data[5000:]
+    before = {sha for _, _, sha in blocks_of(data)}
+    after = [sha for _, _, sha in blocks_of(edited)]
+    changed = [sha for sha in after if sha not in before]
+    assert len(changed) <= 2 and len(after) > 20
+
+
+def test_cdc_blocks_of_empty_file(small_cdc):
+    assert blocks_of(b"") == []
+
+
+def test_assign_blocks_uses_most_free_bucket(monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_FREE_SPACE_MARGIN", 0)
+    a, b = FakeDrive("GoogleDrive", 1), FakeDrive("Dropbox", 2)
+    parts = ChunkTransfer.assign_blocks([{"size": 6}, {"size": 5}, {"size": 4}], [(10, a), (8, b)])
+    assert [p["drive"] for p in parts] == [a, b, a]
+    with pytest.raises(ValueError):
+        ChunkTransfer.assign_blocks([{"size": 11}], [(10, a), (8, b)])
+
+
+def test_block_and_logical_file_names():
+    assert ChunkTransfer.is_block_name(ChunkTransfer.block_name("ab" * 32))
+    assert not ChunkTransfer.is_block_name("report.pdf") and not ChunkTransfer.is_block_name(None)
+    single = {"file_name": "a.txt", "chunks": [{"chunk_name": "a.txt"}]}
+    assert not ChunkTransfer.is_logical_file(single)
+    assert ChunkTransfer.is_logical_file({"file_name": "alias.txt", "chunks": [{"chunk_name": "a.txt"}]})
+    assert ChunkTransfer.is_logical_file({"file_name": "big", "chunks": [{"chunk_name": "big.part0"}, {"chunk_name": "big.part1"}]})
+
+
+def test_version_manifest_and_refs():
+    manifest = {"file_name": "f", "chunks": [{"file_id": "3"}],
+                "versions": [{"chunks": [{"file_id": "1"}]}, {"chunks": [{"file_id": "2"}]}]}
+    assert ChunkTransfer.ChunkAssembler.version_manifest(manifest, None) is manifest
+    assert ChunkTransfer.ChunkAssembler.version_manifest(manifest, 1)["chunks"] == [{"file_id": "2"}]
+    assert ChunkTransfer.ChunkAssembler.version_manifest(manifest, 2)["file_name"] == "f"
+    with pytest.raises(LookupError):
+        ChunkTransfer.ChunkAssembler.version_manifest(manifest, 3)
+    assert [c["file_id"] for c in ChunkTransfer.manifest_refs(manifest)] == ["3", "1", "2"]
+
+
+class MemoryCollection:
+    """The few metadata_collection calls ChunkUploader makes, over a list of manifests."""
+    def __init__(self):
+        self.docs = []
+
+    def _match(self, key):
+        return next((d for d in self.docs if d["user_id"] == key["user_id"] and d["file_name"] == key["file_name"]), None)
+
+    def find_one(self, key, projection=None):
+        return copy.deepcopy(self._match(key))
+
+    def find(self, query, projection=None):
+        return [d for d in self.docs if d["user_id"] == query["user_id"]]
+
+    def update_one(self, key, update, upsert=False):
+        doc = self._match(key)
+        if doc is None:
+            doc = dict(key); self.docs.append(doc)
+        doc.update(update["$set"])
+        for field in update.get("$unset", {}): doc.pop(field, None)
+        for field, push in update.get("$push", {}).items():
+            doc[field] = (doc.get(field, []) + push["$each"])[push["$slice"]:]
+
+    def count_documents(self, query, limit=0):
+        file_id = query["$or"][0]["chunks.file_id"]
+        return sum(1 for d in self.docs if any(c.get("file_id") == file_id for c in ChunkTransfer.manifest_refs(d)))
+
+
+class UploadDrive(FakeDrive):
+    """Keeps uploaded objects in memory, autorenaming taken names like Dropbox; fail_on makes uploads of that name raise."""
+    service = True
+
+    def __init__(self, provider, bucket_number, free, fail_on=None):
+        super().__init__(provider, bucket_number)
+        self.free, self.fail_on, self.objects, self._ids = free, fail_on, {}, 0
+
+    def uploadStream(self, reader, name, size, mimetype):
+        if name == self.fail_on:
+            raise IOError(f"upload of {name} failed")
+        self._ids += 1
+        file_id = f"{self.provider}-{self._ids}"
+        if any(stored == name for stored, _ in self.objects.values()):
+            name = f"{name} ({self._ids})"
+        self.objects[file_id] = (name, reader.read())
+        return {"file_id": file_id, "name": name}
+
+    def deleteFile(self, file_id):
+        return self.objects.pop(file_id, None) is not None
+
+
+class UploadDriveManager(FakeDriveManager):
+    def get_drive_quotas(self):
+        return [(drive, (drive.free, 0)) for drive in self.drives]
+
+    def record_upload(self, bucket_number, size):
+        pass
+
+
+@pytest.fixture
+def uploader_for(monkeypatch):
+    collection = MemoryCollection()
+    database = type("MemoryDatabase", (), {"metadata_collection": collection})()
+    monkeypatch.setattr(ChunkTransfer, "Database", lambda: type("Db", (), {"get_instance": lambda self: database})())
+    monkeypatch.setattr(ChunkTransfer, "CHUNK_UPLOAD_RETRIES", 0)
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_FREE_SPACE_MARGIN", 0)
+
+    def make(*drives):
+        return ChunkTransfer.ChunkUploader(UploadDriveManager(list(drives))), collection
+    return make
+
+
+def reassemble(manifest, drives):
+    objects = {file_id: data for drive in drives for file_id, (_, data) in drive.objects.items()}
+    return b"".join(objects[c["file_id"]][:c["size"]] for c in sorted(manifest["chunks"], key=lambda c: c["index"]))
+
+
+def test_fixed_upload_splits_across_buckets_and_saves_manifest(uploader_for, monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "fixed")
+    a, b = UploadDrive("GoogleDrive", 1, 6), UploadDrive("Dropbox", 2, 10)
+    uploader, collection = uploader_for(a, b)
+    data = b"0123456789abcde"
+    manifest = uploader.upload(io.BytesIO(data), "f.bin", None, len(data))
+    assert manifest["split"] and manifest["chunking"] == "fixed"
+    assert [c["chunk_name"] for c in manifest["chunks"]] == ["f.bin.part0", "f.bin.part1"]
+    assert reassemble(manifest, [a, b]) == data
+    assert collection.find_one({"user_id": "user", "file_name": "f.bin"})["chunks"] == manifest["chunks"]
+
+
+def test_cdc_upload_stores_each_block_once(uploader_for, monkeypatch, small_cdc):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "cdc")
+    a, b = UploadDrive("GoogleDrive", 1, 10 * MB), UploadDrive("Dropbox", 2, 10 * MB)
+    uploader, collection = uploader_for(a, b)
+    block = random_bytes(6000, 4) + b"\n"
+    data = random_bytes(50_000, 5) + block * 3
+    manifest = uploader.upload(io.BytesIO(data), "f.bin", None, len(data))
+    assert manifest["chunking"] == "cdc" and reassemble(manifest, [a, b]) == data
+    stored_names = [name for drive in (a, b) for name, _ in drive.objects.values()]
+    assert len(stored_names) == len(set(stored_names)) < len(manifest["chunks"]) # Repeated blocks are uploaded once
+    assert all(ChunkTransfer.is_block_name(name) for name in stored_names)
+    assert collection.find_one({"user_id": "user", "file_name": "f.bin"})["chunks"] == manifest["chunks"]
+
+
+def test_failed_chunk_rolls_back_uploaded_chunks(uploader_for, monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "fixed")
+    a, b = UploadDrive("GoogleDrive", 1, 6), UploadDrive("Dropbox", 2, 10, fail_on="f.bin.part0")
+    uploader, collection = uploader_for(a, b)
+    with pytest.raises(IOError):
+        uploader.upload(io.BytesIO(b"0123456789abcde"), "f.bin", None, 15)
+    assert a.objects == {} and b.objects == {} and collection.docs == []
+
+
+def test_failed_manifest_save_rolls_back_uploaded_chunks(uploader_for, monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "fixed")
+    a, b = UploadDrive("GoogleDrive", 1, 6), UploadDrive("Dropbox", 2, 10)
+    uploader, collection = uploader_for(a, b)
+
+    def database_down(*args, **kwargs):
+        raise RuntimeError("database down")
+    monkeypatch.setattr(collection, "update_one", database_down)
+    with pytest.raises(RuntimeError):
+        uploader.upload(io.BytesIO(b"0123456789abcde"), "f.bin", None, 15)
+    assert a.objects == {} and b.objects == {}
+
+
+def test_reupload_releases_the_replaced_object(uploader_for, monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "fixed")
+    a = UploadDrive("Dropbox", 1, 100)
+    uploader, collection = uploader_for(a)
+    uploader.upload(io.BytesIO(b"first"), "a.txt", None, 5)
+    manifest = uploader.upload(io.BytesIO(b"second"), "a.txt", None, 6)
+    assert manifest["chunks"][0]["chunk_name"] == "a.txt (2)" # The name Dropbox stored it under
+    assert list(a.objects.values()) == [("a.txt (2)", b"second")]
+
+
+def test_reupload_keeps_objects_an_alias_points_at(uploader_for, monkeypatch):
+    monkeypatch.setattr(ChunkTransfer, "SPLIT_CHUNKING_MODE", "fixed")
+    a = UploadDrive("Dropbox", 1, 100)
+    uploader, collection = uploader_for(a)
+    first = uploader.upload(io.BytesIO(b"first"), "a.txt", None, 5)
+    collection.docs.append({"user_id": "user", "file_name": "b.txt", "chunks": first["chunks"], "dedup_of": "a.txt"})
+    uploader.upload(io.BytesIO(b"second"), "a.txt", None, 6)
+    assert sorted(data for _, data in a.objects.values()) == [b"first", b"second"]
+
+
+def test_replaced_alias_owns_nothing(uploader_for):
+    a = UploadDrive("Dropbox", 1, 100)
+    a.objects["own"] = ("users-own-file.txt", b"data") # Stored by the user, found through the catalog
+    uploader, collection = uploader_for(a)
+    alias = {"user_id": "user", "file_name": "b.txt", "dedup_of": "users-own-file.txt",
+             "chunks": [{"chunk_name": "users-own-file.txt", "index": 0, "size": 4, "provider": "Dropbox", "bucket": 1, "file_id": "own"}]}
+    uploader.release_unreferenced(alias, {"user_id": "user", "file_name": "b.txt"})
+    assert "own" in a.objects
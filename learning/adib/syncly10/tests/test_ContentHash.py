@@ -0,0 +1,36 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+import ContentHash
+from ContentHash import compute_content_hashes, DROPBOX_HASH_BLOCK_SIZE
+
+
+def dropbox_reference_hash(data: bytes) -> str:
+    """Dropbox's documented algorithm, written out plainly."""
+    blocks = [data[i:i + DROPBOX_HASH_BLOCK_SIZE] for i in range(0, len(data), DROPBOX_HASH_BLOCK_SIZE)]
+    return hashlib.sha256(b"".join(hashlib.sha256(block).digest() for block in blocks)).hexdigest()
+
+
+@pytest.mark.parametrize("size", [0, 1, DROPBOX_HASH_BLOCK_SIZE, DROPBOX_HASH_BLOCK_SIZE + 1, 2 * DROPBOX_HASH_BLOCK_SIZE + 12345])
+def test_content_hashes_match_reference_algorithms(monkeypatch, size):
+    monkeypatch.setattr(ContentHash, "DOWNLOAD_CHUNK_SIZE", 1000003) # Reads that straddle Dropbox blocks
+    data = os.urandom(size)
+    hashes = compute_content_hashes(io.BytesIO(data))
+    assert hashes == {"content_sha256": hashlib.sha256(data).hexdigest(), "content_md5": hashlib.md5(data).hexdigest(),
+                      "dropbox_content_hash": dropbox_reference_hash(data)}
+
+
+def test_empty_file_dropbox_hash():
+    assert compute_content_hashes(io.BytesIO(b""))["dropbox_content_hash"] == hashlib.sha256(b"").hexdigest()
+
+
+def test_stream_is_rewound():
+    stream = io.BytesIO(b"some content")
+    stream.seek(4)
+    compute_content_hashes(stream)
+    assert stream.tell() == 0
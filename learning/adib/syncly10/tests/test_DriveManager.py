@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("googleapiclient")
+pytest.importorskip("dropbox")
+
+import DriveManager as drive_manager_module
+from DriveManager import DriveManager, SEARCH_STRONG_HIT_SCORE
+
+QUERY_TERMS = {"annual", "budget", "report", "2024"}
+
+
+def score(name, position):
+    return DriveManager._search_score({"name": name}, QUERY_TERMS, position)
+
+
+def test_strong_hit_needs_half_the_terms_at_the_top():
+    assert score("annual.txt", 0) == 1.5 < SEARCH_STRONG_HIT_SCORE # 1 of 4 terms, even as a bucket's first result
+    assert score("annual budget.txt", 0) == SEARCH_STRONG_HIT_SCORE # 2 of 4 at the top
+    assert score("annual budget.txt", 1) < SEARCH_STRONG_HIT_SCORE
+    assert score("annual budget report.txt", 1) >= SEARCH_STRONG_HIT_SCORE
+    assert score("annual budget report 2024.pdf", 50) >= SEARCH_STRONG_HIT_SCORE
+
+
+class SearchDrive:
+    service = True
+
+    def __init__(self, bucket_number, names, delay=0.0):
+        self.provider, self.bucket_number, self.names, self.delay = "GoogleDrive", bucket_number, names, delay
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(drive_manager_module, "SEARCH_FANOUT_DEADLINE_SECONDS", 2.0)
+    manager = DriveManager.__new__(DriveManager)
+
+    def search_files_in_drive(drive, query, limit):
+        time.sleep(drive.delay)
+        return [{"id": f"{drive.bucket_number}-{i}", "name": name, "provider": drive.provider} for i, name in enumerate(drive.names)]
+    manager.search_files_in_drive = search_files_in_drive
+    return manager
+
+
+def test_fanout_stops_early_on_strong_hits(manager):
+    manager.drives = [SearchDrive(1, ["annual budget report.txt"]), SearchDrive(2, ["annual.txt"], delay=1.0)]
+    results, partial = manager._search_drives("annual budget report 2024", 5, 1)
+    assert [r["name"] for r in results] == ["annual budget report.txt"]
+    assert partial == [{"provider": "GoogleDrive", "bucket": 2, "reason": "skipped"}]
+
+
+def test_fanout_waits_when_hits_are_weak(manager):
+    manager.drives = [SearchDrive(1, ["annual.txt"]), SearchDrive(2, ["annual budget report.txt"], delay=0.2)]
+    results, partial = manager._search_drives("annual budget report 2024", 5, 1)
+    assert [r["name"] for r in results] == ["annual budget report.txt"] and partial == []
+
+
+class LinkService:
+    def __init__(self):
+        self.calls = []
+
+    async def atemporary_link(self, file_id):
+        self.calls.append(file_id)
+        if file_id == "id:broken": raise IOError("link failed")
+        return f"https://dl.example/{file_id}"
+
+
+def test_dropbox_paths_become_temporary_links():
+    import asyncio
+    from Dropbox import DropboxService
+    dropbox = DropboxService.__new__(DropboxService)
+    dropbox.service, dropbox.bucket_number = object(), 1
+    links = LinkService()
+    manager = DriveManager.__new__(DriveManager)
+    manager.drives, manager._dropbox_links = [dropbox], {}
+    manager.async_service = lambda drive: links
+
+    def page():
+        return [{"id": "id:a", "name": "a.txt", "provider": "Dropbox", "bucket": 1, "path": "dropbox:/a.txt"},
+                {"id": "id:broken", "name": "b.txt", "provider": "Dropbox", "bucket": 1, "path": "dropbox:/b.txt"},
+                {"id": "g", "name": "c.txt", "provider": "GoogleDrive", "bucket": 2, "path": "https://drive.google.com/file/d/g/view"}]
+
+    files = asyncio.run(manager.aresolve_links(page()))
+    assert [f["path"] for f in files] == ["https://dl.example/id:a", "dropbox:/b.txt", "https://drive.google.com/file/d/g/view"]
+    asyncio.run(manager.aresolve_links(page()))
+    assert links.calls == ["id:a", "id:broken", "id:broken"] # Working links are reused
+
+
+def test_load_timeout_runs_per_bucket(monkeypatch):
+    bucket_docs = [{"bucket_number": 1, "type": "GoogleDrive"}, {"bucket_number": 2, "type": "GoogleDrive"}, {"bucket_number": 3, "type": "Dropbox"}]
+    database = type("Db", (), {"drives_collection": type("Drives", (), {"find": lambda self, query: bucket_docs})()})()
+    monkeypatch.setattr(drive_manager_module, "Database", lambda: type("Database", (), {"get_instance": lambda self: database})())
+    monkeypatch.setattr(drive_manager_module, "DRIVE_LOAD_WORKERS", 1)
+    monkeypatch.setattr(drive_manager_module, "DRIVE_LOAD_TIMEOUT_SECONDS", 0.3)
+    manager = DriveManager.__new__(DriveManager)
+    manager.user_id, manager.drives, manager.degraded_buckets = "user", [], []
+
+    def load_drive(drive_data):
+        time.sleep(1.0 if drive_data["bucket_number"] == 1 else 0.2) # Bucket 1 hangs; the others each fit their own budget
+        return f"drive-{drive_data['bucket_number']}", 0.2
+    manager._load_drive = load_drive
+
+    manager.load_user_drives()
+    assert manager.drives == ["drive-2", "drive-3"] # Queued behind the stuck bucket, still loaded
+    assert [(b["bucket_number"], b["reason"]) for b in manager.degraded_buckets] == [(1, "timeout")]
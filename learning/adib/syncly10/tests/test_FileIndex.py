@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("pymongo")
+
+from FileIndex import encode_page_cursor, decode_page_cursor
+
+
+def test_page_cursor_round_trip():
+    cursor = encode_page_cursor("report.pdf", "65f1c0ffee0000000000abcd")
+    assert decode_page_cursor(cursor) == ("report.pdf", "65f1c0ffee0000000000abcd")
+
+
+def test_page_cursor_is_url_safe_without_padding():
+    cursor = encode_page_cursor("ünïcode ?&/= name", "GoogleDrive:1a2b")
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+    assert decode_page_cursor(cursor) == ("ünïcode ?&/= name", "GoogleDrive:1a2b")
+
+
+def test_page_cursor_keeps_live_listing_tie_breaker():
+    # The live listing fallback uses "provider:id" instead of an ObjectId
+    assert decode_page_cursor(encode_page_cursor("a.txt", "Dropbox:id:xyz"))[1] == "Dropbox:id:xyz"
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!!", "e30", "bm90IGpzb24"]) # garbage, "{}", "not json"
+def test_malformed_page_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_page_cursor(cursor)
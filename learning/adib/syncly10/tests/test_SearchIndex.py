@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("pymongo")
+
+from SearchIndex import tokenize, catalog_revision, _UserIndex
+
+
+def test_tokenize_lowercases_and_drops_noise():
+    assert tokenize("Quarterly REPORT, v2 (final) a") == ["quarterly", "report", "v2", "final"]
+    assert tokenize("x" * 65 + " ok") == ["ok"]
+    assert tokenize("Überweisung für März") == ["überweisung", "für", "märz"]
+    assert tokenize(None) == [] and tokenize("") == []
+
+
+def test_catalog_revision_prefers_content_hashes():
+    assert catalog_revision({"md5Checksum": "m", "modifiedTime": "t"}) == "m"
+    assert catalog_revision({"content_hash": "h", "modifiedTime": "t"}) == "h"
+    assert catalog_revision({"modifiedTime": "t"}) == "t"
+
+
+def build(docs):
+    index = _UserIndex()
+    for key, terms in docs.items():
+        index.add(key, {"name": key}, [[term, tf] for term, tf in terms.items()])
+    return index
+
+
+def names(results):
+    return [r["name"] for r in results]
+
+
+def test_bm25_ranks_term_frequency_and_rarity():
+    index = build({
+        "budget": {"budget": 5, "plan": 1},
+        "notes": {"budget": 1, "plan": 1},
+        "roadmap": {"plan": 3, "roadmap": 2},
+    })
+    assert names(index.search(["budget"], 10)) == ["budget", "notes"]
+    # "roadmap" is rarer than "plan", so matching it outweighs extra "plan" occurrences elsewhere
+    assert names(index.search(["roadmap", "plan"], 10))[0] == "roadmap"
+    assert index.search(["missing"], 10) == [] and index.search([], 10) == []
+
+
+def test_bm25_prefers_shorter_documents_for_equal_frequency():
+    index = build({"short": {"invoice": 1}, "long": {"invoice": 1, "filler": 50}})
+    assert names(index.search(["invoice"], 10)) == ["short", "long"]
+
+
+def test_bm25_limit_and_scores():
+    index = build({f"doc{i}": {"term": i + 1} for i in range(5)})
+    results = index.search(["term"], 2)
+    assert len(results) == 2 and results[0]["score"] >= results[1]["score"] > 0
+
+
+def test_add_replaces_and_remove_cleans_postings():
+    index = build({"a": {"old": 1}, "b": {"old": 1}})
+    index.add("a", {"name": "a"}, [["new", 2]])
+    assert names(index.search(["old"], 10)) == ["b"]
+    assert names(index.search(["new"], 10)) == ["a"]
+    index.remove("a")
+    index.remove("b")
+    assert index.postings == {} and index.files == {} and index.total_length == 0
+    index.remove("never-added") # No-op
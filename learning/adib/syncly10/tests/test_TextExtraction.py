@@ -0,0 +1,56 @@
+import io
+import zipfile
+
+from TextExtraction import _join_until, _decode_head, head_bytes_for, extract_text
+
+
+def test_join_until_stops_pulling_parts_once_budget_is_met():
+    pulled = []
+
+    def parts():
+        for part in ["aaaa", "bbbb", "cccc", "dddd"]:
+            pulled.append(part)
+            yield part
+
+    assert _join_until(parts(), 9) == "aaaa\nbbbb"
+    assert pulled == ["aaaa", "bbbb"] # The third part was never produced
+
+
+def test_join_until_without_budget_joins_everything():
+    assert _join_until(iter(["a", "b", "c"]), None) == "a\nb\nc"
+    assert _join_until(iter([]), 10) == ""
+
+
+def test_head_bytes_for_plain_text_only():
+    assert head_bytes_for("notes.TXT", 1000) == 4000 # Worst case for UTF-8
+    assert head_bytes_for("notes.txt", None) is None
+    assert head_bytes_for("paper.pdf", 1000) is None
+    assert head_bytes_for("letter.docx", 1000) is None
+
+
+def test_decode_head_drops_a_cut_multibyte_character():
+    raw = "héllo wörld".encode("utf-8")
+    assert _decode_head(raw[:-3], "a.txt") == "héllo wö" # "ö" was cut in half by the ranged download
+
+
+def test_decode_head_falls_back_to_latin1():
+    assert _decode_head(b"caf\xe9 \xff", "a.txt") == "café ÿ"
+
+
+def docx_bytes(paragraphs):
+    ns = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document xmlns:w="{ns}"><w:body>{body}</w:body></w:document>')
+    buffer.seek(0)
+    return buffer
+
+
+def test_docx_extraction_stops_at_budget():
+    text = extract_text(docx_bytes([f"paragraph {i}" for i in range(100)]), "long.docx", max_chars=30)
+    assert text == "paragraph 0\nparagraph 1\nparagraph 2"
+
+
+def test_unsupported_extension_is_skipped():
+    assert extract_text(io.BytesIO(b"\x00\x01"), "image.png") is None
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("pymongo")
+
+import VectorIndex
+from VectorIndex import split_passages
+
+
+@pytest.fixture
+def short_passages(monkeypatch):
+    monkeypatch.setattr(VectorIndex, "VECTOR_PASSAGE_CHARS", 100)
+    monkeypatch.setattr(VectorIndex, "VECTOR_PASSAGE_OVERLAP", 20)
+
+
+TEXT = " ".join(f"word{i}" for i in range(200))
+
+
+def test_split_passages_short_text_is_one_passage(short_passages):
+    assert split_passages("  just a few words  ") == ["just a few words"]
+    assert split_passages("") == [] and split_passages(None) == []
+
+
+def test_split_passages_bounds_and_word_boundaries(short_passages):
+    words = set(TEXT.split())
+    for passage in split_passages(TEXT):
+        assert len(passage) <= 100
+        assert set(passage.split()) <= words # No word cut in half
+
+
+def test_split_passages_cover_text_with_overlap(short_passages):
+    passages = split_passages(TEXT)
+    assert set(" ".join(passages).split()) == set(TEXT.split())
+    for previous, current in zip(passages, passages[1:]):
+        assert previous.split()[-1] in current.split()[:5] # Starts a little before the previous one ended
+
+
+def test_split_passages_terminates_on_unbroken_text(short_passages):
+    passages = split_passages("x" * 350)
+    assert "".join(passages) == "x" * 350 and all(len(p) <= 100 for p in passages)
+
+
+def test_user_vectors_ranks_by_similarity():
+    np = pytest.importorskip("numpy")
+    matrix = np.array([[1, 0], [0.6, 0.8], [0, 1]], dtype=np.float32)
+    vectors = VectorIndex._UserVectors(matrix, [{"name": "a"}, {"name": "b"}, {"name": "c"}], generation=0)
+    results = vectors.search(np.array([1, 0], dtype=np.float32), 2)
+    assert [r["name"] for r in results] == ["a", "b"] and results[0]["score"] == 1.0
+    assert [r["name"] for r in vectors.search(np.array([0, 1], dtype=np.float32), 5)] == ["c", "b"] # "a" is below the threshold
@@ -0,0 +1,42 @@
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def api():
+    pytest.importorskip("fastapi")
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    os.environ.setdefault("API_BASE_URL", "http://testserver")
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # api.py mounts ./static
+    try:
+        return importlib.import_module("api")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 10)),
+    ("bytes=90-", (90, 100)),
+    ("bytes=-5", (95, 100)),
+    ("bytes=95-200", (95, 100)), # End past the file is clamped
+    ("bytes=-500", (0, 100)), # Suffix longer than the file is the whole file
+    (" bytes = 10 - 19 ", (10, 20)),
+])
+def test_parse_range_header(api, header, expected):
+    assert api.parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-9", "bytes=-", "bytes=a-b", "bytes=5-3", "bytes=150-120"])
+def test_parse_range_header_ignores_unsupported_ranges(api, header):
+    assert api.parse_range_header(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=150-160", "bytes=100-100"])
+def test_parse_range_header_rejects_unsatisfiable_ranges(api, header):
+    with pytest.raises(api.HTTPException) as error:
+        api.parse_range_header(header, 100)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */100"